@@ -0,0 +1,249 @@
+"""
+Telemonitor benchmarks. Replays synthetic update streams through the bot dispatcher against local fake Bot API server.
+
+Usage: python -m benchmarks [--updates N] [--concurrency N] [--api-latency MS] [--only NAME [NAME ...]] [--json PATH]
+"""
+import os
+import sys
+import json
+import shutil
+import asyncio
+import argparse
+import tempfile
+from time import perf_counter
+
+from benchmarks.fake_api import FakeTelegramAPI
+
+
+TOKEN = "123456:" + "a" * 35
+WHITELISTED_USERS = list(range(1, 101))
+STRANGER_OFFSET = 1_000_000
+
+
+def parse_args() -> argparse.Namespace:
+    argparser = argparse.ArgumentParser(prog="python -m benchmarks", description="Telemonitor benchmarks with local fake Telegram Bot API server.")
+    argparser.add_argument("--updates", type=int, default=2000, help="amount of updates in each update stream scenario (default: 2000)")
+    argparser.add_argument("--concurrency", type=int, default=100, help="maximum amount of updates processed at the same time (default: 100)")
+    argparser.add_argument("--api-latency", type=float, default=0, metavar="MS", help="delay of fake Bot API responses in milliseconds (default: 0)")
+    argparser.add_argument("--file-size", type=int, default=256, metavar="KB", help="size of files in document scenario in KiB (default: 256)")
+    argparser.add_argument("--only", nargs="+", metavar="NAME", help="run only selected benchmarks")
+    argparser.add_argument("--json", metavar="PATH", help="save results to json file, for comparison between runs")
+    return argparser.parse_args()
+
+
+def rss_mb() -> float:
+    """ Get resident set size of current process in MiB. """
+    try:
+        with open("/proc/self/status", "rt") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    import resource
+    # Peak value on platforms without procfs, in KiB on linux and bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def message_update(update_id: int, user_id: int, **fields) -> dict:
+    message = {"message_id": update_id, "date": 0, "chat": {"id": user_id, "type": "private"}, "from": {"id": user_id, "is_bot": False, "first_name": "bench"}}
+    message.update(fields)
+    return {"update_id": update_id, "message": message}
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {"id": str(update_id), "chat_instance": "1", "data": data, "from": {"id": user_id, "is_bot": False, "first_name": "bench"}}
+    }
+
+
+def stream_start_flood(n: int) -> list:
+    return [message_update(i, WHITELISTED_USERS[i % len(WHITELISTED_USERS)], text="/start") for i in range(n)]
+
+
+def stream_callback_storm(n: int) -> list:
+    return [callback_update(i, WHITELISTED_USERS[i % len(WHITELISTED_USERS)], "button-sysinfo-press") for i in range(n)]
+
+
+def stream_button_mash(n: int) -> list:
+    # Few operators press the same button repeatedly, duplicates must be coalesced
+    return [callback_update(i, WHITELISTED_USERS[i % 5], "button-sysinfo-press") for i in range(n)]
+
+
+def stream_mixed_senders(n: int) -> list:
+    # Every second update is sent by non-whitelisted user and must be dropped by middleware
+    return [message_update(i, WHITELISTED_USERS[i % len(WHITELISTED_USERS)] if i % 2 else STRANGER_OFFSET + i, text="/start") for i in range(n)]
+
+
+def stream_documents(n: int) -> list:
+    # Every file is sent twice, the second copy must be placed from store without download
+    return [
+        message_update(i, WHITELISTED_USERS[i % len(WHITELISTED_USERS)], document={"file_id": f"doc{i // 2}", "file_unique_id": f"doc{i // 2}", "file_name": f"file{i}.bin"})
+        for i in range(n)
+    ]
+
+
+async def replay(dp: object, updates: list, concurrency: int) -> dict:
+    """ Process updates through dispatcher, as polling would do, and measure throughput and latency.
+
+    Args:
+        dp (object): aiogram Dispatcher object.
+        updates (list): Raw updates.
+        concurrency (int): Maximum amount of updates processed at the same time.
+
+    Returns:
+        dict: Benchmark results.
+    """
+    from aiogram import types
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def process(update: types.Update):
+        nonlocal errors
+        async with semaphore:
+            started = perf_counter()
+            try:
+                # Same entry point as polling, so update middlewares run too
+                await dp.updates_handler.notify(update)
+            except Exception:
+                errors += 1
+            latencies.append(perf_counter() - started)
+
+    parsed = [types.Update(**u) for u in updates]
+    started = perf_counter()
+    await asyncio.gather(*(process(u) for u in parsed))
+    elapsed = perf_counter() - started
+
+    return {
+        "updates": len(parsed),
+        "errors": errors,
+        "updates_per_sec": len(parsed) / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "rss_mb": rss_mb()
+    }
+
+
+def micro(func: callable, repeat: int) -> dict:
+    """ Measure average call time of synchronous function. """
+    started = perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = perf_counter() - started
+    return {"calls": repeat, "us_per_call": elapsed / repeat * 1e6, "rss_mb": rss_mb()}
+
+
+async def run(args: argparse.Namespace, api: FakeTelegramAPI) -> dict:
+    from aiogram import Bot, Dispatcher
+    from aiogram.bot.api import TelegramAPIServer
+    from telemonitor import helpers as h
+    from telemonitor.main import setup_dispatcher
+
+    cfg = json.loads(json.dumps(h.DEF_CFG))
+    cfg["bot"]["token"] = TOKEN
+    cfg["bot"]["whitelisted_users"] = WHITELISTED_USERS
+    cfg["file_transfer"]["min_free_space_mb"] = 0
+    h.TM_Config.write(cfg)
+
+    bot = Bot(TOKEN, server=TelegramAPIServer.from_base(api.url))
+    dp = setup_dispatcher(bot, h.TM_Config.model())
+    # Same context as polling sets up, handlers rely on it
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+
+    streams = {
+        "start_flood": stream_start_flood,
+        "callback_storm": stream_callback_storm,
+        "button_mash": stream_button_mash,
+        "mixed_senders": stream_mixed_senders,
+        "documents": stream_documents
+    }
+    from telemonitor.extensions.metrics import processes
+    from telemonitor.extensions.store import TM_Store
+
+    TM_Store.start()
+
+    # Every call must do the full scan instead of returning result of the previous one
+    processes.SCAN_MIN_INTERVAL = 0
+    micros = {
+        "is_whitelisted": (lambda: h.TM_Whitelist.is_whitelisted(WHITELISTED_USERS[-1]), 100_000),
+        "construct_sysinfo": (h.construct_sysinfo, 200),
+        "process_scan": (processes.TM_Processes.scan, 50)
+    }
+    selected = set(args.only) if args.only else set(streams) | set(micros) | {"store_flood", "send_to_all"}
+    results = {}
+
+    for name, (func, repeat) in micros.items():
+        if name in selected:
+            results[name] = micro(func, repeat)
+
+    for name, stream in streams.items():
+        if name in selected:
+            api.calls.clear()
+            results[name] = await replay(dp, stream(args.updates), args.concurrency)
+            results[name]["api_calls"] = sum(api.calls.values())
+
+    if "store_flood" in selected:
+        started = perf_counter()
+        # Sustained write rate, including commits of the background writer
+        for i in range(50_000):
+            TM_Store.audit(i % 100, "benchmark")
+        TM_Store.flush()
+        elapsed = perf_counter() - started
+        results["store_flood"] = {"rows": 50_000, "rows_per_sec": 50_000 / elapsed, "dropped": TM_Store.stats()[1], "rss_mb": rss_mb()}
+
+    if "send_to_all" in selected:
+        api.calls.clear()
+        started = perf_counter()
+        # Whole whitelist is delivered with rate limits, so only first global burst is measured
+        await h.TM_Broadcast.send(bot, WHITELISTED_USERS[:h.BROADCAST_RATE_GLOBAL], "benchmark")
+        elapsed = perf_counter() - started
+        results["send_to_all"] = {"users": h.BROADCAST_RATE_GLOBAL, "ms": elapsed * 1000, "api_calls": sum(api.calls.values()), "rss_mb": rss_mb()}
+
+    TM_Store.stop()
+    await (await bot.get_session()).close()
+    return results
+
+
+def print_results(results: dict):
+    for name, result in results.items():
+        print(f"{name:<20} " + "  ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in result.items()))
+
+
+def main():
+    args = parse_args()
+
+    api = FakeTelegramAPI(latency=args.api_latency / 1000, file_size=args.file_size * 1024)
+    api.start()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    cwd = os.getcwd()
+    # Config file and shared dir are created in working directory
+    workdir = tempfile.mkdtemp(prefix="telemonitor-bench-")
+    os.chdir(workdir)
+    try:
+        results = asyncio.run(run(args, api))
+    finally:
+        api.stop()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"Python {sys.version.split()[0]}, {args.updates} updates per stream, concurrency {args.concurrency}, api latency {args.api_latency} ms")
+    print_results(results)
+    if json_path:
+        with open(json_path, "wt") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Local stand-in for Telegram Bot API server, used by benchmarks instead of `api.telegram.org`
+"""
+import asyncio
+import hashlib
+import threading
+from collections import Counter
+
+from aiohttp import web
+
+
+class FakeTelegramAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0, file_size: int = 256 * 1024):
+        """ Minimal Bot API server, that answers all requests with canned results.
+
+        Server is run in a separate thread with its own event loop, so its work isn't accounted to bot handlers latency.
+
+        Args:
+            host (str, optional): Address to listen on. Defaults to "127.0.0.1".
+            port (int, optional): Port to listen on. Defaults to random free port.
+            latency (float, optional): Delay (in seconds) added to each response, emulating network round trip. Defaults to 0.
+            file_size (int, optional): Size of downloaded files in bytes. Defaults to 256 KiB.
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.file_size = file_size
+        self.calls = Counter()
+        self.__message_id = 0
+        self.__loop = None
+        self.__runner = None
+        self.__thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> str:
+        """ Start server thread.
+
+        Returns:
+            str: Base url of server, for `TelegramAPIServer.from_base`.
+        """
+        started = threading.Event()
+        self.__loop = asyncio.new_event_loop()
+
+        def serve():
+            asyncio.set_event_loop(self.__loop)
+            self.__loop.run_until_complete(self.__start_site())
+            started.set()
+            self.__loop.run_forever()
+            self.__loop.run_until_complete(self.__runner.cleanup())
+            self.__loop.close()
+
+        self.__thread = threading.Thread(target=serve, name="FakeTelegramAPI", daemon=True)
+        self.__thread.start()
+        started.wait()
+        return self.url
+
+    def stop(self):
+        """ Stop server thread. """
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+
+    async def __start_site(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.__handle_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.__handle_file)
+
+        self.__runner = web.AppRunner(app, access_log=None)
+        await self.__runner.setup()
+        site = web.TCPSite(self.__runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def __handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        data = await request.post()
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method in ("sendMessage", "sendDocument", "editMessageText"):
+            self.__message_id += 1
+            result = {
+                "message_id": self.__message_id,
+                "date": 0,
+                "chat": {"id": int(data.get("chat_id", 0)), "type": "private"},
+                "text": data.get("text", "")
+            }
+            if method == "sendDocument":
+                result["document"] = {"file_id": f"sent{self.__message_id}", "file_unique_id": f"sent{self.__message_id}"}
+        elif method == "getFile":
+            file_id = data["file_id"]
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_size": self.file_size, "file_path": f"documents/{file_id}"}
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+        else:
+            result = True
+
+        return web.json_response({"ok": True, "result": result})
+
+    async def __handle_file(self, request: web.Request) -> web.Response:
+        self.calls["file"] += 1
+        # Content depends on path only, so the same file is always downloaded with the same hash
+        seed = hashlib.sha256(request.match_info["path"].encode()).digest()
+        body = (seed * (self.file_size // len(seed) + 1))[:self.file_size]
+        return web.Response(body=body, content_type="application/octet-stream")
@@ -0,0 +1,188 @@
+import re
+import asyncio
+import operator
+from collections import deque
+from logging import getLogger
+
+from aiogram.utils.markdown import bold, code
+
+from telemonitor.helpers import TM_Config, TM_Whitelist
+from telemonitor.extensions.metrics import parse_duration
+
+
+RULE_PATTERN = re.compile(
+    r"^\s*(?P<metric>[^\s<>=]+)"
+    r"(?:\s+avg\s+(?P<window>\S+))?"
+    r"\s*(?P<op><=|>=|<|>)\s*(?P<threshold>-?\d+(?:\.\d+)?)%?"
+    r"(?:\s+for\s+(?P<duration>\S+))?"
+    r"(?:\s+clear\s+(?P<clear>-?\d+(?:\.\d+)?)%?)?\s*$"
+)
+OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le
+}
+
+
+class TM_AlertRule:
+    def __init__(self, rule: str):
+        """ Threshold alert rule with debounce and hysteresis.
+
+        Rule format is `<metric> [avg <window>] <op> <threshold> [for <duration>] [clear <threshold>]`,
+        for example `cpu > 90 for 2m clear 70` or `disk_free:/ < 5`.
+
+        Args:
+            rule (str): Rule string.
+
+        Raises:
+            ValueError: Rule string is malformed.
+        """
+        match = RULE_PATTERN.match(rule)
+        if match is None:
+            raise ValueError(f"Malformed alert rule '{rule}'")
+
+        self.rule = rule.strip()
+        self.metric = match["metric"]
+        self.value = None
+        self.active = False
+
+        self.__compare = OPERATORS[match["op"]]
+        self.__threshold = float(match["threshold"])
+        self.__clear = float(match["clear"]) if match["clear"] is not None else self.__threshold
+        self.__duration = parse_duration(match["duration"]) if match["duration"] else 0
+        self.__window = parse_duration(match["window"]) if match["window"] else 0
+        self.__since = None
+        self.__samples = deque()
+        self.__sum = 0.0
+
+    def evaluate(self, t: float, value: float) -> str:
+        """ Update rule state with new metric sample.
+
+        Args:
+            t (float): Unix timestamp of sample.
+            value (float): Metric value.
+
+        Returns:
+            str:
+                'fire' - Alert was triggered with this sample.
+                'resolve' - Active alert was resolved with this sample.
+                None - Alert state wasn't changed.
+        """
+        if self.__window:
+            # Running sum over sliding window, amortized O(1) per sample
+            self.__samples.append((t, value))
+            self.__sum += value
+            while self.__samples[0][0] <= t - self.__window:
+                self.__sum -= self.__samples.popleft()[1]
+            value = self.__sum / len(self.__samples)
+
+        self.value = value
+
+        if not self.active:
+            if not self.__compare(value, self.__threshold):
+                self.__since = None
+                return None
+
+            if self.__since is None:
+                self.__since = t
+            if t - self.__since >= self.__duration:
+                self.active = True
+                return 'fire'
+
+        elif not self.__compare(value, self.__clear):
+            self.active = False
+            self.__since = None
+            return 'resolve'
+
+        return None
+
+
+class TM_Alerts:
+    """ Incremental threshold alerting on metrics samples """
+    __logger = getLogger(__name__)
+    __rules = {}
+    __bot = None
+    # Notifications in progress, references are kept until they are done
+    __tasks = set()
+
+    @classmethod
+    def start(cls, bot: object) -> int:
+        """ Load alert rules from config file. Should be followed by subscribing `TM_Alerts.evaluate` with `TM_Metrics.add_listener`.
+
+        Args:
+            bot (object): aiogram Bot object, used for notifications delivery.
+
+        Returns:
+            int: Amount of loaded rules.
+        """
+        cfg = TM_Config.model().alerts
+        cls.__bot = bot
+        cls.__rules = {}
+        count = 0
+
+        for rule_str in cfg.rules:
+            try:
+                rule = TM_AlertRule(rule_str)
+            except ValueError as e:
+                cls.__logger.error(str(e))
+            else:
+                cls.__rules.setdefault(rule.metric, []).append(rule)
+                count += 1
+
+        cls.__logger.info(f"Loaded {count} alert rule(-s)")
+        return count
+
+    @classmethod
+    def evaluate(cls, snapshot: dict) -> list:
+        """ Evaluate all rules against new metrics snapshot and send notification on alert state changes.
+
+        Args:
+            snapshot (dict): Metrics snapshot.
+
+        Returns:
+            list: List of (event, rule) tuples for changed rules.
+        """
+        t = snapshot["time"]
+        events = []
+
+        for metric, rules in cls.__rules.items():
+            value = snapshot.get(metric)
+            if value is None:
+                continue
+
+            for rule in rules:
+                event = rule.evaluate(t, value)
+                if event is not None:
+                    events.append((event, rule))
+
+        if events:
+            cls.__logger.info(f"Alert state changed: {', '.join(f'{e} [{r.rule}]' for e, r in events)}")
+            if cls.__bot is not None:
+                task = asyncio.ensure_future(TM_Whitelist.send_to_all(cls.__bot, cls.render(events)))
+                cls.__tasks.add(task)
+                task.add_done_callback(cls.__done)
+
+        return events
+
+    @classmethod
+    def __done(cls, task: asyncio.Task):
+        cls.__tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            cls.__logger.error(f"Alert notification failed: < {str(task.exception())} >")
+
+    @staticmethod
+    def render(events: list) -> str:
+        """ Render notification message for alert state changes.
+
+        Args:
+            events (list): List of (event, rule) tuples.
+
+        Returns:
+            str: Formatted message, ready for Telegram.
+        """
+        lines = []
+        for event, rule in events:
+            title = "🔴 Alert" if event == 'fire' else "🟢 Resolved"
+            lines.append(f"{bold(title)}: {code(rule.rule)} {code(f'(value: {rule.value:.2f})')}")
+        return "\n".join(lines)
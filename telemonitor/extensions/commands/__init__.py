@@ -0,0 +1,263 @@
+import os
+import shlex
+import signal
+import asyncio
+import tempfile
+from time import monotonic
+from logging import getLogger
+
+from aiogram import Bot
+from aiogram.types import InputFile
+from aiogram.utils.markdown import bold, code, italic, pre
+from aiogram.utils.exceptions import MessageNotModified, RetryAfter, TelegramAPIError
+
+from telemonitor.helpers import TM_Config, TM_Offload, PARSE_MODE
+
+
+READ_SIZE = 64 * 1024
+# Output is written to disk in blocks of this size, so chatty commands aren't buffered in memory
+SPOOL_BLOCK = 64 * 1024
+# Output over this size isn't saved, but process keeps running until it exits or times out
+OUTPUT_MAX = 20 * 1024 * 1024
+# Only the end of output is shown in message, the whole output is sent as document
+MESSAGE_TAIL = 3000
+EDIT_INTERVAL = 2
+# Killed process can leave its pipe open in descendants, that moved to other session, so waiting for it is limited too
+KILL_WAIT = 5
+USAGE = "Usage: /run <command> [arguments]"
+
+
+def parse_command(args: str, allowlist: list) -> list:
+    """ Split `/run` command arguments and check them against allowlist.
+
+    Command is allowed if it starts with all words of any allowlist entry, so entry `systemctl status`
+    allows `systemctl status nginx`, but not `systemctl stop nginx`.
+
+    Args:
+        args (str): Command arguments.
+        allowlist (list): Allowed commands.
+
+    Raises:
+        ValueError: Command is empty, malformed or not allowed.
+
+    Returns:
+        list: Command and its arguments.
+    """
+    try:
+        argv = shlex.split(args)
+    except ValueError as e:
+        raise ValueError(f"Can't parse command: {str(e)}")
+    if not argv:
+        raise ValueError(USAGE)
+
+    for entry in allowlist:
+        allowed = shlex.split(entry)
+        if allowed and argv[:len(allowed)] == allowed:
+            return argv
+    raise ValueError(f"Command {argv[0]} is not allowed")
+
+
+class TM_CommandOutput:
+    def __init__(self):
+        """ Output of running command: tail for message and the whole output spooled to temporary file """
+        self.size = 0
+        self.tail = b""
+        self.__block = bytearray()
+        self.__file = None
+
+    async def add(self, data: bytes):
+        """ Append output chunk.
+
+        Args:
+            data (bytes): Output chunk.
+        """
+        self.tail = (self.tail + data)[-MESSAGE_TAIL * 4:]
+        if self.size < OUTPUT_MAX:
+            self.__block += data[:OUTPUT_MAX - self.size]
+            if len(self.__block) >= SPOOL_BLOCK:
+                await self.__flush()
+        self.size += len(data)
+
+    def text(self) -> str:
+        """ Get the end of output as text.
+
+        Returns:
+            str: Up to MESSAGE_TAIL last characters.
+        """
+        text = self.tail.decode(errors="replace")
+        return text if self.is_complete() else "…" + text[-MESSAGE_TAIL:]
+
+    def is_complete(self) -> bool:
+        """ Check if the whole output fits into message.
+
+        Returns:
+            bool: Output isn't cut.
+        """
+        return self.size == len(self.tail) and len(self.tail.decode(errors="replace")) <= MESSAGE_TAIL
+
+    async def file(self) -> object:
+        """ Get the whole output as file, rewound to the start.
+
+        Returns:
+            object: Binary file object.
+        """
+        await self.__flush()
+        await TM_Offload.run(self.__file.seek, 0)
+        return self.__file
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+
+    async def __flush(self):
+        if self.__file is None:
+            self.__file = await TM_Offload.run(tempfile.TemporaryFile)
+        if self.__block:
+            block, self.__block = bytes(self.__block), bytearray()
+            await TM_Offload.run(self.__file.write, block)
+
+
+class TM_CommandRunner:
+    """ Runs allowlisted system commands and streams their output to chat by editing single message """
+    __logger = getLogger(__name__)
+    __tasks = set()
+
+    @classmethod
+    def start(cls, bot: Bot, chat_id: int, argv: list) -> asyncio.Task:
+        """ Start command in background, showing its output in message, that is updated every EDIT_INTERVAL seconds.
+
+        Command doesn't hold the queue of user's updates, so bot stays responsive while it runs.
+
+        Args:
+            bot (Bot): aiogram Bot object.
+            chat_id (int): Chat to send output to.
+            argv (list): Command and its arguments, already checked with `parse_command`.
+
+        Raises:
+            ValueError: Too many commands are already running.
+
+        Returns:
+            asyncio.Task: Task, that runs command.
+        """
+        cfg = TM_Config.model().commands
+        if len(cls.__tasks) >= cfg.max_concurrent:
+            raise ValueError(f"{len(cls.__tasks)} commands are already running, try again later")
+
+        task = asyncio.get_event_loop().create_task(cls.__run(bot, chat_id, argv, cfg.timeout))
+        cls.__tasks.add(task)
+        task.add_done_callback(cls.__done)
+        return task
+
+    @classmethod
+    def stop(cls):
+        """ Cancel all running commands. Their processes are killed. """
+        for task in list(cls.__tasks):
+            task.cancel()
+
+    @classmethod
+    def running(cls) -> int:
+        """ Get amount of running commands.
+
+        Returns:
+            int: Amount of commands.
+        """
+        return len(cls.__tasks)
+
+    @classmethod
+    def __done(cls, task: asyncio.Task):
+        cls.__tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            cls.__logger.error(f"Command runner failed: < {str(task.exception())} >")
+
+    @classmethod
+    async def __run(cls, bot: Bot, chat_id: int, argv: list, timeout: float):
+        command = " ".join(shlex.quote(a) for a in argv)
+        started = monotonic()
+        output = TM_CommandOutput()
+        message = await bot.send_message(chat_id, cls.__render(command, output, italic("Running")), parse_mode=PARSE_MODE)
+        shown = None
+
+        cls.__logger.info(f"Running command: {command}")
+        try:
+            # Own session makes command the leader of process group, so its children are killed together with it
+            process = await asyncio.create_subprocess_exec(
+                *argv, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, stdin=asyncio.subprocess.DEVNULL, start_new_session=True
+            )
+        except OSError as e:
+            await cls.__edit(bot, message, cls.__render(command, output, italic(f"Can't start: {str(e)}")))
+            return
+
+        status = None
+        deadline = started + timeout
+        next_edit = started + EDIT_INTERVAL
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(process.stdout.read(READ_SIZE), max(deadline - monotonic(), 0))
+                except asyncio.TimeoutError:
+                    status = cls.__timed_out(process, command, timeout)
+                    break
+                if not chunk:
+                    break
+
+                await output.add(chunk)
+                # Output is coalesced into single edit per interval, however fast it's printed
+                if monotonic() >= next_edit:
+                    text = cls.__render(command, output, italic(f"Running for {monotonic() - started:.0f} s"))
+                    if text != shown:
+                        next_edit = monotonic() + await cls.__edit(bot, message, text)
+                        shown = text
+
+            if status is None:
+                # Command can close its output and keep running, so the same deadline applies to its exit
+                try:
+                    returncode = await asyncio.wait_for(process.wait(), max(deadline - monotonic(), 0))
+                    status = f"Exit code {returncode}, {monotonic() - started:.1f} s"
+                except asyncio.TimeoutError:
+                    status = cls.__timed_out(process, command, timeout)
+            await cls.__edit(bot, message, cls.__render(command, output, italic(status)))
+
+            if not output.is_complete():
+                note = "" if output.size <= OUTPUT_MAX else f" (first {OUTPUT_MAX} of {output.size} bytes)"
+                await bot.send_document(chat_id, InputFile(await output.file(), filename="output.txt"), caption=f"Output of {command}{note}")
+        finally:
+            if process.returncode is None:
+                cls.__kill(process)
+                try:
+                    await asyncio.wait_for(process.wait(), KILL_WAIT)
+                except asyncio.TimeoutError:
+                    cls.__logger.error(f"Command '{command}' didn't exit after it was killed")
+            output.close()
+
+    @classmethod
+    def __timed_out(cls, process: asyncio.subprocess.Process, command: str, timeout: float) -> str:
+        """ Kill command on timeout. Returns status line. """
+        cls.__kill(process)
+        cls.__logger.warning(f"Command '{command}' was killed after {timeout} seconds timeout")
+        return f"Killed after {timeout} seconds timeout"
+
+    @staticmethod
+    def __kill(process: asyncio.subprocess.Process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            # The whole group has already exited
+            pass
+
+    @classmethod
+    async def __edit(cls, bot: Bot, message: object, text: str) -> float:
+        """ Edit output message. Returns delay before the next edit. """
+        try:
+            await bot.edit_message_text(text, message.chat.id, message.message_id, parse_mode=PARSE_MODE)
+        except MessageNotModified:
+            pass
+        except RetryAfter as e:
+            return max(e.timeout, EDIT_INTERVAL)
+        except TelegramAPIError as e:
+            cls.__logger.error(f"Can't update command output message: < {str(e)} >")
+        return EDIT_INTERVAL
+
+    @staticmethod
+    def __render(command: str, output: TM_CommandOutput, status: str) -> str:
+        text = output.text()
+        return f"{bold('$')} {code(command)}\n{pre(text) if text else italic('No output')}\n{status}"
@@ -0,0 +1,218 @@
+import asyncio
+from functools import partial
+from time import monotonic
+from logging import getLogger
+
+from aiogram import types, Dispatcher, Bot
+from aiogram.utils.markdown import italic
+from aiogram.utils.exceptions import MessageNotModified, RetryAfter, TelegramAPIError, BadRequest
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from telemonitor.helpers import TM_Whitelist, TM_Config, TM_Offload, TM_ResponseCache, PARSE_MODE, construct_sysinfo
+
+
+# Dashboard is stopped after this time (in seconds) without presses of its buttons
+DASHBOARD_TTL = 600
+DASHBOARD_MAX = 20
+# Edits per second of all dashboards together, so replies to commands aren't delayed by flood control
+DASHBOARD_EDIT_RATE = 5
+# Refresh interval is multiplied by this factor on each flood control error, up to the limit
+SLOWDOWN_MAX = 8
+FOOTER_LIVE = italic("Live view, updated automatically")
+FOOTER_STOPPED = italic("Live view stopped")
+
+
+class TM_DashboardState:
+    def __init__(self, chat_id: int, message_id: int):
+        """ Dashboard message, that is updated in place.
+
+        Args:
+            chat_id (int): Chat of message.
+            message_id (int): Message id.
+        """
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = None
+        self.expires = monotonic() + DASHBOARD_TTL
+
+
+class TM_Dashboard:
+    """ Live system information messages, edited in place on each new metrics sample """
+    __logger = getLogger(__name__)
+    __bot = None
+    __dashboards = {}
+    __task = None
+    __slowdown = 1
+    __edits = 0
+    __suppressed = 0
+
+    @classmethod
+    def setup(cls, bot: Bot, dispatcher: Dispatcher, control_keyboard: object):
+        """ Add `Live` button to control panel and register dashboard handlers.
+
+        Args:
+            bot (Bot): aiogram Bot object.
+            dispatcher (Dispatcher): aiogram Dispatcher object.
+            control_keyboard (object): `TM_ControlInlineKB` object.
+        """
+        cls.__bot = bot
+        control_keyboard.keyboard.add(InlineKeyboardButton('Live', callback_data='dashboard-open'))
+
+        @dispatcher.callback_query_handler(lambda c: c.data.startswith('dashboard-'))
+        async def __callback_dashboard(callback_query: types.CallbackQuery):
+            if not TM_Whitelist.is_whitelisted(callback_query.from_user.id): return False
+
+            await bot.answer_callback_query(callback_query.id)
+            if callback_query.data == 'dashboard-open':
+                await cls.open(callback_query.from_user.id)
+            elif callback_query.data == 'dashboard-extend' and callback_query.message is not None:
+                dashboard = cls.__dashboards.get(callback_query.message.chat.id)
+                if dashboard is not None and dashboard.message_id == callback_query.message.message_id:
+                    dashboard.expires = monotonic() + DASHBOARD_TTL
+            elif callback_query.data == 'dashboard-stop' and callback_query.message is not None:
+                dashboard = cls.__dashboards.get(callback_query.message.chat.id)
+                if dashboard is not None and dashboard.message_id == callback_query.message.message_id:
+                    await cls.__close(dashboard)
+
+    @classmethod
+    async def open(cls, chat_id: int):
+        """ Send new dashboard to chat. Previous dashboard of the chat is stopped.
+
+        Args:
+            chat_id (int): Chat to send to.
+        """
+        previous = cls.__dashboards.get(chat_id)
+        if previous is not None:
+            await cls.__close(previous)
+        elif len(cls.__dashboards) >= DASHBOARD_MAX:
+            # The oldest dashboard gives place to the new one
+            await cls.__close(min(cls.__dashboards.values(), key=lambda d: d.expires))
+
+        text = cls.__render(await TM_ResponseCache.get('sysinfo', partial(TM_Offload.run, construct_sysinfo)))
+        message = await cls.__bot.send_message(chat_id, text, parse_mode=PARSE_MODE, reply_markup=cls.__keyboard())
+        dashboard = cls.__dashboards[chat_id] = TM_DashboardState(chat_id, message.message_id)
+        dashboard.text = text
+
+        if cls.__task is None:
+            cls.__task = asyncio.get_event_loop().create_task(cls.__loop())
+
+    @classmethod
+    def stop(cls):
+        """ Cancel refresh task. Dashboard messages are left as is. """
+        if cls.__task is not None:
+            cls.__task.cancel()
+            cls.__task = None
+        cls.__dashboards.clear()
+
+    @classmethod
+    def count(cls) -> int:
+        """ Get amount of open dashboards.
+
+        Returns:
+            int: Amount of dashboards.
+        """
+        return len(cls.__dashboards)
+
+    @classmethod
+    def stats(cls) -> tuple:
+        """ Get counters of dashboard refreshes.
+
+        Returns:
+            tuple: (
+                int,  # sent edits
+                int   # edits skipped, because text wasn't changed
+            )
+        """
+        return cls.__edits, cls.__suppressed
+
+    @classmethod
+    def interval(cls) -> float:
+        """ Get current refresh interval.
+
+        Text changes only with new metrics sample, so it's never refreshed more often than sampled.
+        Interval grows with the amount of dashboards and after flood control errors.
+
+        Returns:
+            float: Interval in seconds.
+        """
+        return max(TM_Config.model().metrics.sample_interval, len(cls.__dashboards) / DASHBOARD_EDIT_RATE) * cls.__slowdown
+
+    @classmethod
+    async def __loop(cls):
+        try:
+            while cls.__dashboards:
+                await asyncio.sleep(cls.interval())
+                throttled = await cls.__refresh()
+
+                if not throttled and cls.__slowdown > 1:
+                    cls.__slowdown //= 2
+        finally:
+            if cls.__task is asyncio.current_task():
+                cls.__task = None
+
+    @classmethod
+    async def __refresh(cls) -> bool:
+        """ Edit all dashboards with changed text. Returns True if refresh was interrupted by flood control. """
+        sysinfo = await TM_ResponseCache.get('sysinfo', partial(TM_Offload.run, construct_sysinfo))
+        text = cls.__render(sysinfo)
+        now = monotonic()
+
+        for dashboard in list(cls.__dashboards.values()):
+            if now >= dashboard.expires:
+                await cls.__close(dashboard)
+                continue
+
+            if dashboard.text == text:
+                cls.__suppressed += 1
+                continue
+
+            try:
+                await cls.__bot.edit_message_text(text, dashboard.chat_id, dashboard.message_id, parse_mode=PARSE_MODE, reply_markup=cls.__keyboard())
+            except MessageNotModified:
+                cls.__suppressed += 1
+            except RetryAfter as e:
+                cls.__slowdown = min(cls.__slowdown * 2, SLOWDOWN_MAX)
+                cls.__logger.warning(f"Dashboard refresh is throttled by flood control for {e.timeout} seconds, slowing down {cls.__slowdown}x")
+                await asyncio.sleep(e.timeout)
+                return True
+            except BadRequest as e:
+                # Message was deleted or is too old to be edited
+                cls.__logger.info(f"Dashboard in chat [{dashboard.chat_id}] was dropped: < {str(e)} >")
+                cls.__forget(dashboard)
+                continue
+            except TelegramAPIError as e:
+                cls.__logger.error(f"Can't refresh dashboard in chat [{dashboard.chat_id}]: < {str(e)} >")
+                continue
+            else:
+                cls.__edits += 1
+            dashboard.text = text
+            # Edits are spread in time instead of single burst
+            await asyncio.sleep(1 / DASHBOARD_EDIT_RATE)
+
+        return False
+
+    @classmethod
+    async def __close(cls, dashboard: TM_DashboardState):
+        cls.__forget(dashboard)
+        try:
+            await cls.__bot.edit_message_text(
+                dashboard.text.rsplit("\n\n", 1)[0] + "\n\n" + FOOTER_STOPPED, dashboard.chat_id, dashboard.message_id, parse_mode=PARSE_MODE
+            )
+        except TelegramAPIError as e:
+            cls.__logger.debug(f"Can't mark dashboard in chat [{dashboard.chat_id}] as stopped: < {str(e)} >")
+
+    @classmethod
+    def __forget(cls, dashboard: TM_DashboardState):
+        if cls.__dashboards.get(dashboard.chat_id) is dashboard:
+            del cls.__dashboards[dashboard.chat_id]
+
+    @staticmethod
+    def __render(sysinfo: str) -> str:
+        return f"{sysinfo}\n\n{FOOTER_LIVE}"
+
+    @staticmethod
+    def __keyboard() -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup().row(
+            InlineKeyboardButton('Keep Alive', callback_data='dashboard-extend'),
+            InlineKeyboardButton('Stop', callback_data='dashboard-stop')
+        )
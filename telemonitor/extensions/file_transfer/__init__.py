@@ -0,0 +1,410 @@
+import os
+import io
+import json
+import shutil
+import asyncio
+import hashlib
+import tempfile
+import threading
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+
+from telemonitor.helpers import TM_Config, TM_Offload, PATH_SHARED_DIR, init_shared_dir
+from telemonitor.extensions.metrics import format_bytes
+
+
+DIR_STORE = ".store"
+DIR_BLOBS = "blobs"
+FILE_INDEX = "index.json"
+# Visible files are hard links to blobs, so blobs are read-only to keep them from being edited in place
+BLOB_MODE = 0o444
+# Suffix of files being downloaded to store dir
+PART_SUFFIX = ".part"
+# Downloaded chunks, waiting to be written. Download is paused when disk is slower than network
+WRITER_MAX_PENDING = 8
+
+
+class TM_FileTransferError(Exception):
+    pass
+
+
+class TM_HashingWriter(io.RawIOBase):
+    def __init__(self, file: object):
+        """ Writable file wrapper, that computes sha256 of all written data.
+
+        Chunks are hashed and written in background thread in the order of `write` calls,
+        so the download loop only queues them. At most `WRITER_MAX_PENDING` chunks are queued,
+        `write` waits for the oldest one over the limit. Call `drain` to wait for all queued chunks.
+
+        Args:
+            file (object): Binary file object opened for writing.
+        """
+        self.__file = file
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="TM_HashingWriter")
+        self.__pending = None
+        self.__slots = threading.Semaphore(WRITER_MAX_PENDING)
+        self.__error = None
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        data = bytes(data)
+        self.size += len(data)
+        self.__slots.acquire()
+        self.__pending = self.__executor.submit(self.__write, data)
+        return len(data)
+
+    def flush(self):
+        # Chunks are flushed by `drain`
+        pass
+
+    async def drain(self):
+        """ Wait until all queued chunks are hashed and written, then stop the background thread.
+
+        Raises:
+            OSError: Writing of any chunk failed.
+        """
+        if self.__pending is not None:
+            await asyncio.wrap_future(self.__pending)
+        await asyncio.wrap_future(self.__executor.submit(self.__file.flush))
+        self.__executor.shutdown(wait=False)
+        if self.__error is not None:
+            raise self.__error
+
+    def __write(self, data: bytes):
+        try:
+            if self.__error is None:
+                self.hash.update(data)
+                self.__file.write(data)
+        except OSError as e:
+            self.__error = e
+        finally:
+            self.__slots.release()
+
+
+class TM_SharedStore:
+    """ Content-addressed storage behind the shared dir.
+
+    Each unique file content is stored once as `.store/blobs/<sha256>` and user-visible files
+    in shared dir are hard links to blobs. Index maps Telegram `file_unique_id` and visible file names to blobs.
+    Blob content is checked against its digest before reuse, and blobs that were modified anyway are evicted.
+    """
+    __logger = getLogger(__name__)
+    __index = None
+    # Stat signatures of blobs with checked content, so unchanged blobs aren't hashed again
+    __verified = {}
+    # Store methods are run in `TM_Offload` thread pool, so index access is serialized
+    __lock = threading.RLock()
+
+    @classmethod
+    def lookup(cls, file_unique_id: str) -> str:
+        """ Get blob path of already downloaded Telegram file.
+
+        Args:
+            file_unique_id (str): Telegram file unique id.
+
+        Returns:
+            str: Path to blob or None if file is unknown or its blob was modified.
+        """
+        with cls.__lock:
+            digest = cls.__get_index()["unique_ids"].get(file_unique_id)
+        if digest is None:
+            return None
+
+        path = cls.__blob_path(digest)
+        if not os.path.isfile(path):
+            return None
+        if not cls.__verify(path):
+            with cls.__lock:
+                cls.__evict(digest)
+            return None
+        return path
+
+    @classmethod
+    def add_blob(cls, tmp_path: str, digest: str, file_unique_id: str) -> str:
+        """ Move downloaded file into store, dropping it if the same content is already stored.
+
+        Index is saved by the following `place` call.
+
+        Args:
+            tmp_path (str): Path of downloaded temporary file.
+            digest (str): sha256 hex digest of file content.
+            file_unique_id (str): Telegram file unique id.
+
+        Returns:
+            str: Path to blob.
+        """
+        path = cls.__blob_path(digest)
+        with cls.__lock:
+            if os.path.isfile(path) and cls.__verify(path):
+                cls.__logger.info(f"Content of file [{file_unique_id}] is already stored, new copy was dropped")
+            else:
+                if os.path.isfile(path):
+                    cls.__evict(digest)
+                os.replace(tmp_path, path)
+                os.chmod(path, BLOB_MODE)
+
+            cls.__get_index()["unique_ids"][file_unique_id] = digest
+        return path
+
+    @classmethod
+    def place(cls, blob_path: str, file_name: str) -> str:
+        """ Make blob visible in shared dir without overwriting other files.
+
+        Args:
+            blob_path (str): Path to blob.
+            file_name (str): Requested path, relative to shared dir.
+
+        Returns:
+            str: Actual path, suffixed with number if requested one is taken by other content.
+        """
+        path = os.path.join(PATH_SHARED_DIR, file_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        root, ext = os.path.splitext(path)
+        n = 0
+
+        while True:
+            candidate = path if n == 0 else f"{root} ({n}){ext}"
+            n += 1
+
+            try:
+                # Hard link creation fails if target exists, so there's no check-then-replace race
+                os.link(blob_path, candidate)
+            except FileExistsError:
+                if cls.__same_content(blob_path, candidate):
+                    break
+                continue
+            except OSError:
+                # Filesystem doesn't support hard links
+                if os.path.exists(candidate):
+                    if cls.__same_content(blob_path, candidate):
+                        break
+                    continue
+                shutil.copyfile(blob_path, candidate)
+            break
+
+        with cls.__lock:
+            cls.__get_index()["names"][os.path.relpath(candidate, PATH_SHARED_DIR)] = os.path.basename(blob_path)
+            cls.__save_index()
+        return candidate
+
+    @classmethod
+    def collect_garbage(cls) -> int:
+        """ Remove index entries of deleted files and blobs, that are no longer visible in shared dir.
+
+        Returns:
+            int: Amount of removed blobs.
+        """
+        with cls.__lock:
+            index = cls.__get_index()
+            index["names"] = {name: digest for name, digest in index["names"].items() if os.path.isfile(os.path.join(PATH_SHARED_DIR, name))}
+            used = set(index["names"].values())
+            index["unique_ids"] = {uid: digest for uid, digest in index["unique_ids"].items() if digest in used}
+
+            removed = 0
+            blobs_dir = os.path.join(PATH_SHARED_DIR, DIR_STORE, DIR_BLOBS)
+            for digest in os.listdir(blobs_dir):
+                if digest not in used:
+                    os.remove(os.path.join(blobs_dir, digest))
+                    removed += 1
+
+            cls.__save_index()
+            if removed:
+                cls.__logger.info(f"Removed {removed} unused blob(-s) from shared dir store")
+        return removed
+
+    @classmethod
+    def tmp_dir(cls) -> str:
+        """ Get dir for temporary files, located on the same filesystem with blobs.
+
+        Returns:
+            str: Path to dir.
+        """
+        with cls.__lock:
+            cls.__get_index()
+        return os.path.join(PATH_SHARED_DIR, DIR_STORE)
+
+    @staticmethod
+    def __blob_path(digest: str) -> str:
+        return os.path.join(PATH_SHARED_DIR, DIR_STORE, DIR_BLOBS, digest)
+
+    @staticmethod
+    def __hash_file(path: str) -> str:
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @classmethod
+    def __same_content(cls, blob_path: str, path: str) -> bool:
+        try:
+            # Blob is checked before it's placed, so the same inode has the same content
+            if os.path.samefile(blob_path, path):
+                return True
+            return cls.__hash_file(path) == os.path.basename(blob_path)
+        except OSError:
+            return False
+
+    @classmethod
+    def __verify(cls, path: str) -> bool:
+        """ Check that blob content matches its digest. Root can still edit read-only blobs through visible hard links. """
+        try:
+            st = os.stat(path)
+            signature = (st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+            if cls.__verified.get(path) == signature:
+                return True
+            if cls.__hash_file(path) != os.path.basename(path):
+                return False
+        except OSError:
+            return False
+
+        cls.__verified[path] = signature
+        return True
+
+    @classmethod
+    def __evict(cls, digest: str):
+        """ Forget modified blob. Visible files keep their new content, but are no longer deduplicated. """
+        cls.__logger.warning(f"Blob {digest} was modified in place, it's removed from shared dir store")
+        index = cls.__get_index()
+        index["unique_ids"] = {uid: d for uid, d in index["unique_ids"].items() if d != digest}
+        index["names"] = {name: d for name, d in index["names"].items() if d != digest}
+
+        path = cls.__blob_path(digest)
+        cls.__verified.pop(path, None)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        cls.__save_index()
+
+    @classmethod
+    def __get_index(cls) -> dict:
+        if cls.__index is None:
+            os.makedirs(os.path.join(PATH_SHARED_DIR, DIR_STORE, DIR_BLOBS), exist_ok=True)
+            try:
+                with open(os.path.join(PATH_SHARED_DIR, DIR_STORE, FILE_INDEX), 'rt') as f:
+                    cls.__index = json.load(f)
+            except (OSError, ValueError):
+                cls.__index = {"unique_ids": {}, "names": {}}
+            cls.collect_garbage()
+            cls.__remove_parts()
+        return cls.__index
+
+    @classmethod
+    def __remove_parts(cls):
+        """ Remove files of downloads, that were interrupted by crash. Index is loaded before any download starts. """
+        store_dir = os.path.join(PATH_SHARED_DIR, DIR_STORE)
+        for name in os.listdir(store_dir):
+            if name.endswith(PART_SUFFIX):
+                try:
+                    os.remove(os.path.join(store_dir, name))
+                except OSError as e:
+                    cls.__logger.warning(f"Can't remove interrupted download {name}: < {str(e)} >")
+                else:
+                    cls.__logger.info(f'Removed interrupted download "{name}" from shared dir store')
+
+    @classmethod
+    def __save_index(cls):
+        path = os.path.join(PATH_SHARED_DIR, DIR_STORE, FILE_INDEX)
+        with open(path + '.tmp', 'wt') as f:
+            json.dump(cls.__index, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+
+class TM_FileTransfer:
+    """ Bounded-concurrency download pipeline for File Transfer System """
+    __logger = getLogger(__name__)
+    __semaphore = None
+    __reserved_bytes = 0
+
+    @classmethod
+    async def download(cls, bot: object, file: object, file_name: str = None) -> str:
+        """ Download file from Telegram servers to shared dir.
+
+        Files, that were already received, are placed from the store without downloading.
+        New files are streamed to the temporary file and then atomically moved to the store.
+        Existing files are never overwritten, name is suffixed with number instead.
+
+        Args:
+            bot (object): aiogram Bot object.
+            file (object): aiogram Document or PhotoSize object.
+            file_name (str, optional): Name of the saved file. Defaults to `photos/<file_unique_id>.jpg`.
+
+        Raises:
+            TM_FileTransferError: Not enough free space or download failed.
+
+        Returns:
+            str: Path to the saved file.
+        """
+        cfg = TM_Config.model().file_transfer
+        if cls.__semaphore is None:
+            cls.__semaphore = asyncio.Semaphore(cfg.max_concurrent_downloads)
+
+        file_name = os.path.join('photos', f"{file.file_unique_id}.jpg") if file_name is None else os.path.basename(file_name)
+        await TM_Offload.run(init_shared_dir)
+
+        blob_path = await TM_Offload.run(TM_SharedStore.lookup, file.file_unique_id)
+        if blob_path is not None:
+            path = await TM_Offload.run(TM_SharedStore.place, blob_path, file_name)
+            cls.__logger.info(f'File "{file_name}" [{file.file_unique_id}] is already stored, placed to "{os.path.abspath(path)}" without download')
+            return path
+
+        file_size = file.file_size or 0
+        min_free_mb = cfg.min_free_space_mb
+        await cls.__check_free_space(file_size, min_free_mb)
+
+        async with cls.__semaphore:
+            # Free space could be taken by other transfers while waiting for semaphore
+            await cls.__check_free_space(file_size, min_free_mb)
+            cls.__reserved_bytes += file_size
+            tmp = None
+
+            try:
+                tg_file = await file.get_file()
+
+                started = monotonic()
+                tmp = tempfile.NamedTemporaryFile(dir=await TM_Offload.run(TM_SharedStore.tmp_dir), suffix=PART_SUFFIX, delete=False)
+                with tmp:
+                    writer = TM_HashingWriter(tmp)
+                    try:
+                        await bot.download_file(tg_file.file_path, writer, chunk_size=cfg.chunk_size_kb * 1024, seek=False)
+                    finally:
+                        # Temporary file is removed only after background writes are finished
+                        await writer.drain()
+                    await TM_Offload.run(os.fsync, tmp.fileno())
+
+                blob_path = await TM_Offload.run(TM_SharedStore.add_blob, tmp.name, writer.hash.hexdigest(), file.file_unique_id)
+                path = await TM_Offload.run(TM_SharedStore.place, blob_path, file_name)
+            except Exception as e:
+                cls.__logger.error(f'Failed to download file "{file_name}": < {str(e)} >')
+                raise TM_FileTransferError(str(e)) from e
+            finally:
+                cls.__reserved_bytes -= file_size
+                if tmp is not None and os.path.exists(tmp.name):
+                    os.remove(tmp.name)
+
+        elapsed = monotonic() - started
+        cls.__logger.info(f'Downloaded file "{file_name}" to "{os.path.abspath(path)}": {format_bytes(writer.size)} in {elapsed:.2f} s ({format_bytes(writer.size / elapsed if elapsed else 0)}/s)')
+        return path
+
+    @classmethod
+    async def __check_free_space(cls, file_size: int, min_free_mb: int):
+        """ Check that file fits into shared dir, keeping minimum amount of free space.
+
+        Args:
+            file_size (int): Announced file size in bytes.
+            min_free_mb (int): Amount of space (in MiB) that must stay free after all running downloads.
+
+        Raises:
+            TM_FileTransferError: Not enough free space.
+        """
+        free = (await TM_Offload.run(shutil.disk_usage, PATH_SHARED_DIR)).free - cls.__reserved_bytes
+        if free - file_size < min_free_mb * 1024 * 1024:
+            raise TM_FileTransferError(f"Not enough free space: {format_bytes(free)} available, {format_bytes(file_size)} required")
@@ -0,0 +1,341 @@
+import io
+import os
+import queue
+import asyncio
+import tarfile
+import threading
+from time import strftime
+from logging import getLogger
+
+from aiogram import Bot
+from aiogram.types import InputFile
+from aiogram.utils.markdown import bold, code
+from aiogram.utils.exceptions import TelegramAPIError
+
+from telemonitor.helpers import TM_Offload, PATH_SHARED_DIR
+from telemonitor.extensions.metrics import format_bytes
+
+
+# Parts are sent as separate documents, each one under Telegram upload limit
+PART_SIZE = 49 * 1024 * 1024
+# Archive writer is blocked when reader is this many chunks behind, so memory use doesn't depend on directory size
+PIPE_CHUNKS = 16
+PIPE_CHUNK_SIZE = 64 * 1024
+FETCH_MAX_CONCURRENT = 1
+# Upper bound of compressor output growth on incompressible data
+COMPRESSION_OVERHEAD = 1.01
+TAR_BLOCK = 512
+
+
+def get_compressor() -> str:
+    """ Get the best available archive compression.
+
+    Returns:
+        str: `zst` if `zstandard` module is installed, `gz` otherwise.
+    """
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return "gz"
+    return "zst"
+
+
+def resolve_path(arg: str) -> str:
+    """ Get path of `/fetch` command argument. Relative paths are resolved from shared directory.
+
+    Args:
+        arg (str): Path from command arguments.
+
+    Raises:
+        ValueError: Path is empty or doesn't exist.
+
+    Returns:
+        str: Absolute path.
+    """
+    arg = arg.strip().strip('"\'')
+    if not arg:
+        raise ValueError("Usage: /fetch <path>")
+
+    path = os.path.abspath(os.path.join(PATH_SHARED_DIR, os.path.expanduser(arg)))
+    if not os.path.exists(path):
+        raise ValueError(f"Path {arg} doesn't exist")
+    return path
+
+
+def estimate_size(path: str) -> int:
+    """ Get upper bound of archive size, without reading the files.
+
+    Args:
+        path (str): File or directory path.
+
+    Returns:
+        int: Size in bytes.
+    """
+    def entry_size(p: str) -> int:
+        try:
+            st = os.lstat(p)
+        except OSError:
+            return 0
+        # Header block and content padded to whole blocks
+        return TAR_BLOCK + (-(-st.st_size // TAR_BLOCK) * TAR_BLOCK if os.path.isfile(p) and not os.path.islink(p) else 0)
+
+    total = 2 * TAR_BLOCK + entry_size(path)
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            total += entry_size(os.path.join(root, name))
+    return int(total * COMPRESSION_OVERHEAD) + TAR_BLOCK
+
+
+class TM_ArchiveAborted(Exception):
+    """ Reader side of archive pipe was closed """
+
+
+class TM_FetchError(Exception):
+    def __init__(self, message: str, parts_sent: int):
+        """ Archive upload failed.
+
+        Args:
+            message (str): Error description.
+            parts_sent (int): Amount of parts, that were delivered before the failure.
+        """
+        super().__init__(message)
+        self.parts_sent = parts_sent
+
+
+class TM_ArchivePipe:
+    def __init__(self):
+        """ Bounded byte stream from archive writer thread to uploads of archive parts """
+        self.__queue = queue.Queue(maxsize=PIPE_CHUNKS)
+        self.__buffer = bytearray()
+        self.__pending = b""
+        self.__eof = False
+        self.__aborted = False
+        self.error = None
+
+    # Writer side
+    def write(self, data: bytes) -> int:
+        self.__buffer += data
+        while len(self.__buffer) >= PIPE_CHUNK_SIZE:
+            self.__put(bytes(self.__buffer[:PIPE_CHUNK_SIZE]))
+            del self.__buffer[:PIPE_CHUNK_SIZE]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close_writer(self, error: Exception = None):
+        """ Send the rest of buffered data and mark end of stream.
+
+        Args:
+            error (Exception, optional): Archive wasn't completed because of this error. Defaults to None.
+        """
+        self.error = error
+        if self.__buffer and error is None:
+            self.__put(bytes(self.__buffer))
+        self.__buffer.clear()
+        self.__put(None)
+
+    def __put(self, chunk: bytes):
+        while True:
+            if self.__aborted:
+                raise TM_ArchiveAborted()
+            try:
+                self.__queue.put(chunk, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    # Reader side
+    def read(self, size: int) -> bytes:
+        """ Read up to `size` bytes, blocking until data is available.
+
+        Args:
+            size (int): Maximum amount of bytes.
+
+        Returns:
+            bytes: Data or empty bytes at the end of stream.
+        """
+        if not self.__pending and not self.__eof:
+            chunk = self.__queue.get()
+            if chunk is None:
+                self.__eof = True
+            else:
+                self.__pending = chunk
+
+        data, self.__pending = self.__pending[:size], self.__pending[size:]
+        return data
+
+    def at_eof(self) -> bool:
+        """ Check if all data was read, blocking until the next chunk is available. """
+        if not self.__pending and not self.__eof:
+            self.__pending = self.read(PIPE_CHUNK_SIZE)
+        return not self.__pending and self.__eof
+
+    def abort(self):
+        """ Stop writer and release its blocked writes. """
+        self.__aborted = True
+        while True:
+            try:
+                self.__queue.get_nowait()
+            except queue.Empty:
+                break
+
+
+class TM_ArchivePart(io.RawIOBase):
+    def __init__(self, pipe: TM_ArchivePipe, size: int = None):
+        """ Readable file with up to `size` bytes of archive stream. Read by aiohttp in executor threads while uploaded.
+
+        Args:
+            pipe (TM_ArchivePipe): Archive stream.
+            size (int, optional): Maximum size of part. Defaults to PART_SIZE.
+        """
+        self.__pipe = pipe
+        self.__left = PART_SIZE if size is None else size
+        self.sent = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b: bytearray) -> int:
+        if self.__left <= 0:
+            return 0
+        data = self.__pipe.read(min(len(b), self.__left))
+        n = len(data)
+        b[:n] = data
+        self.__left -= n
+        self.sent += n
+        return n
+
+
+class TM_ArchiveWriter(threading.Thread):
+    def __init__(self, path: str, pipe: TM_ArchivePipe, compression: str):
+        """ Thread, that writes compressed tar archive of path to pipe.
+
+        Args:
+            path (str): File or directory to archive.
+            pipe (TM_ArchivePipe): Pipe to write to.
+            compression (str): `gz` or `zst`.
+        """
+        super().__init__(name="TM_ArchiveWriter", daemon=True)
+        self.path = path
+        self.pipe = pipe
+        self.compression = compression
+        self.files = 0
+        self.skipped = 0
+
+    def run(self):
+        error = None
+        try:
+            self.__write()
+        except TM_ArchiveAborted:
+            return
+        except Exception as e:
+            error = e
+            getLogger(__name__).error(f'Archive of "{self.path}" failed: < {str(e)} >')
+
+        try:
+            self.pipe.close_writer(error)
+        except TM_ArchiveAborted:
+            pass
+
+    def __write(self):
+        if self.compression == "zst":
+            import zstandard
+
+            compressor = zstandard.ZstdCompressor().stream_writer(self.pipe, closefd=False)
+            with tarfile.open(fileobj=compressor, mode="w|") as tar:
+                self.__add_all(tar)
+            compressor.close()
+        else:
+            with tarfile.open(fileobj=self.pipe, mode="w|gz") as tar:
+                self.__add_all(tar)
+
+    def __add_all(self, tar: tarfile.TarFile):
+        base = os.path.dirname(self.path)
+        self.__add(tar, self.path, base)
+        for root, dirs, files in os.walk(self.path):
+            dirs.sort()
+            for name in dirs + sorted(files):
+                self.__add(tar, os.path.join(root, name), base)
+
+    def __add(self, tar: tarfile.TarFile, path: str, base: str):
+        try:
+            tar.add(path, arcname=os.path.relpath(path, base), recursive=False)
+            self.files += 1
+        except OSError as e:
+            # Files, that are removed or not readable, don't break the whole archive
+            self.skipped += 1
+            getLogger(__name__).warning(f'Skipped "{path}" in archive: < {str(e)} >')
+
+
+class TM_Fetch:
+    """ Sends files and directories as compressed archives, streamed straight into the upload request """
+    __logger = getLogger(__name__)
+    __semaphore = None
+
+    @classmethod
+    async def send(cls, bot: Bot, chat_id: int, path: str) -> str:
+        """ Archive path and send it to chat, split into parts if it's larger than upload limit.
+
+        Args:
+            bot (Bot): aiogram Bot object.
+            chat_id (int): Chat to send to.
+            path (str): Absolute file or directory path.
+
+        Raises:
+            ValueError: Other archive is being sent.
+            TM_FetchError: Upload of any part failed or archive is incomplete.
+
+        Returns:
+            str: Formatted summary message, ready for Telegram.
+        """
+        if cls.__semaphore is None:
+            cls.__semaphore = asyncio.Semaphore(FETCH_MAX_CONCURRENT)
+        if cls.__semaphore.locked():
+            raise ValueError("Other archive is being sent, try again later")
+
+        async with cls.__semaphore:
+            compression = get_compressor()
+            name = f"{os.path.basename(path.rstrip(os.sep)) or 'root'}_{strftime('%Y-%m-%d_%H-%M-%S')}.tar.{compression}"
+            # Name of the single part must be known before upload, so it's decided by the worst case size
+            split = await TM_Offload.run(estimate_size, path) > PART_SIZE
+
+            pipe = TM_ArchivePipe()
+            writer = TM_ArchiveWriter(path, pipe, compression)
+            writer.start()
+            cls.__logger.info(f'Sending archive of "{path}" to chat [{chat_id}]')
+
+            parts, total = 0, 0
+            try:
+                while not await TM_Offload.run(pipe.at_eof):
+                    parts += 1
+                    part = TM_ArchivePart(pipe)
+                    # Files can grow while archive is written, then the rest is numbered even if it wasn't expected
+                    await bot.send_document(chat_id, InputFile(part, filename=f"{name}.{parts:03d}" if split or parts > 1 else name))
+                    total += part.sent
+            except (TelegramAPIError, OSError) as e:
+                pipe.abort()
+                cls.__logger.error(f'Failed to send archive of "{path}" after {parts - 1} parts: < {str(e)} >')
+                raise TM_FetchError(str(e), parts - 1) from e
+            except BaseException:
+                pipe.abort()
+                raise
+            finally:
+                await TM_Offload.run(writer.join)
+
+            if pipe.error is not None:
+                # Parts are already delivered, but archive misses the rest of the files
+                raise TM_FetchError(f"Archive is incomplete: {str(pipe.error)}", parts)
+
+            text = (
+                f"{bold('Archive sent')}: {code(name)}\n"
+                f"{bold('Size')}: {code(format_bytes(total))} {bold('Parts')}: {code(parts)} {bold('Entries')}: {code(writer.files)}"
+            )
+            if split:
+                text += f"\nJoin parts with {code(f'cat {name}.* > {name}')}"
+            elif parts > 1:
+                text += f"\nArchive grew while it was sent and its first part has no number, join parts with {code(f'mv {name} {name}.001 && cat {name}.* > {name}')}"
+            if writer.skipped:
+                text += f"\nSkipped {code(writer.skipped)} unreadable entries"
+            cls.__logger.info(f'Archive of "{path}" sent: {total} bytes in {parts} parts')
+            return text
@@ -0,0 +1,314 @@
+import os
+import json
+import tempfile
+import threading
+from time import monotonic
+from collections import OrderedDict
+from logging import getLogger
+
+from aiogram import types, Dispatcher, Bot
+from aiogram.utils.markdown import bold, code
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputFile
+from aiogram.utils.exceptions import TelegramAPIError
+
+from telemonitor.helpers import TM_Whitelist, TM_Offload, PARSE_MODE, PATH_SHARED_DIR, init_shared_dir
+from telemonitor.middlewares import TM_UserQueueMiddleware
+from telemonitor.extensions.metrics import format_bytes
+from telemonitor.extensions.file_transfer import DIR_STORE
+from telemonitor.extensions.store import TM_Store
+
+
+PAGE_SIZE = 8
+MAX_TOKENS = 4096
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+FILE_IDS = "file_ids.json"
+# Files, that grow or are rewritten in place, don't change dir mtime, so listings with sizes are rescanned after this amount of seconds
+DIR_INDEX_TTL = 10
+
+
+class TM_DirIndex:
+    """ Cached listings of shared dir, rescanned when dir modification time changes or after `DIR_INDEX_TTL` seconds """
+    __cache = {}
+
+    @classmethod
+    def listdir(cls, path: str) -> list:
+        """ Get sorted listing of dir, directories first. Hidden entries are skipped.
+
+        Args:
+            path (str): Path to dir.
+
+        Returns:
+            list: List of (name, is_dir, size) tuples.
+        """
+        mtime = os.stat(path).st_mtime_ns
+        cached = cls.__cache.get(path)
+        if cached is not None and cached[0] == mtime and monotonic() < cached[1]:
+            return cached[2]
+
+        entries = []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                is_dir = entry.is_dir()
+                entries.append((entry.name, is_dir, 0 if is_dir else entry.stat().st_size))
+        entries.sort(key=lambda e: (not e[1], e[0].lower()))
+
+        cls.__cache[path] = (mtime, monotonic() + DIR_INDEX_TTL, entries)
+        return entries
+
+
+class TM_PathTokens:
+    def __init__(self, size: int = MAX_TOKENS):
+        """ Short tokens of paths for callback data, that is limited to 64 bytes.
+
+        Tokens are never reused, so buttons of old keyboards can't lead to other path. The least recently used
+        paths are evicted over `size`, and their tokens are no longer resolved.
+
+        Args:
+            size (int, optional): Maximum amount of remembered paths. Defaults to MAX_TOKENS.
+        """
+        self.__size = size
+        self.__tokens = {}
+        self.__paths = OrderedDict()
+        self.__next = 0
+        # Keyboards are rendered in `TM_Offload` thread pool
+        self.__lock = threading.Lock()
+
+    def token(self, rel_path: str) -> int:
+        """ Get token of path.
+
+        Args:
+            rel_path (str): Path relative to shared dir.
+
+        Returns:
+            int: Token.
+        """
+        with self.__lock:
+            token = self.__tokens.get(rel_path)
+            if token is not None:
+                self.__paths.move_to_end(token)
+                return token
+
+            token, self.__next = self.__next, self.__next + 1
+            self.__tokens[rel_path] = token
+            self.__paths[token] = rel_path
+            # Tokens of the keyboard being rendered are the most recent ones, so they are never evicted
+            while len(self.__paths) > self.__size:
+                _, evicted = self.__paths.popitem(last=False)
+                del self.__tokens[evicted]
+            return token
+
+    def path(self, token: int) -> str:
+        """ Get path of token.
+
+        Args:
+            token (int): Token.
+
+        Returns:
+            str: Path relative to shared dir or None if token is unknown or was evicted.
+        """
+        with self.__lock:
+            rel_path = self.__paths.get(token)
+            if rel_path is not None:
+                self.__paths.move_to_end(token)
+            return rel_path
+
+
+class TM_FileIdCache:
+    """ Persistent cache of Telegram `file_id` for uploaded files, keyed by path, mtime and size """
+    __logger = getLogger(__name__)
+    __cache = None
+    # Cache methods are run in `TM_Offload` thread pool, so concurrent uploads are serialized
+    __lock = threading.Lock()
+
+    @classmethod
+    def get(cls, rel_path: str, st: os.stat_result) -> str:
+        """ Get Telegram file id of already uploaded file.
+
+        Args:
+            rel_path (str): Path relative to shared dir.
+            st (os.stat_result): Current stat of the file.
+
+        Returns:
+            str: Telegram file id or None if file wasn't uploaded or was changed since.
+        """
+        with cls.__lock:
+            entry = cls.__load().get(rel_path)
+        if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return entry[2]
+        return None
+
+    @classmethod
+    def set(cls, rel_path: str, st: os.stat_result, file_id: str):
+        """ Save Telegram file id of uploaded file.
+
+        Args:
+            rel_path (str): Path relative to shared dir.
+            st (os.stat_result): Stat of the uploaded file.
+            file_id (str): Telegram file id.
+        """
+        with cls.__lock:
+            cls.__load()[rel_path] = [st.st_mtime_ns, st.st_size, file_id]
+            cls.__save()
+
+    @classmethod
+    def drop(cls, rel_path: str):
+        """ Forget file id, that was rejected by Telegram.
+
+        Args:
+            rel_path (str): Path relative to shared dir.
+        """
+        with cls.__lock:
+            if cls.__load().pop(rel_path, None) is not None:
+                cls.__save()
+
+    @classmethod
+    def __load(cls) -> dict:
+        if cls.__cache is None:
+            try:
+                with open(os.path.join(PATH_SHARED_DIR, DIR_STORE, FILE_IDS), 'rt') as f:
+                    cls.__cache = json.load(f)
+            except (OSError, ValueError):
+                cls.__cache = {}
+        return cls.__cache
+
+    @classmethod
+    def __save(cls):
+        path = os.path.join(PATH_SHARED_DIR, DIR_STORE, FILE_IDS)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=FILE_IDS, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wt') as f:
+                json.dump(cls.__cache, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+class TM_FileBrowser:
+    __logger = getLogger(__name__)
+
+    def __init__(self, bot: Bot, dispatcher: Dispatcher):
+        """ Register `/files` command for browsing and downloading files from shared dir.
+
+        Args:
+            bot (Bot): aiogram Bot object.
+            dispatcher (Dispatcher): aiogram Dispatcher object.
+        """
+        self.__tokens = TM_PathTokens()
+
+        @dispatcher.message_handler(commands=['files'])
+        async def __command_files(message: types.Message):
+            if not TM_Whitelist.is_whitelisted(message.from_user.id): return False
+
+            await TM_Offload.run(init_shared_dir)
+            text, keyboard = await TM_Offload.run(self.__render, '', 0)
+            await message.reply(text, reply=False, parse_mode=PARSE_MODE, reply_markup=keyboard)
+
+        @dispatcher.callback_query_handler(lambda c: c.data.startswith('files:'))
+        async def __callback_files_press(callback_query: types.CallbackQuery):
+            if not TM_Whitelist.is_whitelisted(callback_query.from_user.id): return False
+
+            _, action, token, *page = callback_query.data.split(':')
+            rel_path = self.__tokens.path(int(token))
+            path = None if rel_path is None else self.__resolve(rel_path)
+
+            if path is None or not await TM_Offload.run(os.path.exists, path):
+                await bot.answer_callback_query(callback_query.id, "File list is outdated, use /files again", show_alert=True)
+
+            elif action == 'd':
+                await bot.answer_callback_query(callback_query.id)
+                text, keyboard = await TM_Offload.run(self.__render, rel_path, int(page[0]))
+                await bot.edit_message_text(text, callback_query.message.chat.id, callback_query.message.message_id, parse_mode=PARSE_MODE, reply_markup=keyboard)
+
+            elif action == 'f':
+                st = await TM_Offload.run(os.stat, path)
+                if st.st_size > MAX_UPLOAD_SIZE:
+                    await bot.answer_callback_query(callback_query.id, f"File is too large for Telegram ({format_bytes(st.st_size)})", show_alert=True)
+                    return
+
+                await bot.answer_callback_query(callback_query.id)
+                # Upload can take minutes, other updates of user shouldn't wait for it
+                TM_UserQueueMiddleware.release()
+                await self.__send(bot, callback_query.from_user.id, rel_path, path, st)
+                TM_Store.transfer(callback_query.from_user.id, 'out', rel_path, st.st_size)
+
+    async def __send(self, bot: Bot, user_id: int, rel_path: str, path: str, st: os.stat_result):
+        """ Send file to user, reusing Telegram file id of previous upload.
+
+        Args:
+            bot (Bot): aiogram Bot object.
+            user_id (int): Telegram user id.
+            rel_path (str): Path relative to shared dir.
+            path (str): Absolute path of file.
+            st (os.stat_result): Current stat of the file.
+        """
+        file_id = await TM_Offload.run(TM_FileIdCache.get, rel_path, st)
+        if file_id is not None:
+            try:
+                await bot.send_document(user_id, file_id)
+                self.__logger.info(f'Sent file "{rel_path}" by cached file id')
+                return
+            except TelegramAPIError as e:
+                # File ids are bound to bot token, so they're rejected after token change
+                self.__logger.warning(f'Cached file id of "{rel_path}" was rejected, uploading file again: < {str(e)} >')
+                await TM_Offload.run(TM_FileIdCache.drop, rel_path)
+
+        sent = await bot.send_document(user_id, InputFile(path))
+        await TM_Offload.run(TM_FileIdCache.set, rel_path, st, sent.document.file_id)
+        self.__logger.info(f'Uploaded file "{rel_path}" ({format_bytes(st.st_size)})')
+
+    def __render(self, rel_path: str, page: int) -> tuple:
+        """ Render page of dir listing.
+
+        Args:
+            rel_path (str): Path of dir, relative to shared dir.
+            page (int): Page number.
+
+        Returns:
+            tuple: Message text and inline keyboard.
+        """
+        entries = TM_DirIndex.listdir(self.__resolve(rel_path))
+        pages = max(1, -(-len(entries) // PAGE_SIZE))
+        page = min(max(page, 0), pages - 1)
+
+        keyboard = InlineKeyboardMarkup()
+        for name, is_dir, size in entries[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]:
+            token = self.__tokens.token(os.path.join(rel_path, name))
+            if is_dir:
+                keyboard.add(InlineKeyboardButton(f"📁 {name}", callback_data=f"files:d:{token}:0"))
+            else:
+                keyboard.add(InlineKeyboardButton(f"📄 {name} ({format_bytes(size)})", callback_data=f"files:f:{token}"))
+
+        nav = []
+        if rel_path:
+            nav.append(InlineKeyboardButton("⬆️ Up", callback_data=f"files:d:{self.__tokens.token(os.path.dirname(rel_path))}:0"))
+        if page > 0:
+            nav.append(InlineKeyboardButton("⬅️", callback_data=f"files:d:{self.__tokens.token(rel_path)}:{page - 1}"))
+        if page < pages - 1:
+            nav.append(InlineKeyboardButton("➡️", callback_data=f"files:d:{self.__tokens.token(rel_path)}:{page + 1}"))
+        if nav:
+            keyboard.row(*nav)
+
+        text = f"{bold('Shared files')}: {code('/' + rel_path)} {code(f'({page + 1}/{pages})')}"
+        if not entries:
+            text += "\nDirectory is empty"
+        return text, keyboard
+
+    @staticmethod
+    def __resolve(rel_path: str) -> str:
+        """ Get absolute path of shared dir entry, denying access outside of shared dir.
+
+        Args:
+            rel_path (str): Path relative to shared dir.
+
+        Returns:
+            str: Absolute path or None if path leads outside of shared dir.
+        """
+        root = os.path.realpath(PATH_SHARED_DIR)
+        path = os.path.realpath(os.path.join(root, rel_path))
+        return path if path == root or path.startswith(root + os.sep) else None
@@ -0,0 +1,370 @@
+import gzip
+import json
+import hmac
+import asyncio
+import platform
+from time import time
+from collections import deque
+from logging import getLogger
+
+from telemonitor.helpers import TM_Config, TM_Offload, render_sysinfo
+
+
+PUSH_PATH = "/push"
+PUSH_TIMEOUT = 10
+# Snapshots kept by agent while hub is unreachable, the oldest are dropped first
+AGENT_MAX_BATCH = 120
+MAX_HOSTS = 90
+MAX_HOST_NAME = 48
+MAX_PUSH_SIZE = 1024 * 1024
+STATIC_KEYS = ("system", "user_host")
+
+
+def encode_payload(payload: dict) -> bytes:
+    """ Serialize agent push to compressed json.
+
+    Args:
+        payload (dict): Push payload.
+
+    Returns:
+        bytes: Gzip-compressed json.
+    """
+    return gzip.compress(json.dumps(payload, separators=(',', ':')).encode(), compresslevel=6)
+
+
+def decode_payload(body: bytes) -> dict:
+    """ Parse and validate agent push.
+
+    Args:
+        body (bytes): Request body, already decompressed.
+
+    Raises:
+        ValueError: Payload is malformed.
+
+    Returns:
+        dict: Payload with `host`, `static` and `snapshots` values. Non-numeric metric values are dropped.
+    """
+    payload = json.loads(body)
+    if not isinstance(payload, dict):
+        raise ValueError("payload must be an object")
+
+    host = payload.get("host")
+    if not isinstance(host, str) or not 0 < len(host) <= MAX_HOST_NAME:
+        raise ValueError(f"host name must be a string of 1-{MAX_HOST_NAME} characters")
+
+    static = payload.get("static")
+    if not isinstance(static, dict) or not all(isinstance(static.get(k), str) for k in STATIC_KEYS):
+        raise ValueError("static system information is missing")
+
+    snapshots = payload.get("snapshots")
+    if not isinstance(snapshots, list) or not all(isinstance(s, dict) for s in snapshots):
+        raise ValueError("snapshots must be a list of objects")
+
+    return {
+        "host": host,
+        "static": {k: static[k] for k in STATIC_KEYS},
+        "snapshots": [
+            {k: v for k, v in s.items() if isinstance(v, (int, float)) and not isinstance(v, bool)}
+            for s in snapshots
+        ]
+    }
+
+
+def split_address(address: str) -> tuple:
+    """ Parse hub address.
+
+    Args:
+        address (str): `unix:/path/to.sock`, `http://host:port` or `host:port`.
+
+    Returns:
+        tuple: ("unix", path) or ("tcp", host, port).
+    """
+    if address.startswith("unix:"):
+        return ("unix", address[len("unix:"):])
+
+    address = address.split("://", 1)[-1].split("/", 1)[0]
+    host, _, port = address.rpartition(":")
+    return ("tcp", host.strip("[]") or "127.0.0.1", int(port))
+
+
+class TM_HostState:
+    def __init__(self, host_id: int, name: str):
+        """ The latest state, pushed by agent.
+
+        Args:
+            host_id (int): Short id of host, used in inline keyboard buttons.
+            name (str): Host name, reported by agent.
+        """
+        self.id = host_id
+        self.name = name
+        self.static = {}
+        self.snapshot = {}
+        self.last_seen = 0.0
+        self.pushes = 0
+        self.samples = 0
+
+    def is_online(self, timeout: float, now: float = None) -> bool:
+        """ Check if agent pushed recently enough.
+
+        Args:
+            timeout (float): Seconds without pushes, after which host is considered offline.
+            now (float, optional): Current unix time. Defaults to `time()`.
+
+        Returns:
+            bool: Host is online.
+        """
+        return (time() if now is None else now) - self.last_seen <= timeout
+
+
+class TM_Hub:
+    """ Receiver of agent pushes, keeping the latest state of each host """
+    __logger = getLogger(__name__)
+    __hosts = {}
+    __runner = None
+
+    @classmethod
+    def receive(cls, payload: dict) -> TM_HostState:
+        """ Update host state with validated push.
+
+        Args:
+            payload (dict): Payload, as returned by `decode_payload`.
+
+        Raises:
+            ValueError: Hub already tracks maximum amount of hosts.
+
+        Returns:
+            TM_HostState: Updated host state.
+        """
+        state = cls.__hosts.get(payload["host"])
+        if state is None:
+            if len(cls.__hosts) >= MAX_HOSTS:
+                raise ValueError(f"hub can't track more than {MAX_HOSTS} hosts")
+            state = cls.__hosts[payload["host"]] = TM_HostState(len(cls.__hosts) + 1, payload["host"])
+            cls.__logger.info(f"New agent connected: {payload['host']}")
+
+        state.static = payload["static"]
+        if payload["snapshots"]:
+            state.snapshot = max(payload["snapshots"], key=lambda s: s.get("time", 0))
+        state.samples += len(payload["snapshots"])
+        state.pushes += 1
+        state.last_seen = time()
+        return state
+
+    @classmethod
+    def hosts(cls) -> list:
+        """ Get all known hosts.
+
+        Returns:
+            list: Host states, sorted by name.
+        """
+        return sorted(cls.__hosts.values(), key=lambda s: s.name.lower())
+
+    @classmethod
+    def host(cls, host_id: int) -> TM_HostState:
+        """ Find host by its id.
+
+        Args:
+            host_id (int): Host id.
+
+        Returns:
+            TM_HostState: Host state or None if there's no such host.
+        """
+        for state in cls.__hosts.values():
+            if state.id == host_id:
+                return state
+        return None
+
+    @classmethod
+    def render_host(cls, state: TM_HostState) -> str:
+        """ Render system information of remote host.
+
+        Args:
+            state (TM_HostState): Host state.
+
+        Returns:
+            str: Formatted message, ready for Telegram.
+        """
+        from aiogram.utils.markdown import bold, code
+
+        timeout = TM_Config.model().hub.host_timeout
+        age = max(0, int(time() - state.last_seen))
+        status = "online" if state.is_online(timeout) else "offline"
+        lines = [
+            f"{bold('Host')}: {code(state.name)}",
+            f"{bold('Status')}: {code(f'{status}, last push {age}s ago')}"
+        ]
+
+        try:
+            lines.append(render_sysinfo(state.static, state.snapshot) if state.snapshot else code("No samples yet"))
+        except (KeyError, TypeError, ValueError):
+            # Agent of different version may push incomplete snapshot
+            lines.append(code("Snapshot can't be displayed"))
+
+        return "\n".join(lines)
+
+    @classmethod
+    async def start_server(cls, listen: str = None, token: str = None) -> str:
+        """ Start accepting agent pushes, if enabled in config file.
+
+        Args:
+            listen (str, optional): `host:port` or `unix:/path` to listen on. Defaults to value from config file.
+            token (str, optional): Shared secret of hub and agents. Defaults to value from config file.
+
+        Returns:
+            str: Address, hub is listening on, or None if hub is disabled.
+        """
+        cfg = TM_Config.model().hub
+        listen = cfg.listen if listen is None else listen
+        token = cfg.token if token is None else token
+        if not listen:
+            return None
+
+        from aiohttp import web
+
+        if not token:
+            cls.__logger.warning("Hub token is not set, pushes from any agent are accepted")
+
+        async def handle(request: object) -> object:
+            if token and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+                return web.json_response({"ok": False, "description": "invalid token"}, status=401)
+
+            # Gzip body is decompressed by aiohttp, as it's sent with `Content-Encoding` header
+            body = await request.read()
+            try:
+                state = cls.receive(decode_payload(body))
+            except ValueError as e:
+                return web.json_response({"ok": False, "description": str(e)}, status=400)
+            return web.json_response({"ok": True, "host_id": state.id})
+
+        app = web.Application(client_max_size=MAX_PUSH_SIZE)
+        app.router.add_post(PUSH_PATH, handle)
+        cls.__runner = web.AppRunner(app, access_log=None)
+        await cls.__runner.setup()
+
+        address = split_address(listen)
+        if address[0] == "unix":
+            site = web.UnixSite(cls.__runner, address[1])
+            await site.start()
+            bound = listen
+        else:
+            site = web.TCPSite(cls.__runner, address[1], address[2])
+            await site.start()
+            # Resolve random port, when listening on port 0
+            bound = "{}:{}".format(*site._server.sockets[0].getsockname()[:2])
+
+        cls.__logger.info(f"Hub is listening for agents on {bound}")
+        return bound
+
+    @classmethod
+    async def stop_server(cls):
+        """ Stop accepting agent pushes. """
+        if cls.__runner is not None:
+            await cls.__runner.cleanup()
+            cls.__runner = None
+
+
+class TM_Agent:
+    """ Bot-less mode, that samples system metrics and pushes them to hub in batches """
+    __logger = getLogger(__name__)
+    __batch = deque(maxlen=AGENT_MAX_BATCH)
+
+    @classmethod
+    def collect(cls, snapshot: dict):
+        """ Metrics listener, that queues new snapshot for the next push.
+
+        Args:
+            snapshot (dict): New snapshot.
+        """
+        cls.__batch.append(snapshot)
+
+    @classmethod
+    async def serve(cls, url: str, name: str = None, token: str = None, push_interval: float = None):
+        """ Sample metrics and push them to hub until cancelled.
+
+        Args:
+            url (str): Hub address, `http://host:port` or `unix:/path`.
+            name (str, optional): Host name, shown by hub. Defaults to value from config file or hostname.
+            token (str, optional): Shared secret of hub and agents. Defaults to value from config file.
+            push_interval (float, optional): Seconds between pushes. Defaults to value from config file.
+        """
+        from aiohttp import ClientSession, ClientTimeout, UnixConnector
+        from telemonitor.extensions.metrics import TM_Metrics
+
+        cfg = TM_Config.model().hub
+        name = name or cfg.agent_name or platform.node()
+        token = cfg.token if token is None else token
+        if push_interval is None:
+            push_interval = cfg.push_interval
+
+        connector = UnixConnector(split_address(url)[1]) if url.startswith("unix:") else None
+        session = ClientSession(connector=connector, timeout=ClientTimeout(total=PUSH_TIMEOUT))
+        TM_Metrics.add_listener(cls.collect)
+        TM_Metrics.start()
+        cls.__logger.info(f"Agent {name} is pushing metrics to {url} every {push_interval} seconds")
+
+        try:
+            while True:
+                await asyncio.sleep(push_interval)
+                await cls.push(session, url, name, token)
+        finally:
+            TM_Metrics.stop()
+            await session.close()
+
+    @classmethod
+    async def push(cls, session: object, url: str, name: str, token: str = "") -> bool:
+        """ Send all queued snapshots to hub. Snapshots are kept for the next push if hub is unreachable.
+
+        Args:
+            session (object): aiohttp ClientSession object, with unix connector for `unix:` url.
+            url (str): Hub address.
+            name (str): Host name.
+            token (str, optional): Shared secret of hub and agents. Defaults to "".
+
+        Returns:
+            bool: Hub accepted the push.
+        """
+        from telemonitor.extensions.metrics import TM_Metrics
+
+        # New snapshots may be collected while request is in flight
+        batch, cls.__batch = cls.__batch, deque(maxlen=AGENT_MAX_BATCH)
+        payload = {"host": name, "static": TM_Metrics.static(), "snapshots": list(batch)}
+        if await cls.send(session, url, payload, token):
+            return True
+
+        batch.extend(cls.__batch)
+        cls.__batch = batch
+        return False
+
+    @classmethod
+    async def send(cls, session: object, url: str, payload: dict, token: str = "") -> bool:
+        """ Send single push to hub.
+
+        Args:
+            session (object): aiohttp ClientSession object, with unix connector for `unix:` url.
+            url (str): Hub address.
+            payload (dict): Push payload with `host`, `static` and `snapshots` values.
+            token (str, optional): Shared secret of hub and agents. Defaults to "".
+
+        Returns:
+            bool: Hub accepted the push.
+        """
+        from aiohttp import ClientError
+
+        # Host of unix socket url is ignored, but required by aiohttp
+        endpoint = "http://hub" + PUSH_PATH if url.startswith("unix:") else url.rstrip("/") + PUSH_PATH
+        headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+
+        body = await TM_Offload.run(encode_payload, payload)
+        try:
+            async with session.post(endpoint, data=body, headers=headers) as response:
+                if response.status != 200:
+                    cls.__logger.warning(f"Hub rejected push: < {response.status} {await response.text()} >")
+                    return False
+        except (ClientError, asyncio.TimeoutError, OSError) as e:
+            cls.__logger.warning(f"Can't push metrics to hub: < {str(e)} >")
+            return False
+
+        cls.__logger.debug(f"Pushed {len(payload['snapshots'])} snapshots ({len(body)} bytes) to hub")
+        return True
@@ -0,0 +1,83 @@
+from aiogram import types, Dispatcher, Bot
+from aiogram.utils.markdown import bold, code
+from aiogram.utils.exceptions import MessageNotModified
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from telemonitor.helpers import TM_Whitelist, TM_Config, PARSE_MODE
+from telemonitor.extensions.hub import TM_Hub
+
+
+class TM_HubKeyboard:
+    def __init__(self, bot: Bot, dispatcher: Dispatcher, control_keyboard: object):
+        """ Host selection for hub: `/hosts` command and `Hosts` button of control panel.
+
+        Args:
+            bot (Bot): aiogram Bot object.
+            dispatcher (Dispatcher): aiogram Dispatcher object.
+            control_keyboard (object): `TM_ControlInlineKB` object, extended with `Hosts` button.
+        """
+        # Host list is sent as a new message, so control panel message keeps its keyboard
+        control_keyboard.keyboard.add(InlineKeyboardButton('Hosts', callback_data='hub-hosts-new'))
+
+        @dispatcher.message_handler(commands=['hosts'])
+        async def __command_hosts(message: types.Message):
+            if TM_Whitelist.is_whitelisted(message.from_user.id):
+                text, markup = self.render_hosts()
+                await message.reply(text, reply=False, parse_mode=PARSE_MODE, reply_markup=markup)
+
+        @dispatcher.callback_query_handler(lambda c: c.data.startswith('hub-'))
+        async def __callback_hub(callback_query: types.CallbackQuery):
+            if not TM_Whitelist.is_whitelisted(callback_query.from_user.id): return False
+
+            data = callback_query.data
+            if data == 'hub-hosts-new':
+                text, markup = self.render_hosts()
+                await bot.answer_callback_query(callback_query.id)
+                await bot.send_message(callback_query.from_user.id, text, parse_mode=PARSE_MODE, reply_markup=markup)
+                return
+            elif data == 'hub-hosts':
+                text, markup = self.render_hosts()
+            elif data.startswith('hub-host:'):
+                state = TM_Hub.host(int(data[len('hub-host:'):]))
+                if state is None:
+                    await bot.answer_callback_query(callback_query.id, "Host is unknown")
+                    return
+                text = TM_Hub.render_host(state)
+                markup = InlineKeyboardMarkup().row(
+                    InlineKeyboardButton('Refresh', callback_data=data),
+                    InlineKeyboardButton('Back', callback_data='hub-hosts')
+                )
+            else:
+                return
+
+            await bot.answer_callback_query(callback_query.id)
+            if callback_query.message is None:
+                await bot.send_message(callback_query.from_user.id, text, parse_mode=PARSE_MODE, reply_markup=markup)
+                return
+
+            try:
+                await callback_query.message.edit_text(text, parse_mode=PARSE_MODE, reply_markup=markup)
+            except MessageNotModified:
+                pass
+
+    @staticmethod
+    def render_hosts() -> tuple:
+        """ Render host list with button for each host.
+
+        Returns:
+            tuple: (
+                str,                  # formatted message
+                InlineKeyboardMarkup  # host buttons
+            )
+        """
+        timeout = TM_Config.model().hub.host_timeout
+        hosts = TM_Hub.hosts()
+        online = sum(1 for s in hosts if s.is_online(timeout))
+
+        markup = InlineKeyboardMarkup(row_width=2)
+        markup.add(*(
+            InlineKeyboardButton(s.name if s.is_online(timeout) else f"{s.name} (offline)", callback_data=f'hub-host:{s.id}')
+            for s in hosts
+        ))
+        text = f"{bold('Hosts')}: {code(f'{online} online of {len(hosts)}')}"
+        return text, markup
@@ -0,0 +1,329 @@
+import io
+import os
+import re
+import gzip
+import mmap
+import shlex
+from bisect import bisect_left
+from collections import deque
+from time import time, strftime, localtime
+from logging import getLogger
+
+from telemonitor.helpers import DIR_LOG
+
+
+TAIL_DEFAULT_LINES = 20
+MAX_LINES = 5000
+MAX_LINE_LENGTH = 1000
+# Distance (in bytes) between entries of time offset index
+INDEX_STEP = 256 * 1024
+# Telegram message limit is 4096 characters, some space is left for formatting
+MESSAGE_SIZE = 3800
+MAX_MESSAGES = 3
+USAGE = "Usage: /logs tail [N] or /logs grep <pattern> [--since 2h]"
+# Log records start with `[YYYY-MM-DD HH:MM:SS,mmm]`, lines of tracebacks have no timestamp
+RE_RECORD = re.compile(rb'^\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)', re.MULTILINE)
+
+
+def list_log_files(dir_path: str = None) -> list:
+    """ Get all log files, including compressed ones.
+
+    Args:
+        dir_path (str, optional): Path to logs dir. Defaults to `DIR_LOG`.
+
+    Returns:
+        list: Paths to log files, from the oldest to the newest.
+    """
+    dir_path = DIR_LOG if dir_path is None else dir_path
+    try:
+        names = [n for n in os.listdir(dir_path) if n.startswith("TMLog_") and n.endswith((".log", ".log.gz"))]
+    except FileNotFoundError:
+        return []
+
+    # File names start with creation time, but numbered files of the same second must follow the plain one
+    def key(name: str) -> tuple:
+        stem = name[len("TMLog_"):].split(".", 1)[0]
+        return stem[:19], int(stem[20:]) if stem[20:].isdigit() else 0
+
+    return [os.path.join(dir_path, n) for n in sorted(names, key=key)]
+
+
+def parse_args(args: str) -> tuple:
+    """ Parse arguments of `/logs` command.
+
+    Args:
+        args (str): Command arguments, like `tail 50` or `grep "Can't .*" --since 2h`.
+
+    Raises:
+        ValueError: Arguments are malformed.
+
+    Returns:
+        tuple: (
+            str,    # "tail" or "grep"
+            object, # amount of lines for tail, compiled pattern for grep
+            float   # unix time to search since, None if not limited
+        )
+    """
+    from telemonitor.extensions.metrics import parse_duration
+
+    parts = shlex.split(args)
+    if not parts or parts[0] not in ("tail", "grep"):
+        raise ValueError(USAGE)
+
+    if parts[0] == "tail":
+        if len(parts) > 2:
+            raise ValueError(USAGE)
+        if len(parts) == 2 and not parts[1].isdigit():
+            raise ValueError(USAGE)
+        n = int(parts[1]) if len(parts) == 2 else TAIL_DEFAULT_LINES
+        if not 0 < n <= MAX_LINES:
+            raise ValueError(f"Amount of lines must be in range 1-{MAX_LINES}")
+        return "tail", n, None
+
+    since = None
+    if "--since" in parts:
+        i = parts.index("--since")
+        if i + 1 >= len(parts):
+            raise ValueError(USAGE)
+        since = time() - parse_duration(parts[i + 1])
+        del parts[i:i + 2]
+
+    if len(parts) != 2:
+        raise ValueError(USAGE)
+    try:
+        pattern = re.compile(parts[1].encode(), re.MULTILINE)
+    except re.error as e:
+        raise ValueError(f"Invalid pattern: {str(e)}")
+    return "grep", pattern, since
+
+
+class TM_LogReader:
+    """ Tail and search of log files through `mmap`, so large files are never fully loaded to memory """
+    __logger = getLogger(__name__)
+    # {path: (inode, size, [(timestamp, offset), ...], next offset to index)}
+    __index = {}
+
+    @classmethod
+    def tail(cls, n: int, dir_path: str = None) -> list:
+        """ Get the last lines of logs. Older files are read if the newest one is too short.
+
+        Blocking, so must be called with `TM_Offload.run`.
+
+        Args:
+            n (int): Amount of lines.
+            dir_path (str, optional): Path to logs dir. Defaults to `DIR_LOG`.
+
+        Returns:
+            list: Lines, from the oldest to the newest.
+        """
+        lines = deque()
+        files = list_log_files(dir_path)
+        cls.__prune_index(files)
+        for path in reversed(files):
+            needed = n - len(lines)
+            if needed <= 0:
+                break
+
+            try:
+                if path.endswith(".gz"):
+                    # Compressed files can't be read backwards, so only the last lines are kept while streaming
+                    with gzip.open(path, 'rb') as f:
+                        found = deque((line.rstrip(b'\r\n') for line in f if line.strip()), maxlen=needed)
+                else:
+                    found = cls.__tail_mmap(path, needed)
+            except (OSError, EOFError) as e:
+                # File can be removed or compressed by retention after it was listed
+                cls.__logger.warning(f"Can't read log file {path}: < {str(e)} >")
+                continue
+            lines.extendleft(reversed([cls.__decode(line) for line in found]))
+
+        return list(lines)
+
+    @classmethod
+    def grep(cls, pattern: re.Pattern, since: float = None, limit: int = MAX_LINES, dir_path: str = None) -> list:
+        """ Find lines of logs, matching the pattern.
+
+        Blocking, so must be called with `TM_Offload.run`.
+
+        Args:
+            pattern (re.Pattern): Compiled bytes pattern.
+            since (float, optional): Search only records written after this unix time. Defaults to None.
+            limit (int, optional): Maximum amount of lines, the newest are kept. Defaults to MAX_LINES.
+            dir_path (str, optional): Path to logs dir. Defaults to `DIR_LOG`.
+
+        Returns:
+            list: Matching lines, from the oldest to the newest.
+        """
+        since_ts = strftime("%Y-%m-%d %H:%M:%S", localtime(since)).encode() if since is not None else None
+        found = deque(maxlen=limit)
+        files = list_log_files(dir_path)
+        cls.__prune_index(files)
+
+        for path in files:
+            try:
+                if since is not None and os.path.getmtime(path) < since:
+                    # Nothing was written to this file since then
+                    continue
+
+                if path.endswith(".gz"):
+                    with gzip.open(path, 'rb') as f:
+                        found.extend(cls.__grep_stream(f, pattern, since_ts, limit))
+                else:
+                    found.extend(cls.__grep_mmap(path, pattern, since_ts, limit))
+            except (OSError, EOFError) as e:
+                cls.__logger.warning(f"Can't search in log file {path}: < {str(e)} >")
+
+        return [cls.__decode(line) for line in found]
+
+    @classmethod
+    def __prune_index(cls, files: list):
+        """ Forget offsets of files, that were removed or compressed by retention. """
+        files = set(files)
+        # Reads run in `TM_Offload` thread pool, so keys are copied before the dict is changed
+        for path in list(cls.__index):
+            if path not in files:
+                cls.__index.pop(path, None)
+
+    @classmethod
+    def __tail_mmap(cls, path: str, n: int) -> list:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                return []
+
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                end = size - 1 if mm[size - 1:size] == b'\n' else size
+                lines = []
+                while end > 0 and len(lines) < n:
+                    start = mm.rfind(b'\n', 0, end) + 1
+                    if mm[start:end].strip():
+                        lines.append(mm[start:end])
+                    end = start - 1
+                lines.reverse()
+                return lines
+
+    @classmethod
+    def __grep_mmap(cls, path: str, pattern: re.Pattern, since_ts: bytes, limit: int) -> deque:
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if not st.st_size:
+                return []
+
+            found = deque(maxlen=limit)
+            with mmap.mmap(f.fileno(), st.st_size, access=mmap.ACCESS_READ) as mm:
+                pos = 0 if since_ts is None else cls.__offset_since(path, st, mm, since_ts)
+                while True:
+                    match = pattern.search(mm, pos)
+                    if match is None:
+                        break
+                    start = mm.rfind(b'\n', 0, match.start()) + 1
+                    end = mm.find(b'\n', match.start())
+                    end = len(mm) if end == -1 else end
+                    found.append(mm[start:end])
+                    # Each line is reported once, even with several matches
+                    pos = end + 1
+            return found
+
+    @classmethod
+    def __grep_stream(cls, f: io.BufferedIOBase, pattern: re.Pattern, since_ts: bytes, limit: int) -> deque:
+        found = deque(maxlen=limit)
+        in_range = since_ts is None
+        for line in f:
+            if not in_range:
+                ts = RE_RECORD.match(line)
+                if ts is None or ts.group(1) < since_ts:
+                    continue
+                in_range = True
+            if pattern.search(line):
+                found.append(line.rstrip(b'\r\n'))
+        return found
+
+    @classmethod
+    def __offset_since(cls, path: str, st: os.stat_result, mm: mmap.mmap, since_ts: bytes) -> int:
+        """ Find offset of the first record, written at or after timestamp, using sparse index of record offsets. """
+        entry = cls.__index.get(path)
+        if entry is None or entry[0] != st.st_ino or entry[1] > st.st_size:
+            # File is new or was replaced
+            entry = (st.st_ino, 0, [], 0)
+
+        # Index is extended only over appended part of the file, with the first record after each step boundary
+        points, indexed = entry[2], entry[3]
+        while indexed < st.st_size:
+            found = RE_RECORD.search(mm, indexed)
+            if found is None:
+                break
+            if not points or points[-1][1] < found.start():
+                points.append((found.group(1), found.start()))
+            indexed = (found.start() // INDEX_STEP + 1) * INDEX_STEP
+        cls.__index[path] = (st.st_ino, st.st_size, points, indexed)
+
+        # Scan starts from the last indexed record, that is older than timestamp
+        i = bisect_left(points, (since_ts, -1))
+        pos = points[i - 1][1] if i else 0
+
+        while True:
+            found = RE_RECORD.search(mm, pos)
+            if found is None:
+                return len(mm)
+            if found.group(1) >= since_ts:
+                return found.start()
+            pos = found.end()
+
+    @staticmethod
+    def __decode(line: bytes) -> str:
+        text = line.decode(errors='replace')
+        return text if len(text) <= MAX_LINE_LENGTH else text[:MAX_LINE_LENGTH] + "…"
+
+
+def split_messages(lines: list, size: int = MESSAGE_SIZE) -> list:
+    """ Group lines into chunks, that fit into single Telegram message after formatting.
+
+    Args:
+        lines (list): Lines of text.
+        size (int, optional): Maximum length of formatted chunk. Defaults to MESSAGE_SIZE.
+
+    Returns:
+        list: Chunks of lines, joined with newline.
+    """
+    from aiogram.utils.text_decorations import markdown_decoration
+
+    chunks, chunk, length = [], [], 0
+    for line in lines:
+        line_length = len(markdown_decoration.quote(line)) + 1
+        if chunk and length + line_length > size:
+            chunks.append("\n".join(chunk))
+            chunk, length = [], 0
+        chunk.append(line)
+        length += line_length
+    if chunk:
+        chunks.append("\n".join(chunk))
+    return chunks
+
+
+async def send_lines(bot: object, chat_id: int, title: str, lines: list):
+    """ Send lines of logs as several messages, or as compressed document if there are too many of them.
+
+    Args:
+        bot (object): aiogram Bot object.
+        chat_id (int): Chat to send to.
+        title (str): Header of the reply.
+        lines (list): Lines of logs.
+    """
+    from aiogram.types import InputFile
+    from aiogram.utils.markdown import bold, code, pre
+    from telemonitor.helpers import TM_Offload, PARSE_MODE
+
+    if not lines:
+        await bot.send_message(chat_id, f"{bold(title)}: {code('nothing found')}", parse_mode=PARSE_MODE)
+        return
+
+    chunks = await TM_Offload.run(split_messages, lines)
+    if len(chunks) <= MAX_MESSAGES:
+        await bot.send_message(chat_id, f"{bold(title)}: {code(f'{len(lines)} lines')}", parse_mode=PARSE_MODE)
+        for chunk in chunks:
+            await bot.send_message(chat_id, pre(chunk), parse_mode=PARSE_MODE)
+        return
+
+    data = await TM_Offload.run(lambda: gzip.compress("\n".join(lines).encode() + b"\n"))
+    document = InputFile(io.BytesIO(data), filename=f"TMLog_{strftime('%Y-%m-%d_%H-%M-%S')}.txt.gz")
+    await bot.send_document(chat_id, document, caption=f"{bold(title)}: {code(f'{len(lines)} lines')}", parse_mode=PARSE_MODE)
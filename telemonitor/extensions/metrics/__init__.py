@@ -0,0 +1,318 @@
+import os
+import asyncio
+import platform
+import threading
+from time import time, monotonic
+from logging import getLogger
+
+from uptime import uptime
+
+from telemonitor.helpers import TM_Config, TM_Offload
+
+
+PATH_PROC = "/proc"
+PATH_SYS_BLOCK = "/sys/block"
+SECTOR_SIZE = 512
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_stat(text: str) -> tuple:
+    """ Parse aggregated cpu times from `/proc/stat`.
+
+    Args:
+        text (str): Content of `/proc/stat`.
+
+    Returns:
+        tuple: (
+            int,  # idle jiffies (including iowait)
+            int   # total jiffies
+        )
+    """
+    fields = [int(v) for v in text.split('\n', 1)[0].split()[1:]]
+    # Guest times are already accounted in user and nice times
+    total = sum(fields[:8])
+    idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+    return idle, total
+
+
+def parse_meminfo(text: str) -> dict:
+    """ Parse `/proc/meminfo`.
+
+    Args:
+        text (str): Content of `/proc/meminfo`.
+
+    Returns:
+        dict: Values in bytes, mapped by meminfo key.
+    """
+    values = {}
+    for line in text.splitlines():
+        key, _, value = line.partition(':')
+        values[key] = int(value.split()[0]) * 1024
+    return values
+
+
+def parse_loadavg(text: str) -> tuple:
+    """ Parse `/proc/loadavg`.
+
+    Args:
+        text (str): Content of `/proc/loadavg`.
+
+    Returns:
+        tuple: Load average for 1, 5 and 15 minutes.
+    """
+    return tuple(float(v) for v in text.split()[:3])
+
+
+def parse_net_dev(text: str) -> tuple:
+    """ Parse total traffic of all network interfaces, except loopback, from `/proc/net/dev`.
+
+    Args:
+        text (str): Content of `/proc/net/dev`.
+
+    Returns:
+        tuple: (
+            int,  # received bytes
+            int   # transmitted bytes
+        )
+    """
+    rx = tx = 0
+    for line in text.splitlines()[2:]:
+        iface, _, data = line.partition(':')
+        if iface.strip() == 'lo':
+            continue
+        fields = data.split()
+        rx += int(fields[0])
+        tx += int(fields[8])
+    return rx, tx
+
+
+def parse_diskstats(text: str, devices: frozenset) -> tuple:
+    """ Parse total io of block devices from `/proc/diskstats`.
+
+    Args:
+        text (str): Content of `/proc/diskstats`.
+        devices (frozenset): Names of devices to account.
+
+    Returns:
+        tuple: (
+            int,  # read bytes
+            int   # written bytes
+        )
+    """
+    read = written = 0
+    for line in text.splitlines():
+        fields = line.split()
+        if fields[2] in devices:
+            read += int(fields[5]) * SECTOR_SIZE
+            written += int(fields[9]) * SECTOR_SIZE
+    return read, written
+
+
+def format_bytes(value: float) -> str:
+    """ Format amount of bytes to human readable string.
+
+    Args:
+        value (float): Amount of bytes.
+
+    Returns:
+        str: Formatted string, like `1.5 MiB`.
+    """
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if abs(value) < 1024 or unit == 'TiB':
+            break
+        value /= 1024
+    return f"{value:.1f} {unit}" if unit != 'B' else f"{value:.0f} B"
+
+
+def parse_duration(text: str) -> float:
+    """ Parse duration string, like `30s`, `5m`, `2h` or `7d`.
+
+    Args:
+        text (str): Duration string. Number without suffix is treated as seconds.
+
+    Raises:
+        ValueError: Duration string is malformed.
+
+    Returns:
+        float: Duration in seconds.
+    """
+    text = text.strip().lower()
+    if text and text[-1] in DURATION_UNITS:
+        return float(text[:-1]) * DURATION_UNITS[text[-1]]
+    return float(text)
+
+
+def format_uptime(seconds: float) -> str:
+    """ Format uptime to `dd:hh:mm:ss` string.
+
+    Args:
+        seconds (float): Uptime in seconds.
+
+    Returns:
+        str: Formatted uptime.
+    """
+    seconds = int(seconds)
+    return f"{seconds // 86400:02}:{seconds // 3600 % 24:02}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+
+
+class TM_Metrics:
+    """ Background sampler of system metrics with cached latest snapshot """
+    __logger = getLogger(__name__)
+    __static = None
+    __snapshot = {}
+    __previous = None
+    __lock = threading.Lock()
+    __devices = frozenset()
+    __listeners = []
+    __task = None
+
+    @classmethod
+    def start(cls) -> asyncio.Task:
+        """ Compute static system information and start sampling task in running event loop.
+
+        Returns:
+            asyncio.Task: Sampling task.
+        """
+        cfg = TM_Config.model().metrics
+        interval = cfg.sample_interval
+        mount_points = cfg.mount_points
+
+        cls.static()
+        if os.path.isdir(PATH_SYS_BLOCK):
+            cls.__devices = frozenset(d for d in os.listdir(PATH_SYS_BLOCK) if not d.startswith(('loop', 'ram', 'zram')))
+
+        if cls.__task is None:
+            cls.__task = asyncio.get_event_loop().create_task(cls.__loop(interval, mount_points))
+            cls.__logger.info(f"Metrics sampler started with {interval} seconds interval")
+        return cls.__task
+
+    @classmethod
+    def stop(cls):
+        """ Cancel sampling task. """
+        if cls.__task is not None:
+            cls.__task.cancel()
+            cls.__task = None
+
+    @classmethod
+    def static(cls) -> dict:
+        """ Get system information that doesn't change while bot is running.
+
+        Returns:
+            dict: Static system information.
+        """
+        if cls.__static is None:
+            uname = platform.uname()
+            cls.__static = {
+                "system": f"{uname.system} {uname.release} ({uname.version})",
+                "user_host": f"{os.path.basename(os.path.expanduser('~'))}@{uname.node}"
+            }
+        return cls.__static
+
+    @classmethod
+    def snapshot(cls) -> dict:
+        """ Get the latest metrics snapshot.
+
+        Returns:
+            dict: Metric values mapped by name. Empty if no samples were taken yet.
+        """
+        return cls.__snapshot
+
+    @classmethod
+    def add_listener(cls, callback: callable):
+        """ Subscribe to new snapshots.
+
+        Args:
+            callback (callable): Function, that will be called with each new snapshot dict.
+                Called from event loop, so it must be fast and non-blocking.
+        """
+        cls.__listeners.append(callback)
+
+    @classmethod
+    async def __loop(cls, interval: float, mount_points: list):
+        while True:
+            started = monotonic()
+            try:
+                snapshot = await TM_Offload.run(cls.sample, mount_points)
+            except Exception as e:
+                cls.__logger.error(f"Can't sample system metrics: < {str(e)} >")
+            else:
+                for callback in cls.__listeners:
+                    try:
+                        callback(snapshot)
+                    except Exception as e:
+                        cls.__logger.error(f"Metrics listener {callback} failed: < {str(e)} >")
+
+            await asyncio.sleep(max(0, interval - (monotonic() - started)))
+
+    @classmethod
+    def sample(cls, mount_points: list = (), baseline: dict = None) -> dict:
+        """ Take new metrics sample and compute rates from the previous one.
+
+        Args:
+            mount_points (list, optional): Mount points to check for free space. Defaults to ().
+            baseline (dict, optional): Counters of out-of-band sample to compute rates from.
+                If set, sampler state is left untouched and counters of this sample are written back to it,
+                so the rates of background sampler keep their full interval. Defaults to None.
+
+        Returns:
+            dict: New snapshot.
+        """
+        now = time()
+        snapshot = {"time": now}
+
+        if not os.path.isfile(os.path.join(PATH_PROC, 'stat')):
+            # Only uptime is available without procfs
+            snapshot["uptime"] = uptime()
+            if baseline is None:
+                cls.__snapshot = snapshot
+            return snapshot
+
+        counters = {"time": monotonic()}
+        counters["cpu"] = parse_stat(cls.__read('stat'))
+        counters["net"] = parse_net_dev(cls.__read('net/dev'))
+        counters["disk"] = parse_diskstats(cls.__read('diskstats'), cls.__devices)
+
+        snapshot["uptime"] = float(cls.__read('uptime').split()[0])
+        snapshot["load1"], snapshot["load5"], snapshot["load15"] = parse_loadavg(cls.__read('loadavg'))
+
+        mem = parse_meminfo(cls.__read('meminfo'))
+        snapshot["mem_total"] = mem.get("MemTotal", 0)
+        snapshot["mem_used"] = snapshot["mem_total"] - mem.get("MemAvailable", mem.get("MemFree", 0))
+        snapshot["mem"] = 100 * snapshot["mem_used"] / snapshot["mem_total"] if snapshot["mem_total"] else 0.0
+        snapshot["swap_total"] = mem.get("SwapTotal", 0)
+        snapshot["swap_used"] = snapshot["swap_total"] - mem.get("SwapFree", 0)
+        snapshot["swap"] = 100 * snapshot["swap_used"] / snapshot["swap_total"] if snapshot["swap_total"] else 0.0
+
+        for mount_point in mount_points:
+            try:
+                st = os.statvfs(mount_point)
+            except OSError:
+                continue
+            snapshot[f"disk_free:{mount_point}"] = 100 * st.f_bavail / st.f_blocks if st.f_blocks else 0.0
+
+        with cls.__lock:
+            if baseline is not None:
+                previous = baseline.copy()
+                baseline.clear()
+                baseline.update(counters)
+            else:
+                previous, cls.__previous = cls.__previous, counters
+        if previous:
+            elapsed = counters["time"] - previous["time"]
+            idle, total = counters["cpu"]
+            d_total = total - previous["cpu"][1]
+            snapshot["cpu"] = 100 * (1 - (idle - previous["cpu"][0]) / d_total) if d_total else 0.0
+            # Counters can go backwards when interface or device disappears
+            snapshot["net_rx"] = max(0, counters["net"][0] - previous["net"][0]) / elapsed
+            snapshot["net_tx"] = max(0, counters["net"][1] - previous["net"][1]) / elapsed
+            snapshot["disk_read"] = max(0, counters["disk"][0] - previous["disk"][0]) / elapsed
+            snapshot["disk_write"] = max(0, counters["disk"][1] - previous["disk"][1]) / elapsed
+
+        if baseline is None:
+            cls.__snapshot = snapshot
+        return snapshot
+
+    @staticmethod
+    def __read(name: str) -> str:
+        with open(os.path.join(PATH_PROC, name), 'rt') as f:
+            return f.read()
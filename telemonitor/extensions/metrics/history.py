@@ -0,0 +1,269 @@
+from time import time
+from array import array
+from logging import getLogger
+
+from aiogram.utils.markdown import bold, code, italic
+
+from telemonitor.extensions.metrics import format_bytes, parse_duration
+
+
+# (name, bucket size in seconds, capacity). Bucket size 0 means raw samples
+TIERS = (
+    ("raw", 0, 720),
+    ("1m", 60, 1440),
+    ("1h", 3600, 2160)
+)
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+SPARK_WIDTH = 30
+RATE_METRICS = ("net_rx", "net_tx", "disk_read", "disk_write")
+SKIPPED_METRICS = ("time", "uptime", "mem_total", "mem_used", "swap_total", "swap_used")
+
+
+class TM_RingBuffer:
+    def __init__(self, capacity: int):
+        """ Fixed-size series of (time, min, avg, max) points.
+
+        Args:
+            capacity (int): Maximum amount of stored points. The oldest points are overwritten.
+        """
+        self.__capacity = capacity
+        self.__head = 0
+        self.__count = 0
+        self.__time = array('d', bytes(8 * capacity))
+        self.__min = array('d', bytes(8 * capacity))
+        self.__avg = array('d', bytes(8 * capacity))
+        self.__max = array('d', bytes(8 * capacity))
+
+    def __len__(self) -> int:
+        return self.__count
+
+    def append(self, t: float, v_min: float, v_avg: float, v_max: float):
+        """ Add new point, overwriting the oldest one if buffer is full. """
+        i = self.__head
+        self.__time[i] = t
+        self.__min[i] = v_min
+        self.__avg[i] = v_avg
+        self.__max[i] = v_max
+
+        self.__head = (i + 1) % self.__capacity
+        if self.__count < self.__capacity:
+            self.__count += 1
+
+    def since(self, t: float) -> list:
+        """ Get points newer than `t` in chronological order.
+
+        Args:
+            t (float): Unix timestamp.
+
+        Returns:
+            list: List of (time, min, avg, max) tuples.
+        """
+        points = []
+        start = (self.__head - self.__count) % self.__capacity
+
+        for n in range(self.__count):
+            i = (start + n) % self.__capacity
+            if self.__time[i] > t:
+                points.append((self.__time[i], self.__min[i], self.__avg[i], self.__max[i]))
+
+        return points
+
+    @property
+    def oldest(self) -> float:
+        """ Get timestamp of the oldest stored point, or None if buffer is empty. """
+        if not self.__count:
+            return None
+        return self.__time[(self.__head - self.__count) % self.__capacity]
+
+
+class TM_MetricHistory:
+    def __init__(self):
+        """ Multi-resolution history of single metric with raw, 1 minute and 1 hour rollups """
+        self.__tiers = [TM_RingBuffer(capacity) for _, _, capacity in TIERS]
+        # Pending rollup for each aggregated tier: [bucket start, min, sum, count, max]
+        self.__pending = [None] * len(TIERS)
+
+    def add(self, t: float, value: float):
+        """ Record new sample and update rollups.
+
+        Args:
+            t (float): Unix timestamp of sample.
+            value (float): Sample value.
+        """
+        self.__tiers[0].append(t, value, value, value)
+        self.__rollup(1, t, value, value, value, 1)
+
+    def __rollup(self, tier: int, t: float, v_min: float, v_sum: float, v_max: float, count: int):
+        if tier >= len(TIERS):
+            return
+
+        bucket = t - t % TIERS[tier][1]
+        pending = self.__pending[tier]
+
+        if pending is not None and pending[0] != bucket:
+            # Bucket is complete, flush it and pass to the next tier
+            start, p_min, p_sum, p_count, p_max = pending
+            self.__tiers[tier].append(start, p_min, p_sum / p_count, p_max)
+            self.__rollup(tier + 1, start, p_min, p_sum, p_max, p_count)
+            pending = None
+
+        if pending is None:
+            self.__pending[tier] = [bucket, v_min, v_sum, count, v_max]
+        else:
+            pending[1] = min(pending[1], v_min)
+            pending[2] += v_sum
+            pending[3] += count
+            pending[4] = max(pending[4], v_max)
+
+    def query(self, since: float) -> tuple:
+        """ Get points from the finest tier, that covers requested period.
+
+        Args:
+            since (float): Unix timestamp of period start.
+
+        Returns:
+            tuple: (
+                str,  # name of used tier
+                list  # list of (time, min, avg, max) tuples
+            )
+        """
+        for (name, _, _), tier in zip(TIERS, self.__tiers):
+            if tier.oldest is not None and tier.oldest <= since:
+                return name, tier.since(since)
+
+        # History is shorter than requested period, use the tier that covers most of it
+        best = 0
+        for n in range(1, len(TIERS)):
+            oldest = self.__tiers[n].oldest
+            if oldest is not None and (self.__tiers[best].oldest is None or oldest + TIERS[n][1] < self.__tiers[best].oldest):
+                best = n
+        return TIERS[best][0], self.__tiers[best].since(since)
+
+
+class TM_History:
+    """ Bounded in-memory storage for metrics history """
+    __logger = getLogger(__name__)
+    __metrics = {}
+
+    @classmethod
+    def record(cls, snapshot: dict):
+        """ Record all numeric metrics from snapshot. Should be subscribed with `TM_Metrics.add_listener`.
+
+        Args:
+            snapshot (dict): Metrics snapshot.
+        """
+        t = snapshot["time"]
+        for key, value in snapshot.items():
+            if key in SKIPPED_METRICS:
+                continue
+
+            history = cls.__metrics.get(key)
+            if history is None:
+                history = cls.__metrics[key] = TM_MetricHistory()
+                cls.__logger.debug(f"Started recording history of metric '{key}'")
+            history.add(t, value)
+
+    @classmethod
+    def metrics(cls) -> list:
+        """ Get names of all recorded metrics.
+
+        Returns:
+            list: Metric names.
+        """
+        return sorted(cls.__metrics)
+
+    @classmethod
+    def query(cls, metric: str, window: float, now: float = None) -> tuple:
+        """ Get history of metric.
+
+        Args:
+            metric (str): Metric name.
+            window (float): Period length in seconds.
+            now (float, optional): Period end. Defaults to current time.
+
+        Returns:
+            tuple: Tier name and list of (time, min, avg, max) tuples, see `TM_MetricHistory.query`.
+        """
+        if now is None:
+            now = time()
+        return cls.__metrics[metric].query(now - window)
+
+    @classmethod
+    def render(cls, args: str) -> str:
+        """ Render reply for `/history <metric> [window]` command.
+
+        Args:
+            args (str): Command arguments.
+
+        Returns:
+            str: Formatted message, ready for Telegram.
+        """
+        args = args.split()
+        usage = f"{bold('Usage')}: {code('/history <metric> [window]')}, for example {code('/history cpu 2h')}\n{bold('Metrics')}: {code(', '.join(cls.metrics()) or '-')}"
+
+        if not args or args[0] not in cls.__metrics:
+            return usage
+
+        window_str = args[1] if len(args) > 1 else '1h'
+        try:
+            window = parse_duration(window_str)
+        except ValueError:
+            return usage
+
+        tier, points = cls.query(args[0], window)
+        if not points:
+            return f"No history of {code(args[0])} for this period"
+
+        points = downsample(points, SPARK_WIDTH)
+        v_min = min(p[1] for p in points)
+        v_max = max(p[3] for p in points)
+        v_avg = sum(p[2] for p in points) / len(points)
+        fmt = (lambda v: f"{format_bytes(v)}/s") if args[0] in RATE_METRICS else (lambda v: f"{v:.2f}")
+
+        return (
+            f"{bold(args[0])} {italic(f'{window_str}, {tier} resolution')}\n"
+            f"{code(sparkline([p[2] for p in points], v_min, v_max))}\n"
+            f"{bold('Min')}: {code(fmt(v_min))} {bold('Avg')}: {code(fmt(v_avg))} {bold('Max')}: {code(fmt(v_max))}"
+        )
+
+
+def downsample(points: list, width: int) -> list:
+    """ Merge points into `width` buckets keeping min, avg and max of each one.
+
+    Args:
+        points (list): List of (time, min, avg, max) tuples.
+        width (int): Maximum amount of output points.
+
+    Returns:
+        list: Downsampled list of (time, min, avg, max) tuples.
+    """
+    if len(points) <= width:
+        return points
+
+    result = []
+    for n in range(width):
+        chunk = points[n * len(points) // width:(n + 1) * len(points) // width]
+        result.append((
+            chunk[0][0],
+            min(p[1] for p in chunk),
+            sum(p[2] for p in chunk) / len(chunk),
+            max(p[3] for p in chunk)
+        ))
+    return result
+
+
+def sparkline(values: list, v_min: float, v_max: float) -> str:
+    """ Render values as unicode sparkline.
+
+    Args:
+        values (list): Values to render.
+        v_min (float): Value of the lowest bar.
+        v_max (float): Value of the highest bar.
+
+    Returns:
+        str: Sparkline string.
+    """
+    span = v_max - v_min
+    if not span:
+        return SPARK_CHARS[0] * len(values)
+    return "".join(SPARK_CHARS[min(len(SPARK_CHARS) - 1, int((v - v_min) / span * len(SPARK_CHARS)))] for v in values)
@@ -0,0 +1,158 @@
+import os
+import heapq
+import threading
+from time import monotonic, sleep
+
+from telemonitor.extensions import metrics
+from telemonitor.extensions.metrics import format_bytes
+
+
+# Results of scans, requested more often than this interval (in seconds), are reused
+SCAN_MIN_INTERVAL = 1
+# Delay between two scans, when CPU usage is requested without previous scan
+FIRST_SCAN_DELAY = 0.5
+STAT_READ_SIZE = 1024
+NAME_WIDTH = 20
+
+
+def parse_pid_stat(text: bytes) -> tuple:
+    """ Parse `/proc/<pid>/stat`.
+
+    Args:
+        text (bytes): Content of `/proc/<pid>/stat`.
+
+    Returns:
+        tuple: (
+            str,  # command name
+            int,  # start time in jiffies since boot, to detect PID reuse
+            int,  # user + system jiffies
+            int   # resident set size in pages
+        )
+    """
+    # Command name may contain spaces and parentheses, so it's bounded by the last `)`
+    start = text.index(b'(')
+    end = text.rindex(b')')
+    fields = text[end + 2:].split()
+    return text[start + 1:end].decode(errors='replace'), int(fields[19]), int(fields[11]) + int(fields[12]), int(fields[21])
+
+
+class TM_Processes:
+    """ Incremental `/proc` scanner, that computes CPU usage of each process from deltas of cached jiffies """
+    __lock = threading.Lock()
+    # {pid: (start time, jiffies)} of the previous scan. Dead processes are evicted on each scan
+    __table = {}
+    __scanned = None
+    __result = []
+    __clock_ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+    __page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+    @classmethod
+    def is_available(cls) -> bool:
+        """ Check if process list can be read on this platform.
+
+        Returns:
+            bool: `/proc` is available.
+        """
+        return os.path.isfile(os.path.join(metrics.PATH_PROC, 'stat'))
+
+    @classmethod
+    def scan(cls) -> list:
+        """ Read stat of all processes and compute CPU usage since the previous scan.
+
+        Blocking, so must be called with `TM_Offload.run`.
+
+        Returns:
+            list: List of (pid, name, cpu percent, rss bytes) tuples. CPU usage is None on the first scan.
+        """
+        with cls.__lock:
+            now = monotonic()
+            if cls.__scanned is not None and now - cls.__scanned < SCAN_MIN_INTERVAL:
+                return cls.__result
+
+            elapsed_ticks = (now - cls.__scanned) * cls.__clock_ticks if cls.__scanned is not None else 0
+            previous = cls.__table
+            table = {}
+            result = []
+
+            for entry in os.listdir(metrics.PATH_PROC):
+                if not entry.isdigit():
+                    continue
+                try:
+                    fd = os.open(os.path.join(metrics.PATH_PROC, entry, 'stat'), os.O_RDONLY)
+                    try:
+                        data = os.read(fd, STAT_READ_SIZE)
+                    finally:
+                        os.close(fd)
+                    name, started, jiffies, rss = parse_pid_stat(data)
+                except (OSError, ValueError, IndexError):
+                    # Process exited while scanning or it's a kernel thread without stat fields
+                    continue
+
+                pid = int(entry)
+                table[pid] = (started, jiffies)
+                cpu = None
+                if elapsed_ticks:
+                    last = previous.get(pid)
+                    # New process or reused PID is counted from its start
+                    base = last[1] if last is not None and last[0] == started else 0
+                    cpu = 100 * (jiffies - base) / elapsed_ticks
+                result.append((pid, name, cpu, rss * cls.__page_size))
+
+            cls.__table = table
+            cls.__scanned = now
+            cls.__result = result
+            return result
+
+    @classmethod
+    def top(cls, n: int) -> tuple:
+        """ Scan processes and pick the heaviest ones. Two scans are made if there's no previous one.
+
+        Blocking, so must be called with `TM_Offload.run`.
+
+        Args:
+            n (int): Amount of processes in each list.
+
+        Returns:
+            tuple: (
+                list,  # top processes by CPU usage
+                list,  # top processes by resident memory
+                int    # total amount of processes
+            )
+        """
+        with cls.__lock:
+            primed = cls.__scanned is not None
+        if not primed:
+            cls.scan()
+            sleep(FIRST_SCAN_DELAY)
+
+        result = cls.scan()
+        by_cpu = heapq.nlargest(n, result, key=lambda p: p[2] or 0.0)
+        by_rss = heapq.nlargest(n, result, key=lambda p: p[3])
+        return by_cpu, by_rss, len(result)
+
+    @classmethod
+    def render(cls, n: int) -> str:
+        """ Render top processes message.
+
+        Blocking, so must be called with `TM_Offload.run`.
+
+        Args:
+            n (int): Amount of processes in each list.
+
+        Returns:
+            str: Formatted message, ready for Telegram.
+        """
+        from aiogram.utils.markdown import bold, code, pre
+
+        if not cls.is_available():
+            return code("Process list is available only on Linux")
+
+        by_cpu, by_rss, total = cls.top(n)
+        lines = [f"{bold('Processes')}: {code(total)}"]
+        for title, processes in (("Top CPU", by_cpu), ("Top Memory", by_rss)):
+            rows = [f"{'PID':>7} {'CPU':>6} {'RSS':>10}  NAME"]
+            for pid, name, cpu, rss in processes:
+                rows.append(f"{pid:>7} {'-' if cpu is None else f'{cpu:.1f}%':>6} {format_bytes(rss):>10}  {name[:NAME_WIDTH]}")
+            lines += [f"\n{bold(title)}", pre("\n".join(rows))]
+
+        return "\n".join(lines)
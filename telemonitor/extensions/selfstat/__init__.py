@@ -0,0 +1,250 @@
+import os
+import gc
+import asyncio
+import threading
+import tracemalloc
+from time import monotonic
+from logging import getLogger
+
+from aiogram.utils.markdown import bold, code, italic, pre
+
+from telemonitor.helpers import TM_Config, TM_Offload
+from telemonitor.extensions.metrics import PATH_PROC, format_bytes, format_uptime
+
+
+# Allocation sites are grouped by single line, deeper tracebacks cost much more memory
+TRACEMALLOC_FRAMES = 1
+RSS_CHECK_INTERVAL = 30
+# Exit code of restart under systemd service, that restarts the bot itself. Same as `EX_TEMPFAIL`
+RESTART_EXIT_CODE = 75
+# Own frames of tracing and import machinery are never leaks of the bot
+TRACE_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>")
+)
+
+
+def read_status() -> dict:
+    """ Read memory and threads of the current process from procfs.
+
+    Returns:
+        dict: `VmRSS`, `VmHWM` (in bytes) and `Threads` values, empty if procfs isn't available.
+    """
+    result = {}
+    try:
+        with open(os.path.join(PATH_PROC, "self", "status"), "rt") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    result[key] = int(value.split()[0]) * 1024
+                elif key == "Threads":
+                    result[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return result
+
+
+def count_fds() -> int:
+    """ Count open file descriptors of the current process.
+
+    Returns:
+        int: Amount of descriptors or None if procfs isn't available.
+    """
+    try:
+        return len(os.listdir(os.path.join(PATH_PROC, "self", "fd")))
+    except OSError:
+        return None
+
+
+def get_rss() -> int:
+    """ Get resident memory size of the current process.
+
+    Returns:
+        int: RSS in bytes or None if it's not available.
+    """
+    rss = read_status().get("VmRSS")
+    if rss is None:
+        try:
+            import resource
+        except ImportError:
+            return None
+        # Peak value is the best estimate without procfs, `ru_maxrss` is in KiB on Linux and in bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        rss *= 1 if os.uname().sysname == "Darwin" else 1024
+    return rss
+
+
+class TM_SelfStat:
+    """ Resource usage of the bot process: memory, descriptors, threads, tasks, garbage collector and allocation growth """
+    __logger = getLogger(__name__)
+    __task = None
+    __started = monotonic()
+    __snapshot = None
+    __snapshot_time = None
+    __growth = []
+    __growth_period = 0
+    __restart_reason = None
+    __stop_loop = None
+
+    @classmethod
+    def start(cls, stop_loop: callable = None) -> bool:
+        """ Start periodic allocation snapshots and RSS ceiling checks, if they are enabled in config file.
+
+        Args:
+            stop_loop (callable, optional): Function, that stops the bot gracefully, called when RSS ceiling is exceeded. Defaults to None.
+
+        Returns:
+            bool: Background checks were started.
+        """
+        cfg = TM_Config.model().diagnostics
+        cls.__stop_loop = stop_loop
+        if cfg.tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            cls.__logger.info("Memory allocation tracing is enabled")
+
+        if cls.__task is None and (cfg.tracemalloc or cfg.rss_limit_mb > 0):
+            cls.__task = asyncio.get_event_loop().create_task(cls.__loop(cfg.snapshot_interval, cfg.rss_limit_mb * 1024 * 1024))
+            return True
+        return False
+
+    @classmethod
+    def stop(cls):
+        """ Stop background checks and allocation tracing. """
+        if cls.__task is not None:
+            cls.__task.cancel()
+            cls.__task = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        cls.__snapshot = None
+
+    @classmethod
+    def restart_reason(cls) -> str:
+        """ Get reason of requested restart.
+
+        Returns:
+            str: Reason or None, if restart wasn't requested.
+        """
+        return cls.__restart_reason
+
+    @classmethod
+    async def collect(cls) -> dict:
+        """ Get resource usage of the bot process.
+
+        Returns:
+            dict: Usage values, None for ones not available on this platform.
+        """
+        status, fds = await TM_Offload.run(lambda: (read_status(), count_fds()))
+        return {
+            "uptime": monotonic() - cls.__started,
+            "rss": status["VmRSS"] if "VmRSS" in status else await TM_Offload.run(get_rss),
+            "rss_peak": status.get("VmHWM"),
+            "fds": fds,
+            "threads": status.get("Threads"),
+            "python_threads": threading.active_count(),
+            "tasks": len(asyncio.all_tasks()),
+            "gc_counts": gc.get_count(),
+            "gc_stats": gc.get_stats(),
+            "gc_garbage": len(gc.garbage),
+            "traced": tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else None
+        }
+
+    @classmethod
+    async def take_snapshot(cls) -> list:
+        """ Take allocation snapshot and compare it with the previous one.
+
+        Returns:
+            list: Top growing allocation sites as `tracemalloc.StatisticDiff` objects, empty on the first snapshot.
+        """
+        if not tracemalloc.is_tracing():
+            return []
+
+        snapshot = await TM_Offload.run(lambda: tracemalloc.take_snapshot().filter_traces(TRACE_FILTERS))
+        now = monotonic()
+        if cls.__snapshot is not None:
+            top = TM_Config.model().diagnostics.top_allocations
+            diff = await TM_Offload.run(snapshot.compare_to, cls.__snapshot, "lineno")
+            cls.__growth = [d for d in diff if d.size_diff > 0][:top]
+            cls.__growth_period = now - cls.__snapshot_time
+        cls.__snapshot, cls.__snapshot_time = snapshot, now
+        return cls.__growth
+
+    @classmethod
+    async def render(cls, args: str = "") -> str:
+        """ Render reply for `/selfstat [snapshot]` command.
+
+        Args:
+            args (str, optional): Command arguments, `snapshot` to compare allocations right now. Defaults to "".
+
+        Returns:
+            str: Formatted message, ready for Telegram.
+        """
+        if args.strip() == "snapshot":
+            await cls.take_snapshot()
+
+        stat = await cls.collect()
+        fmt = (lambda v: "-" if v is None else str(v))
+        lines = [
+            f"{bold('Uptime')}: {code(format_uptime(stat['uptime']))}",
+            f"{bold('RSS')}: {code('-' if stat['rss'] is None else format_bytes(stat['rss']))}"
+            + ("" if stat["rss_peak"] is None else f" {italic('peak')} {code(format_bytes(stat['rss_peak']))}"),
+            f"{bold('Open files')}: {code(fmt(stat['fds']))}",
+            f"{bold('Threads')}: {code(fmt(stat['threads']))} {italic('python')} {code(stat['python_threads'])}",
+            f"{bold('Asyncio tasks')}: {code(stat['tasks'])}",
+            f"{bold('GC')}: {code(cls.__format_gc(stat))}"
+        ]
+
+        if stat["traced"] is None:
+            lines.append(italic("Allocation tracing is disabled"))
+            return "\n".join(lines)
+
+        lines.append(f"{bold('Traced')}: {code(format_bytes(stat['traced'][0]))} {italic('peak')} {code(format_bytes(stat['traced'][1]))}")
+        if not cls.__growth:
+            lines.append(italic("No allocation growth yet, send /selfstat snapshot to compare with the previous snapshot"))
+        else:
+            rows = [f"+{format_bytes(d.size_diff)} ({d.count_diff:+d}) {cls.__format_site(d.traceback)}" for d in cls.__growth]
+            lines.append(f"{bold('Top growing allocations')} {italic(f'in {format_uptime(cls.__growth_period)}')}")
+            lines.append(pre("\n".join(rows)))
+        return "\n".join(lines)
+
+    @classmethod
+    async def __loop(cls, snapshot_interval: float, rss_limit: int):
+        next_snapshot = monotonic() + snapshot_interval
+        while True:
+            await asyncio.sleep(RSS_CHECK_INTERVAL if rss_limit else snapshot_interval)
+
+            if tracemalloc.is_tracing() and monotonic() >= next_snapshot:
+                next_snapshot = monotonic() + snapshot_interval
+                growth = await cls.take_snapshot()
+                if growth:
+                    top = growth[0]
+                    cls.__logger.info(f"Top growing allocation site: {cls.__format_site(top.traceback)} +{top.size_diff} bytes")
+
+            if rss_limit:
+                rss = await TM_Offload.run(get_rss)
+                if rss is not None and rss > rss_limit:
+                    cls.__restart_reason = f"RSS {format_bytes(rss)} exceeded limit of {format_bytes(rss_limit)}"
+                    cls.__logger.warning(f"{cls.__restart_reason}, restarting the bot")
+                    if cls.__stop_loop is not None:
+                        cls.__stop_loop()
+                    return
+
+    @staticmethod
+    def __format_gc(stat: dict) -> str:
+        collections = "/".join(str(s["collections"]) for s in stat["gc_stats"])
+        collected = sum(s["collected"] for s in stat["gc_stats"])
+        uncollectable = sum(s["uncollectable"] for s in stat["gc_stats"])
+        counts = "/".join(str(c) for c in stat["gc_counts"])
+        return f"runs {collections}, pending {counts}, collected {collected}, uncollectable {uncollectable}, garbage {stat['gc_garbage']}"
+
+    @staticmethod
+    def __format_site(traceback: tracemalloc.Traceback) -> str:
+        frame = traceback[0]
+        parts = frame.filename.replace("\\", "/").split("/")
+        # Path inside of site-packages or project is enough to find the line
+        for marker in ("site-packages", "telemonitor"):
+            if marker in parts:
+                parts = parts[parts.index(marker) + (marker == "site-packages"):]
+                break
+        return f"{'/'.join(parts[-4:])}:{frame.lineno}"
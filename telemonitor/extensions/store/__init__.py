@@ -0,0 +1,411 @@
+import queue
+import sqlite3
+import threading
+from time import time, monotonic, strftime, gmtime, localtime
+from logging import getLogger
+
+from aiogram.utils.markdown import bold, code, pre
+
+from telemonitor.helpers import TM_Config
+from telemonitor.extensions.metrics import format_bytes
+
+
+PATH_STORE = "./state.db"
+# Writer commits after this delay (in seconds) or this amount of rows, whichever comes first
+BATCH_DELAY = 0.5
+BATCH_MAX = 5000
+QUEUE_MAX = 100_000
+RETENTION_CHECK_INTERVAL = 3600
+LIST_DEFAULT = 20
+LIST_MAX = 200
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS audit (time REAL NOT NULL, user_id INTEGER, action TEXT NOT NULL, details TEXT)",
+    "CREATE INDEX IF NOT EXISTS audit_time ON audit (time)",
+    "CREATE INDEX IF NOT EXISTS audit_user ON audit (user_id, time)",
+    "CREATE TABLE IF NOT EXISTS transfers (time REAL NOT NULL, user_id INTEGER, direction TEXT NOT NULL, name TEXT NOT NULL, size INTEGER)",
+    "CREATE INDEX IF NOT EXISTS transfers_time ON transfers (time)",
+    "CREATE INDEX IF NOT EXISTS transfers_name ON transfers (name, time)"
+)
+SQL_AUDIT = "INSERT INTO audit VALUES (?, ?, ?, ?)"
+SQL_TRANSFER = "INSERT INTO transfers VALUES (?, ?, ?, ?, ?)"
+# Metrics are partitioned by day, so retention drops whole tables instead of deleting rows one by one
+METRICS_PREFIX = "metrics_"
+
+
+def metrics_table(t: float) -> str:
+    """ Get name of metrics partition.
+
+    Args:
+        t (float): Unix time.
+
+    Returns:
+        str: Table name, like `metrics_20240131`.
+    """
+    return METRICS_PREFIX + strftime("%Y%m%d", gmtime(t))
+
+
+def format_time(t: float) -> str:
+    """ Format unix time as local date and time.
+
+    Args:
+        t (float): Unix time.
+
+    Returns:
+        str: Time, like `2024-01-31 12:00:00`.
+    """
+    return strftime("%Y-%m-%d %H:%M:%S", localtime(t))
+
+
+def parse_list_args(args: str) -> tuple:
+    """ Parse `[count] [filter]` arguments of list commands.
+
+    Args:
+        args (str): Command arguments.
+
+    Raises:
+        ValueError: Count isn't a positive number.
+
+    Returns:
+        tuple: (
+            int,  # amount of rows, up to LIST_MAX
+            str   # filter or None
+        )
+    """
+    args = args.split(maxsplit=1)
+    limit = int(args[0]) if args else LIST_DEFAULT
+    if limit <= 0:
+        raise ValueError("Count must be positive")
+    return min(limit, LIST_MAX), args[1].strip() if len(args) > 1 else None
+
+
+class TM_Store:
+    """ Embedded SQLite store of audit trail, file transfers and metrics.
+
+    All writes are queued and committed by background thread in batches, so callers never wait for disk.
+    """
+    __logger = getLogger(__name__)
+    __queue = None
+    __thread = None
+    __path = None
+    __local = threading.local()
+    __dropped = 0
+    __written = 0
+
+    @classmethod
+    def start(cls, path: str = None) -> bool:
+        """ Open database and start writer thread, if store is enabled in config file.
+
+        Args:
+            path (str, optional): Path to database file. Defaults to PATH_STORE.
+
+        Returns:
+            bool: Store was started.
+        """
+        cfg = TM_Config.model().store
+        if not cfg.enabled or cls.__thread is not None:
+            return False
+
+        cls.__path = PATH_STORE if path is None else path
+        connection = cls.__connect()
+        with connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+        cls.__queue = queue.Queue(maxsize=QUEUE_MAX)
+        cls.__thread = threading.Thread(
+            target=cls.__writer, args=(connection, cfg.retention_days, cfg.metrics_retention_days), name="TM_StoreWriter", daemon=True
+        )
+        cls.__thread.start()
+        cls.__logger.info(f"State store opened in {cls.__path}")
+        return True
+
+    @classmethod
+    def stop(cls):
+        """ Commit all queued rows and close database. """
+        if cls.__thread is None:
+            return
+
+        cls.__queue.put(None)
+        cls.__thread.join()
+        cls.__thread = None
+        cls.__queue = None
+
+    @classmethod
+    def flush(cls):
+        """ Wait until all queued rows are committed. Blocking, so must be called with `TM_Offload.run`. """
+        if cls.__queue is not None:
+            cls.__queue.join()
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        """ Check if store was started.
+
+        Returns:
+            bool: Store is running.
+        """
+        return cls.__thread is not None
+
+    @classmethod
+    def audit(cls, user_id: int, action: str, details: str = None):
+        """ Record user action.
+
+        Args:
+            user_id (int): Telegram user id.
+            action (str): Action name, like `reboot`.
+            details (str, optional): Action arguments. Defaults to None.
+        """
+        cls.__put((SQL_AUDIT, (time(), user_id, action, details)))
+
+    @classmethod
+    def transfer(cls, user_id: int, direction: str, name: str, size: int = None):
+        """ Record file transfer.
+
+        Args:
+            user_id (int): Telegram user id.
+            direction (str): `in` for files received from user, `out` for files sent to user.
+            name (str): File name, relative to shared dir.
+            size (int, optional): File size in bytes. Defaults to None.
+        """
+        cls.__put((SQL_TRANSFER, (time(), user_id, direction, name, size)))
+
+    @classmethod
+    def record_metrics(cls, snapshot: dict):
+        """ Metrics listener, that saves snapshot.
+
+        Args:
+            snapshot (dict): New snapshot.
+        """
+        t = snapshot["time"]
+        rows = [(t, key, value) for key, value in snapshot.items() if key != "time" and isinstance(value, (int, float))]
+        cls.__put((metrics_table(t), rows))
+
+    @classmethod
+    def stats(cls) -> tuple:
+        """ Get writer counters.
+
+        Returns:
+            tuple: (
+                int,  # committed rows
+                int   # rows dropped, because writer queue was full
+            )
+        """
+        return cls.__written, cls.__dropped
+
+    @classmethod
+    def recent_audit(cls, limit: int = LIST_DEFAULT, user_id: int = None) -> list:
+        """ Get the latest audit records.
+
+        Blocking, so must be called with `TM_Offload.run`.
+
+        Args:
+            limit (int, optional): Amount of records. Defaults to LIST_DEFAULT.
+            user_id (int, optional): Show only actions of this user. Defaults to None.
+
+        Returns:
+            list: (time, user_id, action, details) rows, the newest first.
+        """
+        if user_id is None:
+            return cls.__query("SELECT * FROM audit ORDER BY time DESC LIMIT ?", (limit,))
+        return cls.__query("SELECT * FROM audit WHERE user_id = ? ORDER BY time DESC LIMIT ?", (user_id, limit))
+
+    @classmethod
+    def recent_transfers(cls, limit: int = LIST_DEFAULT, name: str = None) -> list:
+        """ Get the latest file transfers.
+
+        Blocking, so must be called with `TM_Offload.run`.
+
+        Args:
+            limit (int, optional): Amount of records. Defaults to LIST_DEFAULT.
+            name (str, optional): Show only transfers of files with names starting with this prefix. Defaults to None.
+
+        Returns:
+            list: (time, user_id, direction, name, size) rows, the newest first.
+        """
+        if name is None:
+            return cls.__query("SELECT * FROM transfers ORDER BY time DESC LIMIT ?", (limit,))
+        # Range condition instead of LIKE, so `transfers_name` index is used
+        return cls.__query(
+            "SELECT * FROM transfers WHERE name >= ? AND name < ? ORDER BY time DESC LIMIT ?",
+            (name, name + "\U0010ffff", limit)
+        )
+
+    @classmethod
+    def metric_history(cls, metric: str, since: float, until: float = None) -> list:
+        """ Get saved values of metric.
+
+        Blocking, so must be called with `TM_Offload.run`.
+
+        Args:
+            metric (str): Metric name, like `cpu`.
+            since (float): Unix time to start from.
+            until (float, optional): Unix time to end at. Defaults to now.
+
+        Returns:
+            list: (time, value) rows, the oldest first.
+        """
+        until = time() if until is None else until
+        tables = [t for t in cls.__metric_tables() if metrics_table(since) <= t <= metrics_table(until)]
+        rows = []
+        for table in tables:
+            rows += cls.__query(f"SELECT time, value FROM {table} WHERE name = ? AND time >= ? AND time <= ? ORDER BY time", (metric, since, until))
+        return rows
+
+    @classmethod
+    def render_audit(cls, args: str) -> str:
+        """ Render reply for `/audit [count] [user id]` command. Blocking, so must be called with `TM_Offload.run`.
+
+        Args:
+            args (str): Command arguments.
+
+        Returns:
+            str: Formatted message, ready for Telegram.
+        """
+        usage = f"{bold('Usage')}: {code('/audit [count] [user id]')}, for example {code('/audit 50')}"
+        try:
+            limit, user_id = parse_list_args(args)
+            user_id = None if user_id is None else int(user_id)
+        except ValueError:
+            return usage
+
+        rows = cls.recent_audit(limit, user_id) if cls.is_enabled() else []
+        if not rows:
+            return "No recorded actions"
+        lines = [f"{format_time(t)} {uid} {action}" + ("" if details is None else f" {details}") for t, uid, action, details in rows]
+        return bold("Recent actions") + "\n" + pre("\n".join(lines))
+
+    @classmethod
+    def render_transfers(cls, args: str) -> str:
+        """ Render reply for `/transfers [count] [name prefix]` command. Blocking, so must be called with `TM_Offload.run`.
+
+        Args:
+            args (str): Command arguments.
+
+        Returns:
+            str: Formatted message, ready for Telegram.
+        """
+        usage = f"{bold('Usage')}: {code('/transfers [count] [name prefix]')}, for example {code('/transfers 50 photos/')}"
+        try:
+            limit, name = parse_list_args(args)
+        except ValueError:
+            return usage
+
+        rows = cls.recent_transfers(limit, name) if cls.is_enabled() else []
+        if not rows:
+            return "No recorded file transfers"
+        lines = [
+            f"{format_time(t)} {uid} {'<-' if direction == 'in' else '->'} {name} ({'?' if size is None else format_bytes(size)})"
+            for t, uid, direction, name, size in rows
+        ]
+        return bold("Recent file transfers") + "\n" + pre("\n".join(lines))
+
+    @classmethod
+    def __put(cls, item: tuple):
+        if cls.__queue is None:
+            return
+        try:
+            cls.__queue.put_nowait(item)
+        except queue.Full:
+            cls.__dropped += 1
+
+    @classmethod
+    def __connect(cls) -> sqlite3.Connection:
+        connection = sqlite3.connect(cls.__path, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # With WAL, commits are durable after checkpoint, but database is never corrupted. Saves fsync on each commit
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA busy_timeout=5000")
+        return connection
+
+    @classmethod
+    def __query(cls, sql: str, params: tuple) -> list:
+        # Each offload thread keeps its own read connection, WAL readers don't block the writer
+        connection = getattr(cls.__local, "connection", None)
+        if connection is None or getattr(cls.__local, "path", None) != cls.__path:
+            connection = cls.__local.connection = cls.__connect()
+            cls.__local.path = cls.__path
+        return connection.execute(sql, params).fetchall()
+
+    @classmethod
+    def __metric_tables(cls) -> list:
+        rows = cls.__query("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?", (METRICS_PREFIX + "%",))
+        return sorted(r[0] for r in rows)
+
+    @classmethod
+    def __writer(cls, connection: sqlite3.Connection, retention_days: float, metrics_retention_days: float):
+        tables = set(r[0] for r in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+        next_retention = 0
+        stopping = False
+
+        while not stopping:
+            batch = [cls.__queue.get()]
+            deadline = monotonic() + BATCH_DELAY
+            while len(batch) < BATCH_MAX:
+                timeout = deadline - monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(cls.__queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            if None in batch:
+                stopping = True
+                batch = [item for item in batch if item is not None]
+
+            try:
+                cls.__written += cls.__commit(connection, batch, tables)
+                if monotonic() >= next_retention:
+                    next_retention = monotonic() + RETENTION_CHECK_INTERVAL
+                    cls.__apply_retention(connection, tables, retention_days, metrics_retention_days)
+            except sqlite3.Error as e:
+                cls.__logger.error(f"Can't write {len(batch)} items to state store: < {str(e)} >")
+            finally:
+                for _ in range(len(batch) + stopping):
+                    cls.__queue.task_done()
+
+        connection.close()
+
+    @classmethod
+    def __commit(cls, connection: sqlite3.Connection, batch: list, tables: set) -> int:
+        # Rows of the same statement are inserted with single `executemany` call
+        grouped = {}
+        for target, rows in batch:
+            if target.startswith(METRICS_PREFIX):
+                grouped.setdefault(target, []).extend(rows)
+            else:
+                grouped.setdefault(target, []).append(rows)
+
+        written = 0
+        created = []
+        with connection:
+            connection.execute("BEGIN")
+            for target, rows in grouped.items():
+                if target.startswith(METRICS_PREFIX):
+                    if target not in tables:
+                        connection.execute(f"CREATE TABLE IF NOT EXISTS {target} (time REAL NOT NULL, name TEXT NOT NULL, value REAL)")
+                        connection.execute(f"CREATE INDEX IF NOT EXISTS {target}_name ON {target} (name, time)")
+                        created.append(target)
+                    connection.executemany(f"INSERT INTO {target} VALUES (?, ?, ?)", rows)
+                else:
+                    connection.executemany(target, rows)
+                written += len(rows)
+
+        # Tables are known only after commit, rolled back batch must create them again
+        tables.update(created)
+        return written
+
+    @classmethod
+    def __apply_retention(cls, connection: sqlite3.Connection, tables: set, retention_days: float, metrics_retention_days: float):
+        now = time()
+        with connection:
+            connection.execute("BEGIN")
+            for table in ("audit", "transfers"):
+                connection.execute(f"DELETE FROM {table} WHERE time < ?", (now - retention_days * 86400,))
+            oldest = metrics_table(now - metrics_retention_days * 86400)
+            dropped = sorted(t for t in tables if t.startswith(METRICS_PREFIX) and t < oldest)
+            for table in dropped:
+                connection.execute(f"DROP TABLE {table}")
+
+        tables.difference_update(dropped)
+        for table in dropped:
+            cls.__logger.info(f"Metrics partition {table} was removed by retention")
@@ -5,7 +5,7 @@ from os import path, remove
 from telemonitor.helpers import TM_Config, DEF_CFG, tm_colorama
 
 
-__version = 1
+__version = 2
 __logger = getLogger(__name__)
 
 # All relative paths are starting from root directory of module `telemonitor`,
@@ -46,14 +46,16 @@ def cli(mode: str):
                 print("Systemd service configuration file doesn't exist, nothing to remove")
 
         elif mode == 'status':
-            cfg_service = TM_Config.get()['systemd_service']
+            cfg_service = TM_Config.model().systemd_service
             service_exists = __systemd_config_exists()
             text = f"Telemonitor Systemd Service - Status\
                      \n\n- Is installed: {colorama.Fore.CYAN}{service_exists}{colorama.Fore.RESET}"
 
             if service_exists:
-                text += f"\n- Version: {colorama.Fore.CYAN}{cfg_service['version']}{colorama.Fore.RESET}\
+                text += f"\n- Version: {colorama.Fore.CYAN}{cfg_service.version}{colorama.Fore.RESET}\
                           \n- Installation path: {colorama.Fore.CYAN}{__service_config_final_path}{colorama.Fore.RESET}"
+                if cfg_service.version < __version:
+                    text += f"\n- Upgrade to version {colorama.Fore.CYAN}{__version}{colorama.Fore.RESET} is available with {colorama.Fore.GREEN}--systemd-service upgrade{colorama.Fore.RESET}"
             print(text)
 
     else:
@@ -111,14 +113,12 @@ def service_upgrade() -> bool:
     __logger.info("Begin systemd service upgrade check")
 
     if __systemd_config_exists():
-        config = TM_Config.get()
-
         builtin_version = __version
-        installed_version = config["systemd_service"]["version"]
+        installed_version = TM_Config.model().systemd_service.version
 
         if installed_version < builtin_version:
             choice = input(f"Service file can be upgraded to version {colorama.Fore.CYAN}{builtin_version}{colorama.Fore.RESET} (Current version: {colorama.Fore.CYAN}{installed_version}{colorama.Fore.RESET}). Upgrade? {colorama.Fore.GREEN}[y/n]{colorama.Fore.RESET}: ")
-            if choice[0].lower() == 'y':
+            if choice[:1].lower() == 'y':
                 print(f"\n- Removing installed version {colorama.Fore.CYAN}{installed_version}{colorama.Fore.RESET} service from system...")
                 if service_remove():
                     print(
@@ -129,7 +129,14 @@ def service_upgrade() -> bool:
                         print("- Successfully installed new systemd service")
                         __update_cfg_values('upgrade')
                         print(f"\nService was successfully upgraded from version {colorama.Fore.CYAN}{installed_version}{colorama.Fore.RESET} to {colorama.Fore.CYAN}{builtin_version}{colorama.Fore.RESET}")
+                        print(
+                            "\nApply the new service file with:",
+                            f"\n\t{colorama.Fore.GREEN}systemctl daemon-reload{colorama.Fore.RESET}",
+                            f"\n\t{colorama.Fore.GREEN}systemctl restart {path.basename(__service_config_final_path)}{colorama.Fore.RESET}"
+                        )
                         was_updated = True
+        else:
+            print(f"Service is already upgraded to the latest version {colorama.Fore.CYAN}{builtin_version}{colorama.Fore.RESET}")
     else:
         text = "Service is not installed, nothing to upgrade"
         __logger.info(text)
@@ -191,16 +198,11 @@ def __update_cfg_values(mode: str):
     if mode not in options:
         raise Exception(f"Option '{mode}' doesn't exist in this function")
 
-    cfg = TM_Config.get()
-
-    if mode == 'install':
-        cfg['systemd_service'] = {
-            "version": __version
-        }
-    elif mode == 'upgrade':
-        cfg['systemd_service']["version"] = __version
+    if mode in ('install', 'upgrade'):
+        TM_Config.set("systemd_service.version", __version)
     elif mode == 'remove':
-        cfg['systemd_service'] = DEF_CFG['systemd_service']
+        TM_Config.set("systemd_service.version", DEF_CFG['systemd_service']['version'])
 
-    TM_Config.write(cfg)
+    # CLI command exits right after this, so don't wait for delayed write
+    TM_Config.flush()
     __logger.debug(f"Updated configuration dict 'systemd_service' to mode '{mode}'")
@@ -1,4 +1,4 @@
 #!/bin/sh
 cd "$(dirname "$0")" # Change workdir to shell script location
 cd ../../../..       # Change workdir to the root of Telemonitor project
-poetry run telem --no-color
+exec poetry run telem --no-color
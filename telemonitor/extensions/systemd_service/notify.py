@@ -0,0 +1,158 @@
+import os
+import socket
+import asyncio
+from time import monotonic
+from logging import getLogger
+
+from telemonitor.helpers import TM_LoopMonitor
+
+
+# Long polling request lasts up to 20 seconds and aiogram waits 15 seconds after failed one,
+# so polling is considered stalled only after several missed requests
+POLLING_STALL_TIMEOUT = 120
+# Watchdog is pinged this many times per `WatchdogSec`, so single late ping doesn't restart the bot
+PINGS_PER_TIMEOUT = 3
+
+
+class TM_SystemdNotify:
+    """ systemd `Type=notify` protocol: readiness, status line and watchdog pings.
+
+    Pings are sent from the event loop itself, and only while polling makes progress, so systemd
+    restarts the bot if the loop hangs or stops receiving updates.
+    """
+    __logger = getLogger(__name__)
+    __address = None
+    __socket = None
+    __watchdog = None
+    __task = None
+
+    @classmethod
+    def setup(cls) -> bool:
+        """ Read notification socket and watchdog timeout from environment, set by systemd.
+
+        Variables are removed from environment, so commands run by the bot don't inherit them.
+
+        Returns:
+            bool: Bot is run by systemd service with notify support.
+        """
+        address = os.environ.pop("NOTIFY_SOCKET", None)
+        watchdog_usec = os.environ.pop("WATCHDOG_USEC", None)
+        # Bot is started by launch script, so it's not the main process of service and its pid is never equal to `WATCHDOG_PID`
+        os.environ.pop("WATCHDOG_PID", None)
+        if not address:
+            return False
+
+        # Abstract namespace socket
+        cls.__address = "\0" + address[1:] if address.startswith("@") else address
+        cls.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        cls.__socket.setblocking(False)
+        try:
+            cls.__watchdog = int(watchdog_usec) / 1_000_000 if watchdog_usec else None
+        except ValueError:
+            cls.__watchdog = None
+        cls.__logger.info(f"Running as systemd notify service, watchdog timeout: {cls.__watchdog} s")
+        return True
+
+    @classmethod
+    def notify(cls, *fields: str) -> bool:
+        """ Send state to systemd.
+
+        Args:
+            *fields (str): Assignments, like `READY=1` or `STATUS=...`.
+
+        Returns:
+            bool: State was sent.
+        """
+        if cls.__socket is None:
+            return False
+        try:
+            cls.__socket.sendto("\n".join(fields).encode(), cls.__address)
+        except OSError as e:
+            cls.__logger.warning(f"Can't send notification to systemd: < {str(e)} >")
+            return False
+        return True
+
+    @classmethod
+    def ready(cls, polling: bool = True):
+        """ Report that the bot has started and start watchdog pings.
+
+        Args:
+            polling (bool, optional): Bot receives updates with long polling, so its progress is checked too. Defaults to True.
+        """
+        if cls.notify("READY=1", f"STATUS={cls.status(None, 0)}") and cls.__watchdog and cls.__task is None:
+            cls.__task = asyncio.get_event_loop().create_task(cls.__ping(polling))
+
+    @classmethod
+    def stopping(cls):
+        """ Report that the bot is shutting down and stop watchdog pings. """
+        if cls.__task is not None:
+            cls.__task.cancel()
+            cls.__task = None
+        cls.notify("STOPPING=1", "STATUS=Shutting down")
+
+    @classmethod
+    def is_healthy(cls, polling: bool, started: float) -> bool:
+        """ Check if event loop is responsive and polling makes progress.
+
+        Args:
+            polling (bool): Check polling progress.
+            started (float): `time.monotonic` value of the bot start.
+
+        Returns:
+            bool: Watchdog can be pinged.
+        """
+        # Loop that can run this check isn't hung, but it can be blocked most of the time
+        if cls.__watchdog is not None and TM_LoopMonitor.last_lag >= cls.__watchdog / PINGS_PER_TIMEOUT:
+            return False
+
+        if polling:
+            from telemonitor.extensions.telemetry import TM_Telemetry
+
+            last_poll = TM_Telemetry.last_api_call("getUpdates")
+            if monotonic() - (started if last_poll is None else max(last_poll, started)) > POLLING_STALL_TIMEOUT:
+                return False
+        return True
+
+    @staticmethod
+    def status(previous: tuple, elapsed: float) -> str:
+        """ Render status line with throughput since previous totals.
+
+        Args:
+            previous (tuple): `TM_Telemetry.totals` value of the previous status or None.
+            elapsed (float): Seconds since previous status.
+
+        Returns:
+            str: Status line.
+        """
+        from telemonitor.extensions.telemetry import TM_Telemetry
+
+        updates, api_calls = TM_Telemetry.totals()
+        text = f"Updates: {updates}, API calls: {api_calls}"
+        if previous is not None and elapsed > 0:
+            text += f", {(updates - previous[0]) / elapsed * 60:.0f} updates/min, {(api_calls - previous[1]) / elapsed * 60:.0f} calls/min"
+        return text + f", loop lag: {TM_LoopMonitor.last_lag * 1000:.0f} ms"
+
+    @classmethod
+    async def __ping(cls, polling: bool):
+        from telemonitor.extensions.telemetry import TM_Telemetry
+
+        started = previous_time = monotonic()
+        previous = TM_Telemetry.totals()
+        unhealthy = False
+
+        while True:
+            await asyncio.sleep(cls.__watchdog / PINGS_PER_TIMEOUT)
+            now = monotonic()
+            status = cls.status(previous, now - previous_time)
+            previous, previous_time = TM_Telemetry.totals(), now
+
+            if cls.is_healthy(polling, started):
+                if unhealthy:
+                    cls.__logger.info("Bot is responsive again, watchdog pings are resumed")
+                    unhealthy = False
+                cls.notify("WATCHDOG=1", f"STATUS={status}")
+            else:
+                if not unhealthy:
+                    cls.__logger.warning("Bot isn't making progress, watchdog pings are stopped")
+                    unhealthy = True
+                cls.notify(f"STATUS=Stalled. {status}")
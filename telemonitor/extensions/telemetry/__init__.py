@@ -0,0 +1,337 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import monotonic
+from logging import getLogger
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.utils.exceptions import RetryAfter
+from aiogram.utils.markdown import bold, code
+
+from telemonitor.helpers import TM_Config
+
+
+# Upper bounds (in seconds) of latency histogram buckets, the last implicit bucket is +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICS_PREFIX = "telemonitor"
+PROMETHEUS_PATH = "/metrics"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+class TM_Histogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        """ Fixed-bucket histogram of durations.
+
+        Args:
+            buckets (tuple, optional): Sorted upper bounds of buckets. Defaults to LATENCY_BUCKETS.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+
+    def observe(self, value: float, error: bool = False):
+        """ Record new duration.
+
+        Args:
+            value (float): Duration in seconds.
+            error (bool, optional): Observed call has failed. Defaults to False.
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if error:
+            self.errors += 1
+
+    def quantile(self, q: float) -> float:
+        """ Estimate quantile as upper bound of the bucket it falls into.
+
+        Args:
+            q (float): Quantile in range [0, 1].
+
+        Returns:
+            float: Estimated value in seconds, `inf` if it's beyond the last bucket.
+        """
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+
+class TM_Telemetry:
+    """ Self-monitoring of the bot: handler and Bot API call latencies, exposed in `/stats` and Prometheus format """
+    __logger = getLogger(__name__)
+    __handlers = {}
+    __api_calls = {}
+    __throttled = {}
+    __last_api_call = {}
+    __gauges = {}
+    __updates = 0
+    __runner = None
+
+    @classmethod
+    def observe_handler(cls, name: str, duration: float, error: bool = False):
+        """ Record handler run.
+
+        Args:
+            name (str): Handler name.
+            duration (float): Run time in seconds.
+            error (bool, optional): Handler raised exception. Defaults to False.
+        """
+        histogram = cls.__handlers.get(name)
+        if histogram is None:
+            histogram = cls.__handlers[name] = TM_Histogram()
+        histogram.observe(duration, error)
+
+    @classmethod
+    def count_handler_error(cls, name: str):
+        """ Record failure of already observed handler run.
+
+        Args:
+            name (str): Handler name.
+        """
+        histogram = cls.__handlers.get(name)
+        if histogram is None:
+            histogram = cls.__handlers[name] = TM_Histogram()
+        histogram.errors += 1
+
+    @classmethod
+    def observe_api_call(cls, method: str, duration: float, error: bool = False, throttled: bool = False):
+        """ Record Bot API request.
+
+        Args:
+            method (str): Bot API method name.
+            duration (float): Request time in seconds.
+            error (bool, optional): Request failed. Defaults to False.
+            throttled (bool, optional): Request was rejected by Telegram flood control. Defaults to False.
+        """
+        histogram = cls.__api_calls.get(method)
+        if histogram is None:
+            histogram = cls.__api_calls[method] = TM_Histogram()
+        histogram.observe(duration, error)
+        cls.__last_api_call[method] = monotonic()
+        if throttled:
+            cls.__throttled[method] = cls.__throttled.get(method, 0) + 1
+
+    @classmethod
+    def count_update(cls):
+        """ Count incoming update. """
+        cls.__updates += 1
+
+    @classmethod
+    def totals(cls) -> tuple:
+        """ Get total counters.
+
+        Returns:
+            tuple: (
+                int,  # incoming updates
+                int   # Bot API requests
+            )
+        """
+        return cls.__updates, sum(h.count for h in cls.__api_calls.values())
+
+    @classmethod
+    def last_api_call(cls, method: str) -> float:
+        """ Get time of the last finished request of Bot API method, successful or not.
+
+        Args:
+            method (str): Bot API method name, like `getUpdates`.
+
+        Returns:
+            float: `time.monotonic` value or None, if method wasn't called yet.
+        """
+        return cls.__last_api_call.get(method)
+
+    @classmethod
+    def add_gauge(cls, name: str, description: str, callback: callable):
+        """ Register value, that is read on each stats request.
+
+        Args:
+            name (str): Metric name without prefix, like `loop_lag_seconds`.
+            description (str): Human-readable description.
+            callback (callable): Function without arguments, that returns current value.
+        """
+        cls.__gauges[name] = (description, callback)
+
+    @classmethod
+    def instrument_bot(cls, bot: object):
+        """ Time all Bot API requests of bot instance.
+
+        Args:
+            bot (object): aiogram Bot object.
+        """
+        request = bot.request
+
+        async def timed_request(method: str, *args, **kwargs):
+            started = monotonic()
+            error = throttled = False
+            try:
+                return await request(method, *args, **kwargs)
+            except RetryAfter:
+                error = throttled = True
+                raise
+            except Exception:
+                error = True
+                raise
+            finally:
+                cls.observe_api_call(method, monotonic() - started, error, throttled)
+
+        bot.request = timed_request
+
+    @classmethod
+    def render(cls) -> str:
+        """ Render reply for `/stats` command.
+
+        Returns:
+            str: Formatted message, ready for Telegram.
+        """
+        lines = [f"{bold('Updates')}: {code(cls.__updates)}"]
+        for name, (description, callback) in cls.__gauges.items():
+            lines.append(f"{bold(description)}: {code(cls.__format_value(callback()))}")
+
+        for title, histograms in (("Handlers", cls.__handlers), ("Bot API", cls.__api_calls)):
+            lines.append(f"\n{bold(title)}")
+            if not histograms:
+                lines.append(code("-"))
+            for name, h in sorted(histograms.items(), key=lambda i: -i[1].count):
+                throttled = cls.__throttled.get(name, 0) if histograms is cls.__api_calls else 0
+                text = f"{name}: {h.count} calls, {h.errors} errors"
+                if throttled:
+                    text += f" ({throttled} throttled)"
+                text += f", avg {h.sum / h.count * 1000:.0f} ms, p95 <= {cls.__format_bound(h.quantile(0.95))}"
+                lines.append(code(text))
+
+        return "\n".join(lines)
+
+    @classmethod
+    def prometheus(cls) -> str:
+        """ Render all metrics in Prometheus text exposition format.
+
+        Returns:
+            str: Metrics page.
+        """
+        from telemonitor.extensions.metrics import TM_Metrics
+
+        p = METRICS_PREFIX
+        lines = [
+            f"# HELP {p}_updates_total Incoming updates, including rejected ones.",
+            f"# TYPE {p}_updates_total counter",
+            f"{p}_updates_total {cls.__updates}"
+        ]
+
+        for name, (description, callback) in cls.__gauges.items():
+            lines += [f"# HELP {p}_{name} {description}.", f"# TYPE {p}_{name} gauge", f"{p}_{name} {float(callback())}"]
+
+        for name, label, description, histograms in (
+            ("handler_duration_seconds", "handler", "Run time of update handlers", cls.__handlers),
+            ("api_request_duration_seconds", "method", "Duration of Bot API requests", cls.__api_calls)
+        ):
+            lines += [f"# HELP {p}_{name} {description}.", f"# TYPE {p}_{name} histogram"]
+            for key, h in sorted(histograms.items()):
+                total = 0
+                for bound, count in zip(h.buckets + (float('inf'),), h.counts):
+                    total += count
+                    le = "+Inf" if bound == float('inf') else repr(float(bound))
+                    lines.append(f'{p}_{name}_bucket{{{label}="{key}",le="{le}"}} {total}')
+                lines.append(f'{p}_{name}_sum{{{label}="{key}"}} {h.sum}')
+                lines.append(f'{p}_{name}_count{{{label}="{key}"}} {h.count}')
+
+        for name, label, description, values in (
+            ("handler_errors_total", "handler", "Update handlers failed with exception", {k: h.errors for k, h in cls.__handlers.items()}),
+            ("api_errors_total", "method", "Failed Bot API requests", {k: h.errors for k, h in cls.__api_calls.items()}),
+            ("api_throttled_total", "method", "Bot API requests rejected by flood control", cls.__throttled)
+        ):
+            lines += [f"# HELP {p}_{name} {description}.", f"# TYPE {p}_{name} counter"]
+            lines += [f'{p}_{name}{{{label}="{key}"}} {value}' for key, value in sorted(values.items())]
+
+        snapshot = TM_Metrics.snapshot()
+        lines += [f"# HELP {p}_host Latest host metrics sample, as shown in Sys Info.", f"# TYPE {p}_host gauge"]
+        lines += [f'{p}_host{{metric="{key}"}} {value}' for key, value in sorted(snapshot.items()) if key != "time"]
+
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    async def start_server(cls):
+        """ Start Prometheus metrics HTTP endpoint, if enabled in config file. """
+        cfg = TM_Config.model().telemetry
+        port = cfg.prometheus_port
+        if not port:
+            return
+
+        from aiohttp import web
+
+        host = cfg.prometheus_host
+
+        async def handle(request: object) -> object:
+            return web.Response(body=cls.prometheus().encode(), headers={"Content-Type": PROMETHEUS_CONTENT_TYPE})
+
+        app = web.Application()
+        app.router.add_get(PROMETHEUS_PATH, handle)
+        cls.__runner = web.AppRunner(app, access_log=None)
+        await cls.__runner.setup()
+        await web.TCPSite(cls.__runner, host, port).start()
+        cls.__logger.info(f"Prometheus metrics endpoint is listening on http://{host}:{port}{PROMETHEUS_PATH}")
+
+    @classmethod
+    async def stop_server(cls):
+        """ Stop Prometheus metrics HTTP endpoint. """
+        if cls.__runner is not None:
+            await cls.__runner.cleanup()
+            cls.__runner = None
+
+    @staticmethod
+    def __format_value(value: float) -> str:
+        return f"{value:.3f}" if isinstance(value, float) else str(value)
+
+    @staticmethod
+    def __format_bound(bound: float) -> str:
+        return "inf" if bound == float('inf') else f"{bound * 1000:.0f} ms"
+
+
+class TM_TelemetryMiddleware(BaseMiddleware):
+    """ Dispatcher middleware that counts updates and times each handler run """
+    # Handler that finished the last in current update, its exception is passed to errors handlers after post-processing
+    __last_handler = ContextVar("TM_TelemetryMiddleware.last_handler", default=None)
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        TM_Telemetry.count_update()
+
+    async def on_pre_process_error(self, update: types.Update, exception: BaseException, data: dict):
+        name = self.__last_handler.get()
+        if name is not None:
+            self.__last_handler.set(None)
+            TM_Telemetry.count_handler_error(name)
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        self.__start(data)
+
+    async def on_post_process_message(self, message: types.Message, results: list, data: dict):
+        self.__finish(data)
+
+    async def on_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        self.__start(data)
+
+    async def on_post_process_callback_query(self, callback_query: types.CallbackQuery, results: list, data: dict):
+        self.__finish(data)
+
+    @classmethod
+    def __start(cls, data: dict):
+        handler = current_handler.get()
+        data["_telemetry"] = (handler.__name__.strip('_'), monotonic())
+        cls.__last_handler.set(None)
+
+    @classmethod
+    def __finish(cls, data: dict):
+        started = data.pop("_telemetry", None)
+        if started is None:
+            # No handler matched the update
+            return
+
+        # Failure is counted by `on_pre_process_error`, dispatcher passes handler exception to errors handlers after this
+        TM_Telemetry.observe_handler(started[0], monotonic() - started[1])
+        cls.__last_handler.set(started[0])
@@ -0,0 +1,75 @@
+import ssl
+from logging import getLogger
+
+from aiogram import executor
+from aiogram.types import InputFile
+
+
+__logger = getLogger(__name__)
+
+
+async def skip_pending_updates(bot: object) -> bool:
+    """ Drop updates received while bot was offline, the same way as `skip_updates` does in polling mode.
+
+    `drop_pending_updates` argument of `set_webhook` isn't available in older aiogram versions,
+    so updates are confirmed with `get_updates`, that works only while webhook is removed.
+
+    Args:
+        bot (object): aiogram Bot object.
+
+    Returns:
+        bool:
+            True - Pending updates were dropped.
+            False - There were no pending updates.
+    """
+    await bot.delete_webhook()
+    # Negative offset returns the last update only and forgets all earlier ones
+    updates = await bot.get_updates(offset=-1, timeout=0)
+    if updates:
+        # Confirm the last update too
+        await bot.get_updates(offset=updates[-1].update_id + 1, timeout=0)
+    return bool(updates)
+
+
+def start(dispatcher: object, args: object, on_startup: callable = None, on_shutdown: callable = None):
+    """ Run bot with aiohttp webhook server instead of long polling.
+
+    Args:
+        dispatcher (object): aiogram Dispatcher object.
+        args (object): Parsed startup arguments with `webhook_*` values.
+        on_startup (callable, optional): Coroutine function, called after webhook registration. Defaults to None.
+        on_shutdown (callable, optional): Coroutine function, called before webhook removal. Defaults to None.
+    """
+    url = args.webhook_url.rstrip('/') + args.webhook_path
+    ssl_context = None
+
+    if args.webhook_cert is not None:
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ssl_context.load_cert_chain(args.webhook_cert, args.webhook_key)
+
+    async def __on_startup(dp: object):
+        certificate = InputFile(args.webhook_cert) if args.webhook_cert is not None else None
+        await skip_pending_updates(dp.bot)
+        await dp.bot.set_webhook(url, certificate=certificate)
+        __logger.info(f"Webhook was registered on {url}")
+
+        if on_startup is not None:
+            await on_startup(dp)
+
+    async def __on_shutdown(dp: object):
+        if on_shutdown is not None:
+            await on_shutdown(dp)
+
+        await dp.bot.delete_webhook()
+        __logger.info("Webhook was removed")
+
+    __logger.info(f"Starting webhook server on {args.webhook_host}:{args.webhook_port}{args.webhook_path}")
+    executor.start_webhook(
+        dispatcher,
+        webhook_path=args.webhook_path,
+        on_startup=__on_startup,
+        on_shutdown=__on_shutdown,
+        host=args.webhook_host,
+        port=args.webhook_port,
+        ssl_context=ssl_context
+    )
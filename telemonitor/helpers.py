@@ -1,62 +1,177 @@
 import os
+import gzip
+import copy
 import json
+import queue
+import sys
+import atexit
+import builtins
+import importlib.util
+import shutil
+import asyncio
 import logging
-import platform
+import threading
+import logging.handlers
+import traceback
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import argparse
-import subprocess
-from math import floor
-from time import strftime, asctime
-from sys import platform as sys_platform
+from time import time, strftime, asctime, monotonic, perf_counter
+from typing import NamedTuple
+from sys import platform as sys_platform, _current_frames
 
 import colorama
-from uptime import uptime
-from aiogram import types, Dispatcher, Bot
-from aiogram.utils.markdown import code, bold, italic
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ParseMode
 
 from telemonitor import __version__
 
 
-MAX_LOGS = 30
+LOG_MAX_FILE_SIZE_MB = 5
+LOG_MAX_TOTAL_SIZE_MB = 50
+LOG_MAX_AGE_DAYS = 30
+WHITELIST_CHECK_INTERVAL = 5
+BROADCAST_RATE_GLOBAL = 30
+BROADCAST_RATE_CHAT = 1
+BROADCAST_MAX_ATTEMPTS = 3
+METRICS_SAMPLE_INTERVAL = 5
+TOP_PROCESSES = 5
+CONFIG_WRITE_DELAY = 1
+# Config file modification is checked at most once per this amount of seconds
+CONFIG_CHECK_INTERVAL = 5
+OFFLOAD_MAX_WORKERS = 4
+RESPONSE_CACHE_TTL = 2
+USER_QUEUE_SIZE = 10
+LOOP_MONITOR_INTERVAL = 1
+LOOP_LAG_THRESHOLD_MS = 200
+HUB_PUSH_INTERVAL = 15
+HUB_HOST_TIMEOUT = 60
+STORE_RETENTION_DAYS = 90
+COMMAND_TIMEOUT = 60
+COMMAND_MAX_CONCURRENT = 2
+SELFSTAT_SNAPSHOT_INTERVAL = 600
+SELFSTAT_TOP_ALLOCATIONS = 10
+STORE_METRICS_RETENTION_DAYS = 7
 DIR_LOG = "./Logs"
 PATH_CFG = "./config.json"
 PATH_SHARED_DIR = "./Shared"
-PARSE_MODE = ParseMode.MARKDOWN_V2
+# Same as `aiogram.types.ParseMode.MARKDOWN_V2`. aiogram isn't imported here, so CLI commands start fast
+PARSE_MODE = "MarkdownV2"
 DEF_CFG = {
     "config_version": 2,
-    "log_files_max": MAX_LOGS,
+    "logging": {
+        "max_file_size_mb": LOG_MAX_FILE_SIZE_MB,
+        "max_total_size_mb": LOG_MAX_TOTAL_SIZE_MB,
+        "max_age_days": LOG_MAX_AGE_DAYS
+    },
     "bot": {
         "token": "",
         "whitelisted_users": [],
+        "whitelist_check_interval": WHITELIST_CHECK_INTERVAL,
+        "admin_users": [],
         "state_notifications": True,
         "enable_file_transfer": True
     },
+    "event_loop": {
+        "monitor_interval": LOOP_MONITOR_INTERVAL,
+        "lag_threshold_ms": LOOP_LAG_THRESHOLD_MS
+    },
+    "telemetry": {
+        "prometheus_host": "127.0.0.1",
+        "prometheus_port": 0
+    },
+    "metrics": {
+        "sample_interval": METRICS_SAMPLE_INTERVAL,
+        "mount_points": ["/"],
+        "top_processes": TOP_PROCESSES
+    },
+    "alerts": {
+        "rules": []
+    },
+    "file_transfer": {
+        "max_concurrent_downloads": 2,
+        "min_free_space_mb": 100,
+        "chunk_size_kb": 64
+    },
+    "hub": {
+        "listen": "",
+        "url": "",
+        "token": "",
+        "agent_name": "",
+        "push_interval": HUB_PUSH_INTERVAL,
+        "host_timeout": HUB_HOST_TIMEOUT
+    },
+    "commands": {
+        "allowlist": [],
+        "timeout": COMMAND_TIMEOUT,
+        "max_concurrent": COMMAND_MAX_CONCURRENT
+    },
+    "diagnostics": {
+        "tracemalloc": False,
+        "snapshot_interval": SELFSTAT_SNAPSHOT_INTERVAL,
+        "top_allocations": SELFSTAT_TOP_ALLOCATIONS,
+        "rss_limit_mb": 0
+    },
+    "store": {
+        "enabled": True,
+        "retention_days": STORE_RETENTION_DAYS,
+        "metrics_retention_days": STORE_METRICS_RETENTION_DAYS
+    },
     "systemd_service": {
         "version": -1
     }
 }
 
+# Minimum values of numeric config keys. Smaller values are reset to default, same as values of wrong type
+CFG_MIN_VALUES = {
+    "logging.max_file_size_mb": 1,
+    "logging.max_total_size_mb": 1,
+    "logging.max_age_days": 1,
+    "bot.whitelist_check_interval": 0,
+    "event_loop.monitor_interval": 0.1,
+    "event_loop.lag_threshold_ms": 1,
+    "telemetry.prometheus_port": 0,
+    "metrics.sample_interval": 1,
+    "metrics.top_processes": 1,
+    "file_transfer.max_concurrent_downloads": 1,
+    "file_transfer.min_free_space_mb": 0,
+    "file_transfer.chunk_size_kb": 1,
+    "hub.push_interval": 1,
+    "hub.host_timeout": 1,
+    "commands.timeout": 1,
+    "commands.max_concurrent": 1,
+    "diagnostics.snapshot_interval": 1,
+    "diagnostics.top_allocations": 1,
+    "diagnostics.rss_limit_mb": 0,
+    "store.retention_days": 1,
+    "store.metrics_retention_days": 1
+}
+
 
 class STRS:
     name = "Telemonitor"
     description = "Telegram bot for monitoring your system."
     reboot = "Rebooting the system"
     shutdown = "Shutting down the system"
-    message_startup = code("System was booted")
-    message_shutdown = code("System is shutting down")
+    # Pre-formatted as markdown code, same as `aiogram.utils.markdown.code` does
+    message_startup = "`System was booted`"
+    message_shutdown = "`System is shutting down`"
 
 
-def tm_colorama() -> colorama:
+_sysinfo_cache = (None, "")
+_sysinfo_baseline = {}
+
+
+def tm_colorama(disable: bool = False) -> colorama:
     """ Wrapper around colorama module with feature to disable the colored output
 
+    Args:
+        disable (bool, optional): Disable colored output for this and all following calls. Defaults to False.
+
     Returns:
         colorama: Colorama module ready for use
     """
-    from telemonitor.main import args
-
     colorama_obj = colorama
 
-    if args.disable_colored_output:
+    if disable:
         # Overwrite all class variables with empty string to disable colored print
         for attr in ("Back", "Cursor", "Fore", "Style"):
             attr_dict = getattr(colorama_obj, attr).__dict__
@@ -70,53 +185,183 @@ def tm_colorama() -> colorama:
 def init_logger(is_verbose: bool = False):
     """ Initialize python `logging` module
 
+    All records are passed through the queue and written to file by background thread,
+    so logging never blocks the event loop.
+
     Args:
         is_verbose (bool, optional): Write more detailed information to log file. Defaults to False.
     """
-    colorama = tm_colorama()
+    cfg = (TM_Config.model() if TM_Config.is_exist() else TM_ConfigSection(DEF_CFG)).logging
+
+    file_handler = TM_LogFileHandler(
+        DIR_LOG,
+        max_bytes=cfg.max_file_size_mb * 1024 * 1024,
+        max_total_bytes=cfg.max_total_size_mb * 1024 * 1024,
+        max_age=cfg.max_age_days * 86400
+    )
+    file_handler.setFormatter(logging.Formatter("[%(asctime)s][%(levelname)s][%(name)s->%(funcName)s]: %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root_logger = logging.getLogger()
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    root_logger.setLevel(logging.DEBUG if is_verbose else logging.INFO)
+
+    # Compress logs of previous runs and apply retention without delaying the startup
+    threading.Thread(target=file_handler.apply_retention, name="TM_LogRetention", daemon=True).start()
 
-    if not os.path.isdir(DIR_LOG):
-        os.makedirs(DIR_LOG)
-    else:
-        log_files = [f for f in os.listdir(DIR_LOG) if os.path.isfile(os.path.join(DIR_LOG, f))]
-        log_files_len = len(log_files)
-        if log_files_len > (TM_Config.get().get("log_files_max", MAX_LOGS) if TM_Config.is_exist() else MAX_LOGS):
-            print(f"- Clearing logs folder. {colorama.Fore.RED}{log_files_len}{colorama.Fore.RESET} files will be removed")
-            for log_file in log_files:
-                os.remove(os.path.join(DIR_LOG, log_file))
 
-    log_level = logging.DEBUG if is_verbose else logging.INFO
-    filename = f'{DIR_LOG}/TMLog_{strftime("%Y-%m-%d_%H-%M-%S")}.log'
-    logging.basicConfig(filename=filename, format="[%(asctime)s][%(levelname)s][%(name)s->%(funcName)s]: %(message)s", level=log_level)
+class TM_LogFileHandler(logging.handlers.RotatingFileHandler):
+    def __init__(self, dir_path: str, max_bytes: int, max_total_bytes: int, max_age: float):
+        """ Log file handler with size-based rotation, gzip compression of old files and retention
+        by total size and age of log files.
 
-    with open(filename, 'wt') as f:
-        f.write(f"{STRS.name} ({__version__}) : [ {asctime()} ]\n\n")
+        Args:
+            dir_path (str): Path to logs dir.
+            max_bytes (int): Size of log file to start a new one.
+            max_total_bytes (int): Maximum total size of all log files.
+            max_age (float): Maximum age of log files in seconds.
+        """
+        os.makedirs(dir_path, exist_ok=True)
+        self.__dir_path = dir_path
+        self.__max_total_bytes = max_total_bytes
+        self.__max_age = max_age
+
+        super().__init__(self.__new_filename(), maxBytes=max_bytes, delay=True)
+        self.__write_header()
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        self.__compress(self.baseFilename)
+        self.baseFilename = os.path.abspath(self.__new_filename())
+        self.__write_header()
+        self.apply_retention()
+
+    def apply_retention(self):
+        """ Compress old log files and remove those exceeding age or total size limit """
+        self.acquire()
+        try:
+            current = os.path.basename(self.baseFilename)
+            for name in os.listdir(self.__dir_path):
+                if name.startswith("TMLog_") and name.endswith(".log") and name != current:
+                    self.__compress(os.path.join(self.__dir_path, name))
+
+            files = []
+            for name in os.listdir(self.__dir_path):
+                if name.startswith("TMLog_") and name != current:
+                    st = os.stat(os.path.join(self.__dir_path, name))
+                    files.append((st.st_mtime, st.st_size, name))
+            files.sort()
+
+            now = time()
+            total = sum(f[1] for f in files) + (os.path.getsize(self.baseFilename) if os.path.exists(self.baseFilename) else 0)
+            for mtime, size, name in files:
+                if now - mtime <= self.__max_age and total <= self.__max_total_bytes:
+                    break
+                os.remove(os.path.join(self.__dir_path, name))
+                total -= size
+        except OSError as e:
+            # Handler can't log its own failures, so they are reported the same way as `logging.Handler.handleError` does
+            if logging.raiseExceptions and sys.stderr is not None:
+                sys.stderr.write(f"--- Logging error ---\nCan't apply logs retention: {str(e)}\n")
+        finally:
+            self.release()
+
+    def __new_filename(self) -> str:
+        filename = f'{self.__dir_path}/TMLog_{strftime("%Y-%m-%d_%H-%M-%S")}.log'
+        n = 1
+        while os.path.exists(filename) or os.path.exists(filename + ".gz"):
+            filename = f'{self.__dir_path}/TMLog_{strftime("%Y-%m-%d_%H-%M-%S")}_{n}.log'
+            n += 1
+        return filename
+
+    def __write_header(self):
+        with open(self.baseFilename, 'wt') as f:
+            f.write(f"{STRS.name} ({__version__}) : [ {asctime()} ]\n\n")
+
+    @staticmethod
+    def __compress(path: str):
+        with open(path, 'rb') as f_in, gzip.open(path + ".gz", 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        shutil.copystat(path, path + ".gz")
+        os.remove(path)
 
 
 def construct_sysinfo() -> str:
-    """ Get system information and construct message from it.
+    """ Construct message from the latest system metrics snapshot.
+
+    Message is rendered only once for each new snapshot.
 
     Returns:
         str: Constructed and formatted message, ready for Telegram.
     """
-    __uname = platform.uname()
-    __sysname = f"{__uname.system} {__uname.release} ({__uname.version})"
-    __userhost = f"{os.path.basename(os.path.expanduser('~'))}@{__uname.node}"
-
-    __uptime_raw = uptime()
-    __uptime_dict = {
-        "days": str(floor(__uptime_raw / (24 * 3600))),
-        "hours": str(floor(__uptime_raw / 3600)),
-        "mins": str(floor(__uptime_raw / 60 % 60)),
-        "secs": str(floor(__uptime_raw % 60))
-    }
-    __uptime_dict.update({k: f"0{__uptime_dict[k]}" for k in __uptime_dict if len(__uptime_dict[k]) == 1})
-    __uptime = f"{__uptime_dict['days']}:{__uptime_dict['hours']}:{__uptime_dict['mins']}:{__uptime_dict['secs']}"
+    from telemonitor.extensions.metrics import TM_Metrics
+    global _sysinfo_cache
 
-    string_final = f"{bold('System')}: {code(__sysname)}\n{bold('Uptime')} {italic('dd:hh:mm:ss')}: {code(__uptime)}\n{bold('User@Host')}: {code(__userhost)}"
+    # Sampler isn't started yet, its own baseline is left for the background task
+    snapshot = TM_Metrics.snapshot() or TM_Metrics.sample(baseline=_sysinfo_baseline)
+    if _sysinfo_cache[0] is snapshot:
+        return _sysinfo_cache[1]
+
+    string_final = render_sysinfo(TM_Metrics.static(), snapshot)
+    _sysinfo_cache = (snapshot, string_final)
     return string_final
 
 
+def render_sysinfo(static: dict, snapshot: dict) -> str:
+    """ Render system information message from metrics of any host.
+
+    Args:
+        static (dict): Static system information, as returned by `TM_Metrics.static`.
+        snapshot (dict): Metrics snapshot, as returned by `TM_Metrics.sample`.
+
+    Returns:
+        str: Formatted message, ready for Telegram.
+    """
+    from aiogram.utils.markdown import bold, code, italic
+    from telemonitor.extensions.metrics import format_bytes, format_uptime
+
+    lines = [
+        f"{bold('System')}: {code(static['system'])}",
+        f"{bold('Uptime')} {italic('dd:hh:mm:ss')}: {code(format_uptime(snapshot['uptime']))}",
+        f"{bold('User@Host')}: {code(static['user_host'])}"
+    ]
+
+    if "load1" in snapshot:
+        cpu = f"{snapshot['cpu']:.1f}%" if "cpu" in snapshot else "-"
+        load = f"{snapshot['load1']:.2f} {snapshot['load5']:.2f} {snapshot['load15']:.2f}"
+        mem = f"{format_bytes(snapshot['mem_used'])} / {format_bytes(snapshot['mem_total'])} ({snapshot['mem']:.1f}%)"
+        lines += [
+            f"{bold('CPU')}: {code(cpu)}",
+            f"{bold('Load Average')}: {code(load)}",
+            f"{bold('Memory')}: {code(mem)}"
+        ]
+
+        if snapshot["swap_total"]:
+            swap = f"{format_bytes(snapshot['swap_used'])} / {format_bytes(snapshot['swap_total'])} ({snapshot['swap']:.1f}%)"
+            lines.append(f"{bold('Swap')}: {code(swap)}")
+
+    if "net_rx" in snapshot:
+        net = f"↓ {format_bytes(snapshot['net_rx'])}/s ↑ {format_bytes(snapshot['net_tx'])}/s"
+        disk = f"R {format_bytes(snapshot['disk_read'])}/s W {format_bytes(snapshot['disk_write'])}/s"
+        lines += [
+            f"{bold('Network')}: {code(net)}",
+            f"{bold('Disk IO')}: {code(disk)}"
+        ]
+
+    for key in snapshot:
+        if key.startswith("disk_free:"):
+            lines.append(f"{bold('Free on')} {code(key[len('disk_free:'):])}: {code(f'{snapshot[key]:.1f}%')}")
+
+    return "\n".join(lines)
+
+
 def init_shared_dir() -> bool:
     """ Initialize dir for shared files
 
@@ -132,9 +377,12 @@ def init_shared_dir() -> bool:
         return False
 
 
-def cli_arguments_parser() -> object:
+def cli_arguments_parser(argv: list = None) -> object:
     """ Parse all startup arguments
 
+    Args:
+        argv (list, optional): Arguments to parse. Defaults to `sys.argv`.
+
     Returns:
         object: Namespace object, generated by `argparse` module
     """
@@ -150,55 +398,371 @@ def cli_arguments_parser() -> object:
     bot_group.add_argument('--token', action='store', type=str, dest='token_overwrite', metavar='STR', help='force the bot to run with token from the argument instead of the configuration file')
     bot_group.add_argument('--whitelist', action='store', type=int, dest='whitelist_overwrite', metavar='INT', nargs='+', help='force the bot to check whitelisted users from argument instead of the of the configuration file')
 
+    webhook_group = argparser.add_argument_group('webhook optional arguments')
+    webhook_group.add_argument('--webhook', action='store_true', help='receive updates with webhook server instead of long polling')
+    webhook_group.add_argument('--webhook-url', action='store', type=str, dest='webhook_url', metavar='URL', help='public base url of webhook server, registered in Telegram (required for webhook mode)')
+    webhook_group.add_argument('--webhook-host', action='store', type=str, dest='webhook_host', metavar='STR', default='127.0.0.1', help='address for webhook server to listen on (default: %(default)s)')
+    webhook_group.add_argument('--webhook-port', action='store', type=int, dest='webhook_port', metavar='INT', default=8443, help='port for webhook server to listen on (default: %(default)s)')
+    webhook_group.add_argument('--webhook-path', action='store', type=str, dest='webhook_path', metavar='STR', default='/telemonitor', help='path of webhook endpoint (default: %(default)s)')
+    webhook_group.add_argument('--webhook-cert', action='store', type=str, dest='webhook_cert', metavar='PATH', help='TLS certificate for webhook server, will be uploaded to Telegram to allow self-signed certificates')
+    webhook_group.add_argument('--webhook-key', action='store', type=str, dest='webhook_key', metavar='PATH', help='TLS private key for webhook server')
+
+    hub_group = argparser.add_argument_group('hub optional arguments')
+    hub_group.add_argument('--agent', action='store_true', help='run without bot and push system metrics to hub instance')
+    hub_group.add_argument('--hub-url', action='store', type=str, dest='hub_url', metavar='URL', help='hub address for agent mode, like http://host:port or unix:/path (default: from the configuration file)')
+    hub_group.add_argument('--agent-name', action='store', type=str, dest='agent_name', metavar='STR', help='name of this host, shown by hub (default: hostname)')
+
     adv_group = argparser.add_argument_group('advanced optional arguments')
     adv_group.add_argument('--dev', help='enable unstable development features', action='store_true', dest='dev_features')
     adv_group.add_argument('--verbose', '-v', help='write debug information to log file', action='store_true')
     adv_group.add_argument('--config-check', action='store_true', help='run config file initialization procedure and exit', dest='config_check_only')
     adv_group.add_argument('--no-config-check', action='store_true', help="don't scan configuration file on start", dest='disable_config_check')
+    adv_group.add_argument('--profile-startup', action='store_true', help='print startup time and import time breakdown', dest='profile_startup')
+
+    return argparser.parse_args(argv)
+
+
+class TM_StartupProfiler:
+    """ Startup time profiler, enabled with `--profile-startup` argument.
 
-    return argparser.parse_args()
+    Each import of not yet loaded module is timed and startup phases are marked
+    until the bot starts receiving updates. Report is printed on first poll or on exit.
+    """
+    __logger = logging.getLogger(__name__)
+    __original_import = None
+    __started = None
+    __phases = []
+    __imports = {}
+    __stack = []
+
+    @classmethod
+    def start(cls):
+        """ Start timing imports. """
+        if cls.__started is not None:
+            return
+
+        cls.__started = perf_counter()
+        cls.__original_import = builtins.__import__
+        builtins.__import__ = cls.__timed_import
+        atexit.register(cls.report)
+
+    @classmethod
+    def mark(cls, phase: str):
+        """ Mark the end of startup phase. Does nothing if profiler wasn't started.
+
+        Args:
+            phase (str): Phase name.
+        """
+        if cls.__started is not None:
+            cls.__phases.append((phase, perf_counter()))
+
+    @classmethod
+    def report(cls, top: int = 15) -> str:
+        """ Stop profiler and print startup time breakdown. Does nothing if profiler wasn't started.
+
+        Args:
+            top (int, optional): Amount of the slowest imports to show. Defaults to 15.
+
+        Returns:
+            str: Report text or None.
+        """
+        if cls.__started is None:
+            return None
+        builtins.__import__ = cls.__original_import
+        atexit.unregister(cls.report)
+
+        lines = ["Startup profile (ms):"]
+        previous = cls.__started
+        for phase, t in cls.__phases:
+            lines.append(f"  {phase:<48} {(t - previous) * 1000:8.1f}")
+            previous = t
+        lines.append(f"  {'total':<48} {(previous - cls.__started) * 1000:8.1f}")
+
+        lines.append(f"Slowest imports (self / cumulative ms), {len(cls.__imports)} modules loaded:")
+        for name, (cumulative, own) in sorted(cls.__imports.items(), key=lambda i: -i[1][1])[:top]:
+            lines.append(f"  {name:<48} {own * 1000:8.1f} {cumulative * 1000:8.1f}")
+
+        text = "\n".join(lines)
+        print(text)
+        cls.__logger.info(text)
+        cls.__started = None
+        return text
+
+    @classmethod
+    def __timed_import(cls, name: str, globals: dict = None, locals: dict = None, fromlist: tuple = (), level: int = 0) -> object:
+        module = name
+        if level and name and globals is not None:
+            module = importlib.util.resolve_name('.' * level + name, globals.get('__package__'))
+        if not name or module in sys.modules:
+            return cls.__original_import(name, globals, locals, fromlist, level)
+
+        # Time of nested imports is accumulated on stack to get self time of each module
+        cls.__stack.append(0.0)
+        started = perf_counter()
+        try:
+            return cls.__original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = perf_counter() - started
+            children = cls.__stack.pop()
+            if cls.__stack:
+                cls.__stack[-1] += elapsed
+            cls.__imports[module] = (elapsed, elapsed - children)
+
+
+class TM_Offload:
+    """ Uniform layer for running blocking calls outside of the event loop """
+    __logger = logging.getLogger(__name__)
+    __executor = None
+
+    @classmethod
+    async def run(cls, func: callable, *args, **kwargs) -> object:
+        """ Run blocking function in bounded thread pool.
+
+        Args:
+            func (callable): Blocking function.
+            *args, **kwargs: Function arguments.
+
+        Returns:
+            object: Function result.
+        """
+        if cls.__executor is None:
+            cls.__executor = ThreadPoolExecutor(max_workers=OFFLOAD_MAX_WORKERS, thread_name_prefix="TM_Offload")
+        return await asyncio.get_event_loop().run_in_executor(cls.__executor, partial(func, *args, **kwargs))
+
+    @classmethod
+    async def run_command(cls, *cmd: str, timeout: float = None) -> tuple:
+        """ Run system command as asyncio subprocess.
+
+        Args:
+            *cmd (str): Command and its arguments.
+            timeout (float, optional): Time limit in seconds, process is killed after it. Defaults to None.
+
+        Returns:
+            tuple: (
+                int,  # return code
+                bytes,  # stdout
+                bytes   # stderr
+            )
+        """
+        cls.__logger.info(f"Running command: {' '.join(cmd)}")
+        process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            cls.__logger.error(f"Command '{' '.join(cmd)}' was killed after {timeout} seconds timeout")
+            raise
+        return process.returncode, stdout, stderr
+
+
+class TM_ResponseCache:
+    """ Short-lived cache of rendered replies. Concurrent requests of the same key share single computation """
+    __entries = {}
+    __in_flight = {}
+
+    @classmethod
+    async def get(cls, key: str, factory: callable, ttl: float = RESPONSE_CACHE_TTL) -> object:
+        """ Get cached value or compute it, if there's no fresh one.
+
+        Args:
+            key (str): Cache key, like action name.
+            factory (callable): Coroutine function without arguments, that computes value.
+            ttl (float, optional): Time (in seconds) to reuse computed value. Defaults to RESPONSE_CACHE_TTL.
+
+        Returns:
+            object: Cached or computed value.
+        """
+        entry = cls.__entries.get(key)
+        if entry is not None and entry[0] > monotonic():
+            return entry[1]
+
+        task = cls.__in_flight.get(key)
+        if task is None:
+            # Computation isn't owned by the first caller, so its cancellation doesn't affect others waiting for the same value
+            task = cls.__in_flight[key] = asyncio.ensure_future(cls.__compute(key, factory, ttl))
+            # Exception is retrieved even if all callers were cancelled
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    @classmethod
+    async def __compute(cls, key: str, factory: callable, ttl: float) -> object:
+        try:
+            value = await factory()
+            cls.__entries[key] = (monotonic() + ttl, value)
+            return value
+        finally:
+            del cls.__in_flight[key]
+
+    @classmethod
+    def clear(cls):
+        """ Drop all cached values. """
+        cls.__entries.clear()
+
+
+class TM_LoopMonitor:
+    """ Event loop lag monitor.
+
+    Background thread periodically schedules a callback in the event loop and measures how long it waits to be run.
+    If the loop doesn't respond within the threshold, the stack of the blocking code is logged.
+    """
+    __logger = logging.getLogger(__name__)
+    __thread = None
+    __stop = None
+    last_lag = 0.0
+    max_lag = 0.0
+    stalls = 0
+    last_response = None
+
+    @classmethod
+    def start(cls, loop: asyncio.AbstractEventLoop = None):
+        """ Start monitor thread for event loop.
+
+        Args:
+            loop (asyncio.AbstractEventLoop, optional): Monitored event loop, must be run in the current thread. Defaults to current event loop.
+        """
+        if cls.__thread is not None:
+            return
+
+        cfg = (TM_Config.model() if TM_Config.is_exist() else TM_ConfigSection(DEF_CFG)).event_loop
+        interval = cfg.monitor_interval
+        threshold = cfg.lag_threshold_ms / 1000
+
+        cls.__stop = threading.Event()
+        cls.__thread = threading.Thread(
+            target=cls.__monitor,
+            args=(loop or asyncio.get_event_loop(), threading.get_ident(), interval, threshold),
+            name="TM_LoopMonitor",
+            daemon=True
+        )
+        cls.__thread.start()
+        cls.__logger.info(f"Event loop monitor started with {threshold * 1000:.0f} ms lag threshold")
+
+    @classmethod
+    def stop(cls):
+        """ Stop monitor thread. """
+        if cls.__thread is not None:
+            cls.__stop.set()
+            cls.__thread = None
+
+    @classmethod
+    def __monitor(cls, loop: asyncio.AbstractEventLoop, loop_thread_id: int, interval: float, threshold: float):
+        stop = cls.__stop
+
+        while not stop.wait(interval):
+            responded = threading.Event()
+            started = monotonic()
+            try:
+                loop.call_soon_threadsafe(responded.set)
+            except RuntimeError:
+                # Loop is closed
+                return
+
+            stalled = not responded.wait(threshold)
+            if stalled:
+                frame = _current_frames().get(loop_thread_id)
+                stack = "".join(traceback.format_stack(frame, limit=8)) if frame is not None else "-"
+                cls.__logger.warning(f"Event loop is blocked for more than {threshold * 1000:.0f} ms, blocking code:\n{stack}")
+
+                while not responded.wait(interval) and not stop.is_set():
+                    pass
+                cls.stalls += 1
+
+            cls.last_lag = monotonic() - started
+            cls.max_lag = max(cls.max_lag, cls.last_lag)
+            cls.last_response = monotonic()
+            if stalled:
+                cls.__logger.warning(f"Event loop was blocked for {cls.last_lag * 1000:.0f} ms")
 
 
 class TM_ControlInlineKB:
-    def __init__(self, bot: Bot, dispatcher: Dispatcher):
+    __logger = logging.getLogger(__name__)
+    # Replies sent after webhook response, references are kept until they are done
+    __tasks = set()
+
+    def __init__(self, bot: object, dispatcher: object, webhook: bool = False):
         """ Generate telegram inline keyboard for bot.
 
         Args:
-            bot (Bot): aiogram Bot object.
-            dispatcher (Dispatcher): aiogram Dispatcher object.
+            bot (object): aiogram Bot object.
+            dispatcher (object): aiogram Dispatcher object.
+            webhook (bool, optional): Bot receives updates with webhook, so callback answers
+                can be returned in webhook response. Defaults to False.
         """
+        from aiogram import types
+        from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+        if webhook:
+            # Pulls aiohttp web server, that isn't needed in polling mode
+            from aiogram.dispatcher.webhook import AnswerCallbackQuery
+
         self.__inline_kb = InlineKeyboardMarkup()
 
         self.__btn_get_sysinfo = InlineKeyboardButton('Sys Info', callback_data='button-sysinfo-press')
+        self.__btn_processes = InlineKeyboardButton('Processes', callback_data='button-processes-press')
         self.__btn_reboot = InlineKeyboardButton('Reboot', callback_data='button-reboot-press')
         self.__btn_shutdown = InlineKeyboardButton('Shutdown', callback_data='button-shutdown-press')
 
-        self.__inline_kb.add(self.__btn_get_sysinfo)
+        self.__inline_kb.row(self.__btn_get_sysinfo, self.__btn_processes)
         self.__inline_kb.row(self.__btn_reboot, self.__btn_shutdown)
 
-        @dispatcher.callback_query_handler()
+        @dispatcher.callback_query_handler(lambda c: c.data.startswith('button-'))
         async def __callback_ctrl_press(callback_query: types.CallbackQuery):
             if not TM_Whitelist.is_whitelisted(callback_query.from_user.id): return False
 
             data = callback_query.data
             if data == 'button-sysinfo-press':
+                if webhook:
+                    # Callback answer is sent back in webhook response right away, saving one API request.
+                    # Sys info is sent after the response, so button spinner doesn't wait for it
+                    task = asyncio.ensure_future(self.__send_sysinfo(bot, callback_query.from_user.id))
+                    self.__tasks.add(task)
+                    task.add_done_callback(self.__done)
+                    return AnswerCallbackQuery(callback_query.id)
+
+                await bot.answer_callback_query(callback_query.id)
+                await self.__send_sysinfo(bot, callback_query.from_user.id)
+
+            elif data == 'button-processes-press':
+                from telemonitor.extensions.metrics.processes import TM_Processes
+
+                top = TM_Config.model().metrics.top_processes
+                message = await TM_ResponseCache.get(f'processes:{top}', partial(TM_Offload.run, TM_Processes.render, top))
                 await bot.answer_callback_query(callback_query.id)
-                message = construct_sysinfo()
                 await bot.send_message(callback_query.from_user.id, message, parse_mode=PARSE_MODE)
 
             elif data == 'button-reboot-press':
+                from telemonitor.extensions.store import TM_Store
+
                 await bot.answer_callback_query(callback_query.id, STRS.reboot, show_alert=True)
+                # Audit record must reach the disk before the system goes down
+                TM_Store.audit(callback_query.from_user.id, 'reboot')
+                await TM_Offload.run(TM_Store.flush)
 
-                if sys_platform == 'linux': subprocess.run(['shutdown', '-r', 'now'])
-                elif sys_platform == 'darwin': subprocess.run(['shutdown', '-r', 'now'])
-                elif sys_platform == 'win32': subprocess.run(['shutdown', '/r', '/t', '0'])
+                if sys_platform == 'linux': await TM_Offload.run_command('shutdown', '-r', 'now')
+                elif sys_platform == 'darwin': await TM_Offload.run_command('shutdown', '-r', 'now')
+                elif sys_platform == 'win32': await TM_Offload.run_command('shutdown', '/r', '/t', '0')
 
             elif data == 'button-shutdown-press':
+                from telemonitor.extensions.store import TM_Store
+
                 await bot.answer_callback_query(callback_query.id, STRS.shutdown, show_alert=True)
+                TM_Store.audit(callback_query.from_user.id, 'shutdown')
+                await TM_Offload.run(TM_Store.flush)
+
+                if sys_platform == 'linux': await TM_Offload.run_command('shutdown', 'now')
+                elif sys_platform == 'darwin': await TM_Offload.run_command('shutdown', '-h', 'now')
+                elif sys_platform == 'win32': await TM_Offload.run_command('shutdown', '/s', '/t', '0')
 
-                if sys_platform == 'linux': subprocess.run(['shutdown', 'now'])
-                elif sys_platform == 'darwin': subprocess.run(['shutdown', '-h', 'now'])
-                elif sys_platform == 'win32': subprocess.run(['shutdown', '/s', '/t', '0'])
+    @staticmethod
+    async def __send_sysinfo(bot: object, user_id: int):
+        message = await TM_ResponseCache.get('sysinfo', partial(TM_Offload.run, construct_sysinfo))
+        await bot.send_message(user_id, message, parse_mode=PARSE_MODE)
+
+    @classmethod
+    def __done(cls, task: asyncio.Task):
+        cls.__tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            cls.__logger.error(f"Failed to send sys info: < {str(task.exception())} >")
 
     @property
     def keyboard(self) -> object:
@@ -212,11 +776,21 @@ class TM_ControlInlineKB:
 
 class TM_Whitelist:
     __logger = logging.getLogger(__name__)
+    __index = frozenset()
+    __index_source = None
+    __last_check_time = None
+    __check_interval = WHITELIST_CHECK_INTERVAL
+    __admins = frozenset()
+    __overwrite = None
+    __refresh_task = None
 
     @classmethod
     def is_whitelisted(cls, user_id: int) -> bool:
         """ Check is user in whitelist.
 
+        Lookup is done against the in-memory whitelist index, that is
+        refreshed from config file not more often than once per `whitelist_check_interval` seconds.
+
         Args:
             user_id (int): Telegram user id.
 
@@ -225,8 +799,99 @@ class TM_Whitelist:
                 True - User is whitelisted.
                 False - User is not whitelisted.
         """
-        users = cls.get_whitelist()
-        return user_id in users
+        now = monotonic()
+        if cls.__last_check_time is None or now - cls.__last_check_time >= cls.__check_interval:
+            cls.__last_check_time = now
+            cls.refresh_index()
+
+        return user_id in cls.__index
+
+    @classmethod
+    async def is_whitelisted_async(cls, user_id: int) -> bool:
+        """ Same as `is_whitelisted`, but config file is read in `TM_Offload` thread pool when index refresh is due.
+
+        Args:
+            user_id (int): Telegram user id.
+
+        Returns:
+            bool:
+                True - User is whitelisted.
+                False - User is not whitelisted.
+        """
+        now = monotonic()
+        if cls.__last_check_time is None or now - cls.__last_check_time >= cls.__check_interval:
+            cls.__last_check_time = now
+            cls.__refresh_task = asyncio.ensure_future(TM_Offload.run(cls.refresh_index))
+
+        task = cls.__refresh_task
+        if task is not None:
+            # Concurrent checks wait for the same refresh, otherwise they would see the stale (or still empty) index
+            try:
+                await asyncio.shield(task)
+            finally:
+                if task.done() and cls.__refresh_task is task:
+                    cls.__refresh_task = None
+
+        return user_id in cls.__index
+
+    @classmethod
+    def is_admin(cls, user_id: int) -> bool:
+        """ Check is user allowed to use admin commands.
+
+        Admins are whitelisted users from `admin_users` config key. If it's empty, all whitelisted users are admins.
+
+        Args:
+            user_id (int): Telegram user id.
+
+        Returns:
+            bool:
+                True - User is admin.
+                False - User is not admin.
+        """
+        return cls.is_whitelisted(user_id) and (not cls.__admins or user_id in cls.__admins)
+
+    @classmethod
+    def set_overwrite(cls, users: list):
+        """ Check whitelisted users from list instead of config file.
+
+        Args:
+            users (list): Telegram user ids, usually from `--whitelist` startup argument. None to use config file.
+        """
+        cls.__overwrite = users
+        cls.__last_check_time = None
+
+    @classmethod
+    def refresh_index(cls) -> bool:
+        """ Rebuild whitelist index if whitelisted users source was changed.
+
+        Returns:
+            bool:
+                True - Index was rebuilt.
+                False - Index is up-to-date.
+        """
+        # Whitelist has its own check interval, so config throttling must not stretch it
+        bot_cfg = (TM_Config.model(force_check=True) if TM_Config.is_exist() else TM_ConfigSection(DEF_CFG)).bot
+        # Interval is cached here, so the hot path doesn't touch config file at all
+        cls.__check_interval = bot_cfg.whitelist_check_interval
+        cls.__admins = frozenset(bot_cfg.admin_users)
+
+        if cls.__overwrite is not None:
+            source = cls.__overwrite
+        else:
+            source = bot_cfg.whitelisted_users
+
+        # Config dict is replaced only on actual file modification, so identity check is enough here
+        if source is cls.__index_source:
+            return False
+
+        cls.__index_source = source
+        index = frozenset(source)
+        if index != cls.__index:
+            cls.__index = index
+            cls.__logger.info(f"Whitelist index was rebuilt with {len(index)} user(-s)")
+            return True
+
+        return False
 
     @classmethod
     def get_whitelist(cls) -> list:
@@ -235,15 +900,14 @@ class TM_Whitelist:
         Returns:
             list: All whitelisted users.
         """
-        from telemonitor.main import args
         cls.__logger.debug('Whitelist read request')
-        whitelist = TM_Config.get()["bot"]["whitelisted_users"] if args.whitelist_overwrite is None else args.whitelist_overwrite
+        whitelist = TM_Config.model().bot.whitelisted_users if cls.__overwrite is None else cls.__overwrite
         cls.__logger.debug(f"Whitelist content: {whitelist}")
 
         return whitelist
 
     @classmethod
-    async def send_to_all(cls, bot: object, message: str) -> bool:
+    async def send_to_all(cls, bot: object, message: str) -> dict:
         """ Send message to all users in whitelist.
 
         Args:
@@ -251,33 +915,160 @@ class TM_Whitelist:
             message (str): Text of the message.
 
         Returns:
-            bool:
-                True - Message sent.
-                False - Message not sent.
+            dict: Delivery report for each whitelisted user, see `TM_Broadcast.send`.
+        """
+        return await TM_Broadcast.send(bot, cls.get_whitelist(), message, parse_mode=PARSE_MODE)
+
+
+class TM_TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        """ Asynchronous token bucket rate limiter.
+
+        Args:
+            rate (float): Amount of tokens restored per second.
+            capacity (float): Maximum amount of stored tokens (burst size).
+        """
+        self.__rate = rate
+        self.__capacity = capacity
+        self.__tokens = capacity
+        self.__updated = monotonic()
+
+    async def acquire(self):
+        """ Wait until one token is available and take it. """
+        while True:
+            now = monotonic()
+            self.__tokens = min(self.__capacity, self.__tokens + (now - self.__updated) * self.__rate)
+            self.__updated = now
+
+            if self.__tokens >= 1:
+                self.__tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self.__tokens) / self.__rate)
+
+
+class TM_BroadcastResult(NamedTuple):
+    user_id: int
+    success: bool
+    attempts: int
+    error: str = None
+
+
+class TM_Broadcast:
+    """ Concurrent message delivery within Telegram rate limits """
+    __logger = logging.getLogger(__name__)
+    __global_bucket = None
+    __chat_buckets = {}
+
+    @classmethod
+    async def send(cls, bot: object, users: list, message: str, **kwargs) -> dict:
+        """ Send message to all users concurrently.
+
+        Args:
+            bot (object): aiogram bot object.
+            users (list): Telegram ids of recipients.
+            message (str): Text of the message.
+            **kwargs: Additional arguments for `bot.send_message`.
+
+        Returns:
+            dict: `TM_BroadcastResult` for each recipient, mapped by user id.
+        """
+        results = await asyncio.gather(*(cls.__send_one(bot, user, message, kwargs) for user in dict.fromkeys(users)))
+        report = {result.user_id: result for result in results}
+
+        failed = sum(1 for result in results if not result.success)
+        cls.__logger.info(f"Broadcast finished: {len(results) - failed} delivered, {failed} failed")
+        return report
+
+    @classmethod
+    async def __send_one(cls, bot: object, user: int, message: str, kwargs: dict) -> TM_BroadcastResult:
+        """ Deliver message to single user with bounded retries.
+
+        Args:
+            bot (object): aiogram bot object.
+            user (int): Telegram user id.
+            message (str): Text of the message.
+            kwargs (dict): Additional arguments for `bot.send_message`.
+
+        Returns:
+            TM_BroadcastResult: Delivery result.
         """
-        for user in cls.get_whitelist():
+        from aiogram.utils.exceptions import RetryAfter, NetworkError, RestartingTelegram
+
+        if cls.__global_bucket is None:
+            cls.__global_bucket = TM_TokenBucket(BROADCAST_RATE_GLOBAL, BROADCAST_RATE_GLOBAL)
+        chat_bucket = cls.__chat_buckets.setdefault(user, TM_TokenBucket(BROADCAST_RATE_CHAT, 1))
+
+        error = None
+        for attempt in range(1, BROADCAST_MAX_ATTEMPTS + 1):
+            await chat_bucket.acquire()
+            await cls.__global_bucket.acquire()
+
             try:
-                await bot.send_message(user, message, parse_mode=PARSE_MODE)
-                cls.__logger.debug(f"Successfully sent startup message to user [{user}]")
-                return True
+                await bot.send_message(user, message, **kwargs)
+            except RetryAfter as e:
+                error = str(e)
+                delay = e.timeout
+                cls.__logger.warning(f"Flood control for user [{user}], retry in {delay} seconds")
+            except (NetworkError, RestartingTelegram, asyncio.TimeoutError) as e:
+                error = str(e)
+                delay = 0.5 * 2 ** attempt
+                cls.__logger.warning(f"Temporary error while sending message to user [{user}]: < {error} >")
             except Exception as e:
                 cls.__logger.error(f"Can't send message to whitelisted user [{user}]: < {str(e)} >")
-                return False
+                return TM_BroadcastResult(user, False, attempt, str(e))
+            else:
+                cls.__logger.debug(f"Successfully sent message to user [{user}]")
+                return TM_BroadcastResult(user, True, attempt)
+
+            if attempt < BROADCAST_MAX_ATTEMPTS:
+                await asyncio.sleep(delay)
+
+        cls.__logger.error(f"Can't send message to whitelisted user [{user}] after {BROADCAST_MAX_ATTEMPTS} attempts: < {error} >")
+        return TM_BroadcastResult(user, False, BROADCAST_MAX_ATTEMPTS, error)
+
+
+class TM_ConfigSection:
+    def __init__(self, schema: dict, values: dict = None):
+        """ Typed read-only view of config section with attribute access.
+
+        Values must be already validated with `TM_Config.config_check`. Lists and other
+        mutable values are shared with the source dict, not copied.
+
+        Args:
+            schema (dict): Section of `DEF_CFG`.
+            values (dict, optional): Section of validated config. Defaults to values from schema.
+        """
+        values = schema if values is None else values
+        for key, default in schema.items():
+            value = values.get(key, default)
+            object.__setattr__(self, key, TM_ConfigSection(default, value) if type(default) == dict else value)
+
+    def __setattr__(self, name: str, value: object):
+        raise AttributeError("Config values can be changed only with `TM_Config.set`")
+
+    def __repr__(self) -> str:
+        return f"TM_ConfigSection({self.__dict__})"
 
 
 class TM_Config:
     __config = {}
+    __model = None
     __last_mod_time = None
+    __next_check = 0
+    __write_timer = None
+    __write_lock = threading.RLock()
     __logger = logging.getLogger(__name__)
 
-    def __init__(self):
+    def __init__(self, args: object):
         """
         Initialize configuration file.
         If the configuration file is not found - it will be created.
         If the configuration file is found - it will be checked for all necessary values.
-        """
-        from telemonitor.main import args
 
+        Args:
+            args (object): Parsed startup arguments.
+        """
         colorama = tm_colorama()
         if not self.is_exist():
             self.create()
@@ -288,32 +1079,42 @@ class TM_Config:
                 text = "Reading bot token and whitelist from input arguments"
                 self.__logger.info(text)
                 print('- ' + text)
+            elif args.agent and args.hub_url:
+                text = "Reading hub address from input arguments"
+                self.__logger.info(text)
+                print('- ' + text)
             else:
                 # Generate config file and exit if no token and whitelist startup args provided
                 print("First, you need to configure it's values and then run the script again.")
                 exit()
 
-        cfg = self.get()
+        with open(PATH_CFG, 'rt') as f:
+            cfg = json.load(f)
 
         if args.disable_config_check:
+            # File is left as is, but values are still validated in memory
+            self.config_check(cfg)
             self.__logger.info('Configuration file check skipped')
         else:
-            config_check_result = self.config_check(cfg)
+            up_to_date, has_deprecated, migrated = self.config_check(cfg)
 
-            if not config_check_result[0] or config_check_result[1] or config_check_result[2]:
+            if not up_to_date or has_deprecated or migrated:
                 self.write(cfg)
 
             log_message = "Config file "
-            if config_check_result[0]:
+            if up_to_date:
                 log_message += "is up-to-date"
             else:
                 log_message += "was updated with new keys"
 
-            if config_check_result[1]:
+            if has_deprecated:
                 log_message += " and deprecated keys were removed"
 
             self.__logger.info(log_message)
 
+        # Already parsed and checked values are used, so the first `get` doesn't read file again
+        self.__apply(cfg, os.path.getmtime(PATH_CFG))
+
     @classmethod
     def create(cls):
         """ Create config file with default values. """
@@ -322,32 +1123,162 @@ class TM_Config:
 
     @classmethod
     def write(cls, config_dict: dict):
-        """ Rewrite configuration file with new values.
+        """ Atomically rewrite configuration file with new values.
+
+        Values are written to temporary file, flushed to disk and renamed over the old file,
+        so configuration file is never left partially written.
 
         Args:
             config_dict (dict): Dictionary with new config values.
         """
-        with open(PATH_CFG, 'wt') as f:
-            json.dump(config_dict, f, indent=4)
+        with cls.__write_lock:
+            data = json.dumps(config_dict, indent=4)
+            tmp_path = PATH_CFG + '.tmp'
+
+            try:
+                with open(tmp_path, 'wt') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, PATH_CFG)
+            except BaseException:
+                # Config file is left untouched, partially written copy is removed
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+            if sys_platform != 'win32':
+                # Persist rename itself
+                dir_fd = os.open(os.path.dirname(os.path.abspath(PATH_CFG)), os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+
+            if config_dict is cls.__config:
+                # File content is already loaded, don't parse it again
+                cls.__last_mod_time = os.path.getmtime(PATH_CFG)
+
         cls.__logger.debug("Successful write request to configuration file")
 
+    @classmethod
+    def set(cls, key: str, value: object):
+        """ Change config value at runtime.
+
+        Change is applied in memory immediately, while file is written in background after `CONFIG_WRITE_DELAY`
+        seconds, so all changes made meanwhile are coalesced into a single write.
+
+        Args:
+            key (str): Dot-separated path of key, like `bot.whitelisted_users`.
+            value (object): New value, must be of the same type as the default one.
+
+        Raises:
+            KeyError: Key doesn't exist in `DEF_CFG`.
+            TypeError: Value type doesn't match the default one.
+            ValueError: Value is less than minimum from `CFG_MIN_VALUES`.
+        """
+        *sections, name = key.split('.')
+        schema = DEF_CFG
+
+        with cls.__write_lock:
+            node = cls.get()
+            for section in sections:
+                schema = schema.get(section) if type(schema) == dict else None
+                node = node[section] if schema is not None else None
+            if type(schema) != dict or name not in schema or type(schema[name]) == dict:
+                raise KeyError(f"Unknown config key '{key}'")
+            if not cls.__is_valid(schema[name], value):
+                raise TypeError(f"Config key '{key}' must be of type '{type(schema[name]).__name__}'")
+            if not cls.__is_valid(schema[name], value, CFG_MIN_VALUES.get(key)):
+                raise ValueError(f"Config key '{key}' must be at least {CFG_MIN_VALUES[key]}")
+
+            node[name] = value
+            cls.__apply(cls.__config)
+
+            if cls.__write_timer is None:
+                cls.__write_timer = threading.Timer(CONFIG_WRITE_DELAY, cls.flush)
+                cls.__write_timer.daemon = True
+                cls.__write_timer.start()
+                atexit.register(cls.flush)
+
+        cls.__logger.debug(f"Config key '{key}' was changed, write is scheduled")
+
+    @classmethod
+    def flush(cls):
+        """ Write changes made with `TM_Config.set` to file immediately, if there are any. """
+        with cls.__write_lock:
+            if cls.__write_timer is None:
+                return
+
+            cls.__write_timer.cancel()
+            cls.__write_timer = None
+            atexit.unregister(cls.flush)
+            cls.write(cls.__config)
+
     @classmethod
     def get(cls) -> dict:
         """ Get json configuration file values.
 
         If config file wasn't changed from last read - get values from variable,
-        Else - Read values from modified file.
+        Else - Read values from modified file. Values are migrated and validated
+        against `DEF_CFG` in memory, so all keys are always present.
+        File modification is checked at most once per `CONFIG_CHECK_INTERVAL` seconds.
 
         Returns:
             dict: Parsed configuration json file.
         """
-        if cls.is_modified():
-            with open(PATH_CFG, 'rt') as f:
-                cls.__config = json.load(f)
-            cls.__last_mod_time = os.path.getmtime(PATH_CFG)
+        if cls.__is_check_due() and cls.is_modified():
+            cls.__load()
 
         return cls.__config
 
+    @classmethod
+    def model(cls, force_check: bool = False) -> TM_ConfigSection:
+        """ Get typed config with attribute access, like `TM_Config.model().bot.whitelisted_users`.
+
+        File modification is checked at most once per `CONFIG_CHECK_INTERVAL` seconds.
+
+        Args:
+            force_check (bool, optional): Check file modification right away, for callers with their own
+                check interval. Defaults to False.
+
+        Returns:
+            TM_ConfigSection: Config values. Object is rebuilt only when config changes.
+        """
+        if (force_check or cls.__is_check_due()) and cls.is_modified():
+            cls.__load()
+
+        return cls.__model
+
+    @classmethod
+    def __is_check_due(cls) -> bool:
+        if cls.__last_mod_time is None:
+            return True
+        now = monotonic()
+        if now < cls.__next_check:
+            return False
+        cls.__next_check = now + CONFIG_CHECK_INTERVAL
+        return True
+
+    @classmethod
+    def __load(cls):
+        with cls.__write_lock:
+            with open(PATH_CFG, 'rt') as f:
+                config = json.load(f)
+            mod_time = os.path.getmtime(PATH_CFG)
+
+            cls.config_check(config)
+            cls.__apply(config, mod_time)
+
+    @classmethod
+    def __apply(cls, config: dict, mod_time: float = None):
+        """ Use values of already checked config. Typed model is built here once per change. """
+        cls.__config = config
+        cls.__model = TM_ConfigSection(DEF_CFG, config)
+        if mod_time is not None:
+            cls.__last_mod_time = mod_time
+            cls.__next_check = monotonic() + CONFIG_CHECK_INTERVAL
+
     @classmethod
     def is_modified(cls) -> bool:
         """ Check if config file was modified from the last load.
@@ -376,7 +1307,11 @@ class TM_Config:
 
     @classmethod
     def config_check(cls, config: dict) -> tuple:
-        """ Configuration file recursive check system
+        """ Migrate configuration file to the current version and validate it against `DEF_CFG` in one pass.
+
+        Migrations are applied one by one, starting from the version of config file.
+        Then missing keys are added, deprecated keys are removed and values
+        of wrong type or below `CFG_MIN_VALUES` are reset to default.
 
         Args:
             config (dict): Parsed configuration file that will be modified
@@ -388,67 +1323,60 @@ class TM_Config:
                 bool   # was merged to newer version
             )
         """
-        def special_update_check() -> bool:
-            """ Non-automatic config updater for correct merge between major config file updates
-
-            Returns:
-                bool: Was config file updated
-            """
-            is_updated = False
-
-            if "config_version" not in config:
-                # Update config dict to version 2
-                # First version of config file doesn't have key 'config_version'
-                config.update({
-                    "bot": {
-                        "token": config.get("api_key", ""),
-                        "whitelisted_users": config.get("whitelisted_users", []),
-                        "state_notifications": config.get("state_notifications", DEF_CFG["bot"]["state_notifications"]),
-                        "enable_file_transfer": config.get("enable_file_transfer", DEF_CFG["bot"]["enable_file_transfer"])
-                    }
-                })
-                is_updated = True
-                cls.__logger.info("Successfully merged config file to version 2")
-
-            return is_updated
-
-        def add_new_keys(default_config=DEF_CFG, user_config=config) -> bool:
-            up_to_date = True
-
-            for k, v in list(default_config.items()):
-                if type(v) == dict:
-                    if k not in user_config:
-                        user_config[k] = v
-                        up_to_date = False
-                    else:
-                        up_to_date = add_new_keys(v, user_config[k])
-                elif k not in user_config:
-                    up_to_date = False
-                    user_config.update({k: v})
-                    cls.__logger.debug(f"Adding new key '{k}' to user configuration file")
-
-            return up_to_date
-
-        def remove_deprecated(default_config=DEF_CFG, user_config=config) -> bool:
-            has_deprecated_values = False
-
-            for k, v in list(user_config.items()):
-                if type(v) == dict:
-                    has_deprecated_values = remove_deprecated(default_config[k], v)
-                elif k not in default_config:
-                    has_deprecated_values = True
-                    del(user_config[k])
-                    cls.__logger.debug(f"Removing deprecated key '{k}' from user configuration file")
-
-            return has_deprecated_values
-
-        # Prepare output in right order
-        special_check = special_update_check()
-        any_deprecated = remove_deprecated()
-        any_new = add_new_keys()
+        migrations = {
+            2: cls.__migrate_to_v2
+        }
+
+        # First version of config file doesn't have key 'config_version'
+        version = config.get("config_version", 1)
+        migrated = version < DEF_CFG["config_version"]
+        for target in range(version + 1, DEF_CFG["config_version"] + 1):
+            migrations[target](config)
+            config["config_version"] = target
+            cls.__logger.info(f"Successfully merged config file to version {target}")
+
+        counters = {"added": 0, "removed": 0, "reset": 0}
+
+        def reconcile(schema: dict, user_config: dict, path: str):
+            for k in list(user_config):
+                if k not in schema:
+                    del user_config[k]
+                    counters["removed"] += 1
+                    cls.__logger.debug(f"Removing deprecated key '{path}{k}' from user configuration file")
+
+            for k, default in schema.items():
+                if k not in user_config:
+                    user_config[k] = copy.deepcopy(default)
+                    counters["added"] += 1
+                    cls.__logger.debug(f"Adding new key '{path}{k}' to user configuration file")
+                elif type(default) == dict and type(user_config[k]) == dict:
+                    reconcile(default, user_config[k], f"{path}{k}.")
+                elif not cls.__is_valid(default, user_config[k], CFG_MIN_VALUES.get(f"{path}{k}")):
+                    cls.__logger.warning(f"Config key '{path}{k}' has invalid value {user_config[k]!r}, default value {default!r} is used")
+                    user_config[k] = copy.deepcopy(default)
+                    counters["reset"] += 1
+
+        reconcile(DEF_CFG, config, "")
 
         return (
-            any_new,
-            any_deprecated,
-            special_check
+            counters["added"] == 0 and counters["reset"] == 0,
+            counters["removed"] > 0,
+            migrated
         )
+
+    @staticmethod
+    def __is_valid(default: object, value: object, minimum: float = None) -> bool:
+        """ Check that value has the same type as the default one and isn't less than minimum. Integer and float numbers are interchangeable. """
+        if type(default) in (int, float):
+            return type(value) in (int, float) and (minimum is None or value >= minimum)
+        return type(value) == type(default)
+
+    @staticmethod
+    def __migrate_to_v2(config: dict):
+        """ Move bot settings of the first config version to `bot` section """
+        config["bot"] = {
+            "token": config.get("api_key", ""),
+            "whitelisted_users": config.get("whitelisted_users", []),
+            "state_notifications": config.get("state_notifications", DEF_CFG["bot"]["state_notifications"]),
+            "enable_file_transfer": config.get("enable_file_transfer", DEF_CFG["bot"]["enable_file_transfer"])
+        }
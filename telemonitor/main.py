@@ -1,39 +1,49 @@
+import sys
+import asyncio
 import logging
-from os import chdir, path
-
-from aiogram import Bot, Dispatcher, executor, types
-from aiogram.utils.markdown import bold, code
+from os import chdir, execv, path
 
 from telemonitor import helpers as h, __version__
-from telemonitor.extensions import systemd_service
-from telemonitor.helpers import TM_Whitelist, TM_ControlInlineKB, cli_arguments_parser, tm_colorama, PARSE_MODE, STRS
-
-
-args = cli_arguments_parser()
-
+from telemonitor.helpers import TM_Whitelist, TM_ControlInlineKB, TM_Offload, TM_LoopMonitor, TM_StartupProfiler, cli_arguments_parser, tm_colorama, PARSE_MODE, STRS
 
-def run():
-    colorama = tm_colorama()
-    colorama.init(autoreset=True)
-    chdir(path.dirname(__file__))
 
-    h.init_logger(args.verbose)
-    logger = logging.getLogger(__name__)
-    logger.info("Telemonitor is starting")
+def setup_dispatcher(bot: object, cfg: object, webhook: bool = False) -> object:
+    """ Create dispatcher with all middlewares and handlers registered.
 
-    # Initialize config and read it
-    cfg = h.TM_Config().get()
-    if args.config_check_only: exit()
+    Args:
+        bot (object): aiogram Bot object.
+        cfg (TM_ConfigSection): Typed config values.
+        webhook (bool, optional): Bot receives updates with webhook. Defaults to False.
 
-    if args.systemd_service is not None:
-        systemd_service.cli(args.systemd_service)
+    Returns:
+        object: aiogram Dispatcher object.
+    """
+    # aiogram and extensions are imported only when bot is actually started, so CLI commands don't pay for them
+    from aiogram import Dispatcher, types
+    from aiogram.utils.markdown import bold, code
+    from telemonitor.middlewares import TM_WhitelistMiddleware, TM_UserQueueMiddleware
+    from telemonitor.extensions.metrics.history import TM_History
+    from telemonitor.extensions.telemetry import TM_Telemetry, TM_TelemetryMiddleware
+    from telemonitor.extensions.dashboard import TM_Dashboard
+    from telemonitor.extensions.logs import TM_LogReader, parse_args as parse_logs_args, send_lines as send_log_lines
+    from telemonitor.extensions.store import TM_Store
+    from telemonitor.extensions.commands import TM_CommandRunner, parse_command
 
-    api_token = cfg["bot"]["token"] if args.token_overwrite is None else args.token_overwrite
-    bot = Bot(token=api_token)
     dp = Dispatcher(bot)
+    TM_Telemetry.instrument_bot(bot)
+    whitelist_middleware = TM_WhitelistMiddleware()
+    queue_middleware = TM_UserQueueMiddleware()
+    # Telemetry goes first, so rejected updates are counted too. Queues go last, only accepted updates are queued
+    dp.middleware.setup(TM_TelemetryMiddleware())
+    dp.middleware.setup(whitelist_middleware)
+    dp.middleware.setup(queue_middleware)
+    TM_Telemetry.add_gauge("rejected_updates", "Rejected updates", lambda: whitelist_middleware.rejected_total)
+    TM_Telemetry.add_gauge("dropped_updates", "Dropped updates", lambda: queue_middleware.dropped)
+    TM_Telemetry.add_gauge("loop_lag_seconds", "Event loop lag", lambda: TM_LoopMonitor.last_lag)
+    TM_Telemetry.add_gauge("loop_lag_max_seconds", "Max event loop lag", lambda: TM_LoopMonitor.max_lag)
 
     # Inline keyboard for controls
-    ikb = TM_ControlInlineKB(bot, dp)
+    ikb = TM_ControlInlineKB(bot, dp, webhook=webhook)
 
     # Handlers
     @dp.message_handler(commands=['start'])
@@ -46,27 +56,245 @@ def run():
                 reply_markup=ikb.keyboard
             )
 
-    if cfg["bot"]["enable_file_transfer"]:
+    @dp.message_handler(commands=['history'])
+    async def __command_history(message: types.Message):
+        if TM_Whitelist.is_whitelisted(message.from_user.id):
+            await message.reply(TM_History.render(message.get_args()), reply=False, parse_mode=PARSE_MODE)
+
+    @dp.message_handler(commands=['stats'])
+    async def __command_stats(message: types.Message):
+        if TM_Whitelist.is_admin(message.from_user.id):
+            await message.reply(TM_Telemetry.render(), reply=False, parse_mode=PARSE_MODE)
+
+    @dp.message_handler(commands=['logs'])
+    async def __command_logs(message: types.Message):
+        if TM_Whitelist.is_admin(message.from_user.id):
+            try:
+                mode, value, since = parse_logs_args(message.get_args())
+            except ValueError as e:
+                await message.reply(code(str(e)), reply=False, parse_mode=PARSE_MODE)
+                return
+
+            if mode == "tail":
+                lines = await TM_Offload.run(TM_LogReader.tail, value)
+                title = "Last log lines"
+            else:
+                lines = await TM_Offload.run(TM_LogReader.grep, value, since)
+                title = f"Log lines matching {value.pattern.decode()}"
+            await send_log_lines(bot, message.chat.id, title, lines)
+
+    @dp.message_handler(commands=['audit'])
+    async def __command_audit(message: types.Message):
+        if TM_Whitelist.is_admin(message.from_user.id):
+            await message.reply(await TM_Offload.run(TM_Store.render_audit, message.get_args()), reply=False, parse_mode=PARSE_MODE)
+
+    @dp.message_handler(commands=['transfers'])
+    async def __command_transfers(message: types.Message):
+        if TM_Whitelist.is_admin(message.from_user.id):
+            await message.reply(await TM_Offload.run(TM_Store.render_transfers, message.get_args()), reply=False, parse_mode=PARSE_MODE)
+
+    @dp.message_handler(commands=['selfstat'])
+    async def __command_selfstat(message: types.Message):
+        if TM_Whitelist.is_admin(message.from_user.id):
+            from telemonitor.extensions.selfstat import TM_SelfStat
+
+            await message.reply(await TM_SelfStat.render(message.get_args()), reply=False, parse_mode=PARSE_MODE)
+
+    @dp.message_handler(commands=['run'])
+    async def __command_run(message: types.Message):
+        if TM_Whitelist.is_whitelisted(message.from_user.id):
+            try:
+                argv = parse_command(message.get_args(), h.TM_Config.model().commands.allowlist)
+                TM_CommandRunner.start(bot, message.chat.id, argv)
+                # Commands rejected by concurrency limit never ran, so they're not audited
+                TM_Store.audit(message.from_user.id, 'run', message.get_args())
+            except ValueError as e:
+                await message.reply(code(str(e)), reply=False, parse_mode=PARSE_MODE)
+
+    TM_Telemetry.add_gauge("running_commands", "Running /run commands", TM_CommandRunner.running)
+    TM_Telemetry.add_gauge("store_written_rows", "Rows written to state store", lambda: TM_Store.stats()[0])
+    TM_Telemetry.add_gauge("store_dropped_rows", "Rows dropped by state store", lambda: TM_Store.stats()[1])
+
+    TM_Dashboard.setup(bot, dp, ikb)
+    TM_Telemetry.add_gauge("dashboards", "Open live dashboards", TM_Dashboard.count)
+    TM_Telemetry.add_gauge("dashboard_edits", "Dashboard edits", lambda: TM_Dashboard.stats()[0])
+    TM_Telemetry.add_gauge("dashboard_edits_suppressed", "Skipped dashboard edits", lambda: TM_Dashboard.stats()[1])
+
+    if cfg.hub.listen:
+        from telemonitor.extensions.hub.keyboard import TM_HubKeyboard
+
+        TM_HubKeyboard(bot, dp, ikb)
+
+    if cfg.bot.enable_file_transfer:
+        from telemonitor.extensions.file_transfer import TM_FileTransfer, TM_FileTransferError
+        from telemonitor.extensions.file_transfer.browser import TM_FileBrowser
+
+        TM_FileBrowser(bot, dp)
+
+        @dp.message_handler(commands=['fetch'])
+        async def __command_fetch(message: types.Message):
+            if TM_Whitelist.is_admin(message.from_user.id):
+                from telemonitor.extensions.file_transfer.archive import TM_Fetch, TM_FetchError, resolve_path
+
+                # Upload can take minutes, other updates of user shouldn't wait for it
+                TM_UserQueueMiddleware.release()
+
+                try:
+                    file_path = await TM_Offload.run(resolve_path, message.get_args())
+                    text = await TM_Fetch.send(bot, message.chat.id, file_path)
+                except ValueError as e:
+                    text = code(str(e))
+                except TM_FetchError as e:
+                    text = f"{bold('Archive upload failed')}: {code(str(e))}\n{bold('Sent parts')}: {code(e.parts_sent)}"
+                else:
+                    TM_Store.transfer(message.from_user.id, 'out', file_path)
+                await message.reply(text, reply=False, parse_mode=PARSE_MODE)
+
         @dp.message_handler(content_types=['document', 'photo'])
         async def __file_transfer(message: types.Message):
             if TM_Whitelist.is_whitelisted(message.from_user.id):
-                h.init_shared_dir()
+                TM_UserQueueMiddleware.release()
                 if message.content_type == 'document':
-                    await message.document.download(path.join(h.PATH_SHARED_DIR, message.document.file_name))
-                    logger.info(f'Successfully downloaded file "{message.document.file_name}" to "{path.abspath(h.PATH_SHARED_DIR)}""')
-                    await message.reply(text=f"Successfully downloaded file {code(message.document.file_name)}", parse_mode=PARSE_MODE, reply=False)
-                elif message.content_type == 'photo':
-                    await message.photo[-1].download(h.PATH_SHARED_DIR)
-                    logger.info(f'Successfully downloaded image(-s) to "{path.join(path.abspath(h.PATH_SHARED_DIR), "photos")}"')
-                    await message.reply(text="Successfully downloaded image(-s)", parse_mode=PARSE_MODE, reply=False)
+                    file, file_name, text = message.document, message.document.file_name, f"Successfully downloaded file {code(message.document.file_name)}"
+                else:
+                    file, file_name, text = message.photo[-1], None, "Successfully downloaded image(-s)"
+
+                try:
+                    file_path = await TM_FileTransfer.download(bot, file, file_name)
+                except TM_FileTransferError as e:
+                    text = f"Can't download file: {code(str(e))}"
+                else:
+                    TM_Store.transfer(message.from_user.id, 'in', path.relpath(file_path, h.PATH_SHARED_DIR), file.file_size)
+                await message.reply(text=text, parse_mode=PARSE_MODE, reply=False)
+
+    return dp
+
+
+def run(argv: list = None):
+    args = cli_arguments_parser(argv)
+    if args.profile_startup:
+        TM_StartupProfiler.start()
+
+    colorama = tm_colorama(disable=args.disable_colored_output)
+    colorama.init(autoreset=True)
+    # Restart after exceeding memory limit runs the same command, so script path must survive the workdir change
+    restart_argv = [sys.executable, path.abspath(sys.argv[0])] + (sys.argv[1:] if argv is None else argv)
+    chdir(path.dirname(__file__))
+
+    h.init_logger(args.verbose)
+    logger = logging.getLogger(__name__)
+    logger.info("Telemonitor is starting")
+
+    # Initialize config and read it
+    h.TM_Config(args)
+    cfg = h.TM_Config.model()
+    TM_StartupProfiler.mark("logger and config")
+    if args.config_check_only: exit()
+
+    if args.systemd_service is not None:
+        from telemonitor.extensions import systemd_service
+        systemd_service.cli(args.systemd_service)
+
+    if args.agent:
+        from telemonitor.extensions.hub import TM_Agent
+
+        url = args.hub_url or cfg.hub.url
+        if not url:
+            print(f"{colorama.Fore.RED}Agent mode requires hub address, provided with {colorama.Fore.CYAN}--hub-url{colorama.Fore.RESET} argument or {colorama.Fore.CYAN}hub.url{colorama.Fore.RESET} config value")
+            exit()
+
+        print(f'{colorama.Fore.CYAN}{STRS.name}{colorama.Style.RESET_ALL} agent is starting. Version: {colorama.Fore.CYAN}{__version__}{colorama.Style.RESET_ALL}')
+        try:
+            asyncio.run(TM_Agent.serve(url, args.agent_name))
+        except KeyboardInterrupt:
+            pass
+        h.TM_Config.flush()
+        exit()
+
+    if args.webhook and args.webhook_url is None:
+        print(f"{colorama.Fore.RED}Webhook mode requires public server url, provided with {colorama.Fore.CYAN}--webhook-url{colorama.Fore.RESET} argument")
+        exit()
+
+    TM_Whitelist.set_overwrite(args.whitelist_overwrite)
+
+    from aiogram import Bot, executor
+    TM_StartupProfiler.mark("aiogram import")
+
+    from telemonitor.extensions.metrics import TM_Metrics
+    from telemonitor.extensions.metrics.history import TM_History
+    from telemonitor.extensions.alerts import TM_Alerts
+    from telemonitor.extensions.telemetry import TM_Telemetry
+    from telemonitor.extensions.hub import TM_Hub
+    from telemonitor.extensions.dashboard import TM_Dashboard
+    from telemonitor.extensions.store import TM_Store
+    from telemonitor.extensions.commands import TM_CommandRunner
+    from telemonitor.extensions.systemd_service.notify import TM_SystemdNotify
+    from telemonitor.extensions.selfstat import TM_SelfStat, RESTART_EXIT_CODE
+    TM_StartupProfiler.mark("extensions import")
+
+    under_systemd = TM_SystemdNotify.setup()
+    api_token = cfg.bot.token if args.token_overwrite is None else args.token_overwrite
+    bot = Bot(token=api_token)
+    dp = setup_dispatcher(bot, cfg, webhook=args.webhook)
+    TM_StartupProfiler.mark("bot and dispatcher setup")
+
+    def __interrupt():
+        # Stops polling or webhook server the same way as Ctrl+C does, with all shutdown hooks
+        raise KeyboardInterrupt
+
+    async def __on_startup(dp: object):
+        TM_LoopMonitor.start()
+        TM_SelfStat.start(stop_loop=lambda: asyncio.get_event_loop().call_soon(__interrupt))
+        TM_Metrics.add_listener(TM_History.record)
+        if await TM_Offload.run(TM_Store.start):
+            TM_Metrics.add_listener(TM_Store.record_metrics)
+        if TM_Alerts.start(bot):
+            TM_Metrics.add_listener(TM_Alerts.evaluate)
+        TM_Metrics.start()
+        await TM_Telemetry.start_server()
+        await TM_Hub.start_server()
+        # Startup notifications are rate limited and can take a while, so readiness is reported before them.
+        # Polling starts only after startup hooks return, the first watchdog checks allow for that with polling stall timeout
+        TM_SystemdNotify.ready(polling=not args.webhook)
+        if cfg.bot.state_notifications:
+            await TM_Whitelist.send_to_all(bot, STRS.message_startup)
+        TM_StartupProfiler.mark("startup hooks")
+        TM_StartupProfiler.report()
+
+    async def __on_shutdown(dp: object):
+        TM_SystemdNotify.stopping()
+        TM_Metrics.stop()
+        TM_Dashboard.stop()
+        TM_CommandRunner.stop()
+        TM_SelfStat.stop()
+        TM_LoopMonitor.stop()
+        await TM_Telemetry.stop_server()
+        await TM_Hub.stop_server()
+        await TM_Offload.run(TM_Store.stop)
+        h.TM_Config.flush()
+        if cfg.bot.state_notifications and args.dev_features:
+            await TM_Whitelist.send_to_all(bot, STRS.message_shutdown)
 
     print(f'{colorama.Fore.CYAN}{STRS.name}{colorama.Style.RESET_ALL} is starting. Version: {colorama.Fore.CYAN}{__version__}{colorama.Style.RESET_ALL}')
-    executor.start_polling(
-        dp,
-        skip_updates=True,
-        on_startup=(lambda _: TM_Whitelist.send_to_all(bot, STRS.message_startup)) if cfg["bot"]["state_notifications"] else None,
-        on_shutdown=(lambda _: TM_Whitelist.send_to_all(bot, STRS.message_shutdown)) if cfg["bot"]["state_notifications"] and args.dev_features else None
-    )
+    if args.webhook:
+        from telemonitor.extensions import webhook
+        webhook.start(dp, args, on_startup=__on_startup, on_shutdown=__on_shutdown)
+    else:
+        executor.start_polling(
+            dp,
+            skip_updates=True,
+            on_startup=__on_startup,
+            on_shutdown=__on_shutdown
+        )
+
+    restart_reason = TM_SelfStat.restart_reason()
+    if restart_reason is not None:
+        logger.warning(f"Restarting the bot: {restart_reason}")
+        logging.shutdown()
+        if under_systemd:
+            # Service is restarted by systemd, that also starts notify protocol from scratch
+            sys.exit(RESTART_EXIT_CODE)
+        execv(sys.executable, restart_argv)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+from collections import Counter
+from contextvars import ContextVar
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.utils.exceptions import TelegramAPIError
+
+from telemonitor.helpers import TM_Whitelist, USER_QUEUE_SIZE
+
+
+# Update fields with event, that has `from_user`
+UPDATE_EVENTS = (
+    "message", "edited_message", "callback_query",
+    "inline_query", "chosen_inline_result", "shipping_query",
+    "pre_checkout_query", "my_chat_member", "chat_member",
+    "chat_join_request"
+)
+
+
+def get_update_user(update: types.Update) -> object:
+    """ Get the sender of update.
+
+    Args:
+        update (types.Update): aiogram Update object.
+
+    Returns:
+        object: aiogram User object or None if update has no sender.
+    """
+    # Member and join request updates were added in newer aiogram versions, so missing attributes are skipped
+    for name in UPDATE_EVENTS:
+        event = getattr(update, name, None)
+        if event is not None:
+            return event.from_user
+
+    poll_answer = getattr(update, "poll_answer", None)
+    if poll_answer is not None:
+        return poll_answer.user
+
+    return None
+
+
+class TM_WhitelistMiddleware(BaseMiddleware):
+    """ Dispatcher middleware that drops updates from non-whitelisted users before any handler runs """
+    __logger = logging.getLogger(__name__)
+    __rejected_ids_max = 1000
+
+    def __init__(self):
+        super().__init__()
+        self.__rejected = Counter()
+        self.__rejected_total = 0
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        user = get_update_user(update)
+        if user is not None and await TM_Whitelist.is_whitelisted_async(user.id):
+            return
+
+        user_id = None if user is None else user.id
+        self.__rejected_total += 1
+        if user_id in self.__rejected:
+            self.__rejected[user_id] += 1
+        elif len(self.__rejected) < self.__rejected_ids_max:
+            # Log only the first update from each unknown user to keep floods out of the log file
+            self.__rejected[user_id] = 1
+            self.__logger.info(f"Rejected update from non-whitelisted user [{user_id}]")
+
+        raise CancelHandler()
+
+    @property
+    def rejected(self) -> Counter:
+        """ Get counters of rejected updates.
+
+        Returns:
+            Counter: Amount of rejected updates by Telegram user id.
+        """
+        return self.__rejected
+
+    @property
+    def rejected_total(self) -> int:
+        """ Get total amount of rejected updates.
+
+        Returns:
+            int: Amount of rejected updates.
+        """
+        return self.__rejected_total
+
+
+class TM_UserQueue:
+    def __init__(self):
+        """ Updates of single user: the one being processed and those waiting for it. """
+        self.lock = asyncio.Lock()
+        self.size = 0
+        # Data of callback queries, waiting in queue
+        self.waiting = Counter()
+
+
+class TM_UserQueueMiddleware(BaseMiddleware):
+    """ Dispatcher middleware that processes updates of each user in order, while different users are processed in parallel.
+
+    Queue of each user is bounded, updates over the limit and callback queries, that duplicate already waiting ones,
+    are dropped. Must be set up after all other middlewares, that can cancel updates.
+    Long-running handlers, like file uploads, leave the queue early with `TM_UserQueueMiddleware.release`.
+    """
+    __logger = logging.getLogger(__name__)
+    # Middleware and data of update, that holds the queue in current task
+    __current = ContextVar("TM_UserQueueMiddleware.current", default=None)
+
+    def __init__(self, max_size: int = USER_QUEUE_SIZE):
+        """ Create middleware with empty queues.
+
+        Args:
+            max_size (int, optional): Maximum amount of updates of single user, including the one being processed.
+                Defaults to USER_QUEUE_SIZE.
+        """
+        super().__init__()
+        self.__max_size = max_size
+        self.__queues = {}
+        self.__dropped = 0
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        user = get_update_user(update)
+        if user is None:
+            return
+
+        queue = self.__queues.get(user.id)
+        if queue is None:
+            queue = self.__queues[user.id] = TM_UserQueue()
+
+        key = update.callback_query.data if update.callback_query is not None else None
+        if queue.size >= self.__max_size or (key is not None and queue.waiting[key]):
+            self.__dropped += 1
+            self.__logger.debug(f"Dropped update [{update.update_id}] of user [{user.id}] with {queue.size} updates in queue")
+            if update.callback_query is not None:
+                await self.__answer(update.callback_query)
+            raise CancelHandler()
+
+        queue.size += 1
+        queue.waiting[key] += 1
+        try:
+            await queue.lock.acquire()
+        except BaseException:
+            self.__leave(user.id, queue)
+            raise
+        finally:
+            queue.waiting[key] -= 1
+            if not queue.waiting[key]:
+                del queue.waiting[key]
+        data["_user_queue"] = (user.id, queue)
+        self.__current.set((self, data))
+
+    async def on_post_process_update(self, update: types.Update, results: list, data: dict):
+        self.__release(data)
+
+    @classmethod
+    def release(cls):
+        """ Let the next updates of the same user run, while handler of the current one keeps running.
+
+        Should be called by handlers, that take long, so other updates of user don't wait and aren't dropped meanwhile.
+        Does nothing if current update isn't queued.
+        """
+        current = cls.__current.get()
+        if current is not None:
+            cls.__current.set(None)
+            middleware, data = current
+            middleware.__release(data)
+
+    @property
+    def dropped(self) -> int:
+        """ Get total amount of dropped updates.
+
+        Returns:
+            int: Amount of dropped updates.
+        """
+        return self.__dropped
+
+    def __release(self, data: dict):
+        user_id, queue = data.pop("_user_queue", (None, None))
+        if queue is None:
+            return
+
+        queue.lock.release()
+        self.__leave(user_id, queue)
+
+    def __leave(self, user_id: int, queue: TM_UserQueue):
+        queue.size -= 1
+        if not queue.size:
+            del self.__queues[user_id]
+
+    async def __answer(self, callback_query: types.CallbackQuery):
+        # Stops loading animation of the button, the same reply will be delivered by update that is already in queue
+        try:
+            await self.manager.bot.answer_callback_query(callback_query.id)
+        except TelegramAPIError as e:
+            self.__logger.debug(f"Can't answer dropped callback query: < {str(e)} >")
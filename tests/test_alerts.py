@@ -0,0 +1,57 @@
+"""
+Test alert rules evaluation
+"""
+import asyncio
+
+import pytest
+
+from telemonitor.extensions.alerts import TM_AlertRule, TM_Alerts, TM_Whitelist
+
+
+def feed(rule: TM_AlertRule, samples: list) -> list:
+    return [rule.evaluate(t, v) for t, v in samples]
+
+
+def test_rule_malformed():
+    with pytest.raises(ValueError):
+        TM_AlertRule("cpu is high")
+
+
+def test_rule_fires_once():
+    rule = TM_AlertRule("cpu > 90")
+    assert feed(rule, [(0, 50), (5, 95), (10, 99), (15, 80)]) == [None, 'fire', None, 'resolve']
+
+
+def test_rule_debounce():
+    rule = TM_AlertRule("cpu > 90 for 2m")
+    assert feed(rule, [(0, 95), (60, 95), (90, 50), (100, 95), (219, 95), (220, 95)]) == [None, None, None, None, None, 'fire']
+
+
+def test_rule_hysteresis():
+    rule = TM_AlertRule("disk_free:/ < 5% clear 10%")
+    assert rule.metric == "disk_free:/"
+    assert feed(rule, [(0, 4), (5, 6), (10, 4.5), (15, 11)]) == ['fire', None, None, 'resolve']
+
+
+def test_rule_sliding_average():
+    rule = TM_AlertRule("load1 avg 10s >= 2")
+    assert feed(rule, [(0, 1), (5, 3), (10, 1), (15, 1)]) == [None, 'fire', None, 'resolve']
+
+
+def test_notification_errors_are_logged(monkeypatch, caplog):
+    async def send_to_all(bot, text):
+        raise ConnectionError("network is down")
+
+    monkeypatch.setattr(TM_Alerts, '_TM_Alerts__rules', {"cpu": [TM_AlertRule("cpu > 90")]})
+    monkeypatch.setattr(TM_Alerts, '_TM_Alerts__bot', object())
+    monkeypatch.setattr(TM_Whitelist, 'send_to_all', send_to_all)
+
+    async def main():
+        TM_Alerts.evaluate({"time": 0, "cpu": 95})
+        # Notification task isn't referenced by caller, but isn't lost
+        assert len(TM_Alerts._TM_Alerts__tasks) == 1
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert not TM_Alerts._TM_Alerts__tasks
+    assert "Alert notification failed: < network is down >" in caplog.text
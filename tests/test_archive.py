@@ -0,0 +1,126 @@
+"""
+Test streamed directory archives split into upload parts
+"""
+import io
+import os
+import asyncio
+import threading
+import tarfile
+
+import pytest
+
+from telemonitor.extensions.file_transfer import archive
+from telemonitor.extensions.file_transfer.archive import TM_Fetch, TM_FetchError, estimate_size, resolve_path
+
+
+class FakeBot:
+    def __init__(self, fail_on: int = None):
+        self.documents = []
+        self.fail_on = fail_on
+
+    async def send_document(self, chat_id, document):
+        if len(self.documents) + 1 == self.fail_on:
+            # Upload breaks after the first chunk
+            await asyncio.get_event_loop().run_in_executor(None, document.file.read, 1024)
+            raise ConnectionError("connection lost")
+        # Same as aiohttp payload, file is read in executor by 64 KiB chunks
+        data = bytearray()
+        while True:
+            chunk = await asyncio.get_event_loop().run_in_executor(None, document.file.read, 65536)
+            if not chunk:
+                break
+            data += chunk
+        self.documents.append((document.filename, bytes(data)))
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, 'get_compressor', lambda: "gz")
+    root = tmp_path / "dumps"
+    (root / "nested").mkdir(parents=True)
+    for i in range(3):
+        # Random content doesn't compress, so archive is larger than a part
+        (root / f"dump_{i}.bin").write_bytes(os.urandom(100_000))
+    (root / "nested" / "notes.txt").write_text("hello\n" * 1000)
+    return str(root)
+
+
+def fetch(bot: FakeBot, path: str) -> str:
+    return asyncio.run(TM_Fetch.send(bot, 1, path))
+
+
+def test_split_into_parts(data_dir, monkeypatch):
+    monkeypatch.setattr(archive, 'PART_SIZE', 128 * 1024)
+    bot = FakeBot()
+    text = fetch(bot, data_dir)
+
+    names = [d[0] for d in bot.documents]
+    assert len(names) == 3 and all(n.startswith("dumps_") and n.endswith(f".tar.gz.00{i + 1}") for i, n in enumerate(names))
+    assert all(len(d[1]) <= archive.PART_SIZE for d in bot.documents)
+    assert "*Parts*: `3`" in text
+
+    with tarfile.open(fileobj=io.BytesIO(b"".join(d[1] for d in bot.documents)), mode="r:gz") as tar:
+        members = {m.name: m for m in tar.getmembers()}
+        assert set(members) == {"dumps", "dumps/nested", "dumps/nested/notes.txt", "dumps/dump_0.bin", "dumps/dump_1.bin", "dumps/dump_2.bin"}
+        assert tar.extractfile(members["dumps/dump_1.bin"]).read() == open(os.path.join(data_dir, "dump_1.bin"), "rb").read()
+
+
+def test_single_part_and_file(data_dir):
+    bot = FakeBot()
+    fetch(bot, os.path.join(data_dir, "nested"))
+    fetch(bot, os.path.join(data_dir, "nested", "notes.txt"))
+
+    assert [d[0].endswith(".tar.gz") for d in bot.documents] == [True, True]
+    with tarfile.open(fileobj=io.BytesIO(bot.documents[1][1]), mode="r:gz") as tar:
+        assert tar.getnames() == ["notes.txt"]
+
+
+def test_failed_upload_stops_writer(data_dir, monkeypatch):
+    monkeypatch.setattr(archive, 'PART_SIZE', 128 * 1024)
+    monkeypatch.setattr(archive, 'PIPE_CHUNKS', 2)
+    monkeypatch.setattr(archive, 'PIPE_CHUNK_SIZE', 4096)
+
+    with pytest.raises(TM_FetchError) as e:
+        fetch(FakeBot(fail_on=2), data_dir)
+    assert e.value.parts_sent == 1
+    assert not any(t.name == "TM_ArchiveWriter" for t in threading.enumerate())
+
+
+def test_incomplete_archive_is_error(data_dir, monkeypatch):
+    monkeypatch.setattr(archive, 'PART_SIZE', 128 * 1024)
+    add = archive.TM_ArchiveWriter._TM_ArchiveWriter__add
+
+    def failing_add(self, tar, path, base):
+        if path.endswith("dump_2.bin"):
+            raise RuntimeError("disk failure")
+        add(self, tar, path, base)
+
+    monkeypatch.setattr(archive.TM_ArchiveWriter, '_TM_ArchiveWriter__add', failing_add)
+    bot = FakeBot()
+    with pytest.raises(TM_FetchError) as e:
+        fetch(bot, data_dir)
+    assert "disk failure" in str(e.value)
+    # Files before the failed one are already delivered
+    assert e.value.parts_sent == len(bot.documents) > 0
+
+
+def test_estimate_and_resolve(data_dir, tmp_path):
+    size = estimate_size(data_dir)
+    assert 300_000 < size < 320_000
+    assert resolve_path(f'"{data_dir}"') == data_dir
+    for arg in ("", str(tmp_path / "missing")):
+        with pytest.raises(ValueError):
+            resolve_path(arg)
+
+
+def test_unexpected_parts_are_numbered(data_dir, monkeypatch):
+    # Files grew after size estimation, so archive needs more parts than expected
+    monkeypatch.setattr(archive, 'PART_SIZE', 128 * 1024)
+    monkeypatch.setattr(archive, 'estimate_size', lambda path: 1024)
+    bot = FakeBot()
+    text = fetch(bot, data_dir)
+
+    names = [d[0] for d in bot.documents]
+    assert len(names) == 3 and names[0].endswith(".tar.gz")
+    assert names[1:] == [f"{names[0]}.002", f"{names[0]}.003"]
+    assert f"mv {names[0]} {names[0]}.001" in text.replace("\\", "")
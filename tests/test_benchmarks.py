@@ -0,0 +1,22 @@
+"""
+Smoke test of benchmark suite with local fake Bot API server
+"""
+import sys
+import json
+
+from benchmarks.__main__ import main
+
+
+def test_benchmarks_run(tmp_path, monkeypatch):
+    result_path = tmp_path / "results.json"
+    monkeypatch.setattr(sys, 'argv', ['benchmarks', '--updates', '20', '--file-size', '4', '--json', str(result_path)])
+    main()
+
+    results = json.loads(result_path.read_text())
+    for name in ("start_flood", "callback_storm", "mixed_senders", "documents"):
+        assert results[name]["errors"] == 0
+        assert results[name]["updates_per_sec"] > 0
+
+    # Updates from non-whitelisted users never reach handlers
+    assert results["mixed_senders"]["api_calls"] == 10
+    assert results["send_to_all"]["api_calls"] == results["send_to_all"]["users"]
@@ -0,0 +1,61 @@
+"""
+Test concurrent broadcast delivery
+"""
+import asyncio
+
+from aiogram.utils.exceptions import RetryAfter, ChatNotFound
+
+from telemonitor.helpers import TM_Broadcast, TM_TokenBucket
+
+
+class FakeBot:
+    def __init__(self, failures: dict):
+        self.failures = failures
+        self.sent = []
+
+    async def send_message(self, user, message, **kwargs):
+        await asyncio.sleep(0.05)
+        errors = self.failures.get(user)
+        if errors:
+            raise errors.pop(0)
+        self.sent.append(user)
+
+
+def test_broadcast_report():
+    bot = FakeBot({
+        101: [RetryAfter(0)],
+        102: [ChatNotFound('Chat not found')]
+    })
+    report = asyncio.run(TM_Broadcast.send(bot, [100, 101, 102], "text"))
+
+    assert sorted(bot.sent) == [100, 101]
+    assert report[100].success and report[100].attempts == 1
+    assert report[101].success and report[101].attempts == 2
+    assert not report[102].success and report[102].error
+
+
+def test_broadcast_is_concurrent():
+    bot = FakeBot({})
+    users = list(range(200, 220))
+
+    async def timed():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await TM_Broadcast.send(bot, users, "text")
+        return loop.time() - start
+
+    # Sequential delivery would take at least 20 * 0.05 seconds
+    assert asyncio.run(timed()) < 0.5
+    assert sorted(bot.sent) == users
+
+
+def test_token_bucket_limits_rate():
+    async def timed():
+        bucket = TM_TokenBucket(rate=20, capacity=1)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for _ in range(5):
+            await bucket.acquire()
+        return loop.time() - start
+
+    assert asyncio.run(timed()) >= 0.15
@@ -0,0 +1,92 @@
+"""
+Test allowlisted command runner with coalesced output edits
+"""
+import sys
+import asyncio
+from time import monotonic
+from types import SimpleNamespace
+
+import pytest
+
+from telemonitor import helpers as h
+from telemonitor.extensions import commands
+from telemonitor.extensions.commands import TM_CommandRunner, parse_command
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+        self.edits = []
+        self.documents = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(text)
+        return SimpleNamespace(chat=SimpleNamespace(id=chat_id), message_id=len(self.sent))
+
+    async def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        self.edits.append(text)
+
+    async def send_document(self, chat_id, document, caption=None):
+        self.documents.append((document.filename, document.file.read(), caption))
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    cfg = dict(h.DEF_CFG, commands={"allowlist": [sys.executable], "timeout": 1, "max_concurrent": 1})
+    monkeypatch.setattr(h.TM_Config, 'model', classmethod(lambda cls: h.TM_ConfigSection(h.DEF_CFG, cfg)))
+    monkeypatch.setattr(commands, 'EDIT_INTERVAL', 0.1)
+    return FakeBot()
+
+
+def run(bot: FakeBot, *code: str):
+    async def main():
+        await asyncio.gather(*(TM_CommandRunner.start(bot, 1, [sys.executable, "-c", c]) for c in code))
+    asyncio.run(main())
+
+
+def test_allowlist():
+    allowlist = ["df -h", "systemctl status", "uptime"]
+    assert parse_command("uptime", allowlist) == ["uptime"]
+    assert parse_command("systemctl status 'my unit'", allowlist) == ["systemctl", "status", "my unit"]
+    for args in ("", "systemctl stop nginx", "df", "rm -rf /", "uptime '"):
+        with pytest.raises(ValueError):
+            parse_command(args, allowlist)
+
+
+def test_output_coalesced(bot):
+    # 50 lines over ~0.5 seconds are shown with few edits
+    run(bot, "import time\nfor i in range(50):\n    print(i, flush=True)\n    time.sleep(0.01)")
+
+    assert len(bot.edits) < 15
+    assert "49" in bot.edits[-1] and "Exit code 0" in bot.edits[-1]
+    assert not bot.documents
+
+
+def test_large_output_and_timeout(bot):
+    run(bot, "print('x' * 100000)")
+    assert bot.documents[0][1] == b"x" * 100000 + b"\n"
+    assert "…" in bot.edits[-1]
+
+    run(bot, "import time\nprint('started', flush=True)\ntime.sleep(10)")
+    assert "started" in bot.edits[-1] and "Killed after 1 seconds timeout" in bot.edits[-1]
+
+
+def test_timeout_kills_process_group(bot):
+    # Command closes its output and keeps running, and child keeps the pipe open after the command itself is killed
+    for code in ("import os, time\nos.close(1)\nos.close(2)\ntime.sleep(6)", "import subprocess\nsubprocess.run(['sleep', '5'])"):
+        started = monotonic()
+        run(bot, code)
+        assert monotonic() - started < 3
+        assert "Killed after 1 seconds timeout" in bot.edits[-1]
+    assert TM_CommandRunner.running() == 0
+
+
+def test_concurrency_limit(bot):
+    async def main():
+        task = TM_CommandRunner.start(bot, 1, [sys.executable, "-c", "pass"])
+        with pytest.raises(ValueError):
+            TM_CommandRunner.start(bot, 1, [sys.executable, "-c", "pass"])
+        await task
+        return TM_CommandRunner.running()
+
+    assert asyncio.run(main()) == 0
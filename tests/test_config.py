@@ -0,0 +1,148 @@
+"""
+Test config migrations, validation, typed model and coalesced writes
+"""
+import json
+import time
+
+import pytest
+
+from telemonitor import helpers as h
+
+
+@pytest.fixture
+def config_path(tmp_path, monkeypatch):
+    path = tmp_path / 'config.json'
+    monkeypatch.setattr(h, 'PATH_CFG', str(path))
+    monkeypatch.setattr(h.TM_Config, '_TM_Config__last_mod_time', None)
+    monkeypatch.setattr(h.TM_Config, '_TM_Config__write_timer', None)
+    return path
+
+
+def test_migration_from_first_version():
+    config = {"api_key": "123:abc", "whitelisted_users": [1], "state_notifications": False, "log_files_max": 5}
+    up_to_date, has_deprecated, migrated = h.TM_Config.config_check(config)
+
+    assert migrated and has_deprecated and not up_to_date
+    assert config["config_version"] == h.DEF_CFG["config_version"]
+    assert config["bot"]["token"] == "123:abc"
+    assert config["bot"]["state_notifications"] is False
+    assert "api_key" not in config and "log_files_max" not in config
+
+
+def test_check_counts_nested_changes():
+    config = json.loads(json.dumps(h.DEF_CFG))
+    config["bot"]["old_key"] = 1
+    del config["metrics"]["mount_points"]
+    config["file_transfer"]["chunk_size_kb"] = "64"
+    config["diagnostics"]["snapshot_interval"] = 0
+    config["commands"]["timeout"] = -5
+    config["diagnostics"]["rss_limit_mb"] = 0
+
+    up_to_date, has_deprecated, migrated = h.TM_Config.config_check(config)
+
+    assert (up_to_date, has_deprecated, migrated) == (False, True, False)
+    assert config["metrics"]["mount_points"] == ["/"]
+    assert config["file_transfer"]["chunk_size_kb"] == 64
+    assert config["diagnostics"]["snapshot_interval"] == h.DEF_CFG["diagnostics"]["snapshot_interval"]
+    assert config["commands"]["timeout"] == h.DEF_CFG["commands"]["timeout"]
+    assert config["diagnostics"]["rss_limit_mb"] == 0
+    # New values are copies, not shared with defaults
+    assert config["metrics"]["mount_points"] is not h.DEF_CFG["metrics"]["mount_points"]
+
+
+def test_model_access(config_path):
+    config = json.loads(json.dumps(h.DEF_CFG))
+    config["bot"]["whitelisted_users"] = [1, 2]
+    h.TM_Config.write(config)
+
+    model = h.TM_Config.model()
+    assert model.bot.whitelisted_users == [1, 2]
+    assert model.file_transfer.chunk_size_kb == h.DEF_CFG["file_transfer"]["chunk_size_kb"]
+    with pytest.raises(AttributeError):
+        model.bot.token = "other"
+
+
+def test_set_coalesces_writes(config_path, monkeypatch):
+    monkeypatch.setattr(h, 'CONFIG_WRITE_DELAY', 0.2)
+    h.TM_Config.write(h.DEF_CFG)
+    writes = []
+    write = h.TM_Config.write
+    monkeypatch.setattr(h.TM_Config, 'write', classmethod(lambda cls, cfg: writes.append(1) or write(cfg)))
+
+    h.TM_Config.set("bot.whitelisted_users", [1])
+    h.TM_Config.set("bot.whitelisted_users", [1, 2])
+    h.TM_Config.set("metrics.sample_interval", 2.5)
+    assert h.TM_Config.model().bot.whitelisted_users == [1, 2]
+
+    time.sleep(0.5)
+    assert len(writes) == 1
+    saved = json.loads(config_path.read_text())
+    assert saved["bot"]["whitelisted_users"] == [1, 2]
+    assert saved["metrics"]["sample_interval"] == 2.5
+
+    with pytest.raises(KeyError):
+        h.TM_Config.set("bot.unknown", 1)
+    with pytest.raises(TypeError):
+        h.TM_Config.set("bot.state_notifications", "yes")
+    with pytest.raises(ValueError):
+        h.TM_Config.set("commands.timeout", 0)
+
+
+def test_write_is_atomic(config_path):
+    h.TM_Config.write(h.DEF_CFG)
+    with pytest.raises(TypeError):
+        h.TM_Config.write({"bot": object()})
+
+    assert json.loads(config_path.read_text()) == h.DEF_CFG
+    assert [p.name for p in config_path.parent.iterdir()] == ['config.json']
+
+
+def test_failed_write_keeps_config(config_path, monkeypatch):
+    h.TM_Config.write(h.DEF_CFG)
+    original = config_path.read_text()
+
+    def fsync(fd):
+        raise OSError("disk failure")
+
+    monkeypatch.setattr(h.os, 'fsync', fsync)
+    config = json.loads(json.dumps(h.DEF_CFG))
+    config["bot"]["whitelisted_users"] = [5]
+    with pytest.raises(OSError):
+        h.TM_Config.write(config)
+
+    assert config_path.read_text() == original
+    assert [p.name for p in config_path.parent.iterdir()] == ['config.json']
+
+
+def test_modification_check_is_throttled(config_path, monkeypatch):
+    monkeypatch.setattr(h, 'CONFIG_CHECK_INTERVAL', 0.2)
+    h.TM_Config.write(h.DEF_CFG)
+    model = h.TM_Config.model()
+
+    stats = []
+    getmtime = h.os.path.getmtime
+    monkeypatch.setattr(h.os.path, 'getmtime', lambda p: stats.append(p) or getmtime(p))
+    for _ in range(1000):
+        assert h.TM_Config.model() is model
+    assert len(stats) <= 1
+
+    config = json.loads(json.dumps(h.DEF_CFG))
+    config["bot"]["whitelisted_users"] = [3]
+    config_path.write_text(json.dumps(config))
+    h.os.utime(config_path, (time.time() + 10, time.time() + 10))
+    time.sleep(0.25)
+    assert h.TM_Config.model().bot.whitelisted_users == [3]
+
+
+def test_forced_modification_check(config_path, monkeypatch):
+    monkeypatch.setattr(h, 'CONFIG_CHECK_INTERVAL', 60)
+    h.TM_Config.write(h.DEF_CFG)
+    h.TM_Config.model()
+
+    config = json.loads(json.dumps(h.DEF_CFG))
+    config["bot"]["whitelisted_users"] = [4]
+    config_path.write_text(json.dumps(config))
+    h.os.utime(config_path, (time.time() + 10, time.time() + 10))
+
+    assert h.TM_Config.model().bot.whitelisted_users == []
+    assert h.TM_Config.model(force_check=True).bot.whitelisted_users == [4]
@@ -0,0 +1,78 @@
+"""
+Test live dashboard refresh with suppressed edits and expiry
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.utils.exceptions import MessageToEditNotFound
+
+from telemonitor import helpers as h
+from telemonitor.extensions import dashboard
+from telemonitor.extensions.dashboard import TM_Dashboard
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+        self.edits = []
+        self.deleted = set()
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+        return SimpleNamespace(message_id=len(self.sent))
+
+    async def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        if chat_id in self.deleted:
+            raise MessageToEditNotFound("Message to edit not found")
+        self.edits.append((chat_id, text))
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    bot = FakeBot()
+    texts = iter(["cpu 1", "cpu 1", "cpu 2", "cpu 2", "cpu 3", "cpu 3", "cpu 3"])
+
+    async def get(key, factory, ttl=None):
+        return await factory()
+
+    monkeypatch.setattr(dashboard, 'construct_sysinfo', lambda: next(texts))
+    monkeypatch.setattr(dashboard, 'DASHBOARD_EDIT_RATE', 1000)
+    monkeypatch.setattr(h.TM_ResponseCache, 'get', get)
+    monkeypatch.setattr(TM_Dashboard, 'interval', classmethod(lambda cls: 0.02))
+    monkeypatch.setattr(TM_Dashboard, '_TM_Dashboard__bot', bot)
+    monkeypatch.setattr(TM_Dashboard, '_TM_Dashboard__dashboards', {})
+    monkeypatch.setattr(TM_Dashboard, '_TM_Dashboard__edits', 0)
+    monkeypatch.setattr(TM_Dashboard, '_TM_Dashboard__suppressed', 0)
+    yield bot
+    TM_Dashboard.stop()
+
+
+def test_unchanged_text_not_edited(bot):
+    async def main():
+        await TM_Dashboard.open(1)
+        await asyncio.sleep(0.15)
+        TM_Dashboard.stop()
+
+    asyncio.run(main())
+
+    assert bot.sent == [(1, "cpu 1\n\n" + dashboard.FOOTER_LIVE)]
+    # Text is changed only twice, other refreshes are suppressed
+    assert [e[1].split("\n")[0] for e in bot.edits] == ["cpu 2", "cpu 3"]
+    edits, suppressed = TM_Dashboard.stats()
+    assert edits == 2 and suppressed >= 2
+
+
+def test_expired_and_deleted_dashboards_dropped(bot, monkeypatch):
+    async def main():
+        await TM_Dashboard.open(1)
+        monkeypatch.setattr(dashboard, 'DASHBOARD_TTL', 0)
+        await TM_Dashboard.open(2)
+        bot.deleted.add(1)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+
+    assert TM_Dashboard.count() == 0
+    # Expired dashboard is marked as stopped
+    assert bot.edits[-1] == (2, "cpu 1\n\n" + dashboard.FOOTER_STOPPED)
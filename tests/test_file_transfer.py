@@ -0,0 +1,223 @@
+"""
+Test File Transfer System download pipeline and shared dir store
+"""
+import os
+import time
+import asyncio
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+
+from telemonitor import helpers as h
+from telemonitor.extensions import file_transfer as ft
+
+
+class FakeFile:
+    def __init__(self, file_unique_id: str, content: bytes):
+        self.file_unique_id = file_unique_id
+        self.file_size = len(content)
+        self.content = content
+
+    async def get_file(self):
+        return SimpleNamespace(file_path=f"documents/{self.file_unique_id}", content=self.content)
+
+
+class FakeBot:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.downloads = 0
+        self.files = {}
+
+    async def download_file(self, file_path, destination, chunk_size, seek):
+        self.downloads += 1
+        if self.fail:
+            # Connection breaks after the first chunk
+            destination.write(b"partial")
+            raise ConnectionError("connection lost")
+        destination.write(self.files[file_path])
+
+
+def download(bot: FakeBot, file: FakeFile, name: str) -> str:
+    bot.files[f"documents/{file.file_unique_id}"] = file.content
+    return asyncio.run(ft.TM_FileTransfer.download(bot, file, name))
+
+
+def visible(path: str) -> list:
+    return sorted(f for f in os.listdir(path) if not f.startswith('.'))
+
+
+@pytest.fixture
+def shared_dir(tmp_path, monkeypatch):
+    path = str(tmp_path / "Shared")
+    monkeypatch.setattr(h, 'PATH_SHARED_DIR', path)
+    monkeypatch.setattr(ft, 'PATH_SHARED_DIR', path)
+    monkeypatch.setattr(h.TM_Config, 'model', classmethod(lambda cls: h.TM_ConfigSection(h.DEF_CFG)))
+    monkeypatch.setattr(ft.TM_FileTransfer, '_TM_FileTransfer__semaphore', None)
+    monkeypatch.setattr(ft.TM_SharedStore, '_TM_SharedStore__index', None)
+    return path
+
+
+def test_download_does_not_overwrite(shared_dir):
+    bot = FakeBot()
+    first = download(bot, FakeFile("id1", b"one"), "a.txt")
+    second = download(bot, FakeFile("id2", b"two"), "a.txt")
+
+    assert visible(shared_dir) == ["a (1).txt", "a.txt"]
+    with open(first, 'rb') as f:
+        assert f.read() == b"one"
+    with open(second, 'rb') as f:
+        assert f.read() == b"two"
+
+
+def test_known_file_is_not_downloaded(shared_dir):
+    bot = FakeBot()
+    download(bot, FakeFile("id1", b"one"), "a.txt")
+    path = download(bot, FakeFile("id1", b"one"), "a.txt")
+
+    assert bot.downloads == 1
+    assert visible(shared_dir) == ["a.txt"]
+    assert os.path.basename(path) == "a.txt"
+
+
+def test_identical_files_are_linked(shared_dir):
+    bot = FakeBot()
+    first = download(bot, FakeFile("id1", b"same"), "a.txt")
+    second = download(bot, FakeFile("id2", b"same"), "b.txt")
+
+    assert visible(shared_dir) == ["a.txt", "b.txt"]
+    assert os.path.samefile(first, second)
+    assert len(os.listdir(os.path.join(shared_dir, ft.DIR_STORE, ft.DIR_BLOBS))) == 1
+
+
+def test_failed_download_leaves_nothing(shared_dir):
+    with pytest.raises(ft.TM_FileTransferError):
+        download(FakeBot(fail=True), FakeFile("id1", b""), "a.txt")
+
+    assert visible(shared_dir) == []
+    assert os.listdir(os.path.join(shared_dir, ft.DIR_STORE, ft.DIR_BLOBS)) == []
+
+
+def test_free_space_check(shared_dir):
+    huge = FakeFile("id1", b"")
+    huge.file_size = 1 << 60
+
+    with pytest.raises(ft.TM_FileTransferError):
+        download(FakeBot(), huge, "a.txt")
+
+
+def test_dir_index_cache(tmp_path, monkeypatch):
+    from telemonitor.extensions.file_transfer import browser
+    from telemonitor.extensions.file_transfer.browser import TM_DirIndex
+
+    (tmp_path / "b.txt").write_bytes(b"12")
+    (tmp_path / "a").mkdir()
+    (tmp_path / ".store").mkdir()
+
+    first = TM_DirIndex.listdir(str(tmp_path))
+    assert first == [("a", True, 0), ("b.txt", False, 2)]
+    assert TM_DirIndex.listdir(str(tmp_path)) is first
+
+    (tmp_path / "c.txt").write_bytes(b"")
+    assert [e[0] for e in TM_DirIndex.listdir(str(tmp_path))] == ["a", "b.txt", "c.txt"]
+
+    # File growth doesn't change dir mtime, so sizes are refreshed after TTL
+    mtime = os.stat(tmp_path).st_mtime_ns
+    (tmp_path / "b.txt").write_bytes(b"1234")
+    os.utime(tmp_path, ns=(mtime, mtime))
+    assert TM_DirIndex.listdir(str(tmp_path))[1] == ("b.txt", False, 2)
+    later = time.monotonic() + browser.DIR_INDEX_TTL
+    monkeypatch.setattr(browser, 'monotonic', lambda: later)
+    assert TM_DirIndex.listdir(str(tmp_path))[1] == ("b.txt", False, 4)
+
+
+def test_path_tokens_not_reused():
+    from telemonitor.extensions.file_transfer.browser import TM_PathTokens
+
+    tokens = TM_PathTokens(size=4)
+    stale = tokens.token("a.txt")
+    recent = tokens.token("b.txt")
+    for i in range(3):
+        tokens.token(f"dir/{i}.txt")
+        # Pressed button keeps its path remembered
+        assert tokens.path(recent) == "b.txt"
+
+    # Evicted token isn't resolved to other path after numbering passed the limit
+    assert tokens.path(stale) is None
+    assert tokens.token("a.txt") != stale
+    assert tokens.path(10 ** 6) is None
+
+
+def test_modified_blob_is_not_reused(shared_dir):
+    bot = FakeBot()
+    path = download(bot, FakeFile("id1", b"one"), "a.txt")
+    assert not os.stat(path).st_mode & 0o222
+
+    # Visible file is hard link to blob, so editing it in place modifies the blob
+    os.chmod(path, 0o644)
+    with open(path, 'ab') as f:
+        f.write(b" edited")
+
+    again = download(bot, FakeFile("id1", b"one"), "a.txt")
+    assert bot.downloads == 2
+    with open(again, 'rb') as f:
+        assert f.read() == b"one"
+    with open(path, 'rb') as f:
+        assert f.read() == b"one edited"
+    assert not os.path.samefile(path, again)
+
+
+def test_file_id_cache_concurrent_set(shared_dir, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from telemonitor.extensions.file_transfer import browser
+    from telemonitor.extensions.file_transfer.browser import TM_FileIdCache
+
+    monkeypatch.setattr(browser, 'PATH_SHARED_DIR', shared_dir)
+    monkeypatch.setattr(TM_FileIdCache, '_TM_FileIdCache__cache', None)
+    st = os.stat_result((0o644, 0, 0, 1, 0, 0, 10, 0, 0, 0))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: TM_FileIdCache.set(f"{i}.txt", st, f"id{i}"), range(200)))
+
+    TM_FileIdCache.drop("0.txt")
+    monkeypatch.setattr(TM_FileIdCache, '_TM_FileIdCache__cache', None)
+    assert TM_FileIdCache.get("0.txt", st) is None
+    assert TM_FileIdCache.get("199.txt", st) == "id199"
+    assert not [f for f in os.listdir(os.path.join(shared_dir, ft.DIR_STORE)) if f.endswith('.tmp')]
+
+
+def test_writer_queue_is_bounded(monkeypatch):
+    monkeypatch.setattr(ft, 'WRITER_MAX_PENDING', 2)
+    written = []
+
+    class SlowFile:
+        def write(self, data):
+            time.sleep(0.005)
+            written.append(data)
+
+        def flush(self):
+            pass
+
+    async def main():
+        writer = ft.TM_HashingWriter(SlowFile())
+        backlog = []
+        for i in range(20):
+            writer.write(bytes([i]) * 10)
+            backlog.append(i + 1 - len(written))
+        await writer.drain()
+        return writer, backlog
+
+    writer, backlog = asyncio.run(main())
+    # Chunk being written and the queued ones
+    assert max(backlog) <= 3
+    assert b"".join(written) == b"".join(bytes([i]) * 10 for i in range(20))
+    assert writer.hash.hexdigest() == hashlib.sha256(b"".join(written)).hexdigest()
+
+
+def test_interrupted_downloads_removed(shared_dir):
+    store = os.path.join(shared_dir, ft.DIR_STORE)
+    os.makedirs(store)
+    with open(os.path.join(store, "tmpabc" + ft.PART_SUFFIX), 'wb') as f:
+        f.write(b"partial")
+
+    ft.TM_SharedStore.tmp_dir()
+    assert not [n for n in os.listdir(store) if n.endswith(ft.PART_SUFFIX)]
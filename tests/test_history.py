@@ -0,0 +1,46 @@
+"""
+Test metrics history ring buffers and rollups
+"""
+from telemonitor.extensions.metrics.history import TM_RingBuffer, TM_MetricHistory, downsample, sparkline
+
+
+def test_ring_buffer_overwrites_oldest():
+    buffer = TM_RingBuffer(3)
+    for t in range(5):
+        buffer.append(t, t, t, t)
+
+    assert len(buffer) == 3
+    assert buffer.oldest == 2
+    assert [p[0] for p in buffer.since(-1)] == [2, 3, 4]
+    assert [p[0] for p in buffer.since(3)] == [4]
+
+
+def test_rollup_min_avg_max():
+    history = TM_MetricHistory()
+    for t, value in ((0, 1), (20, 2), (40, 6), (60, 5)):
+        history.add(t, value)
+
+    tier, points = history.query(-1)
+    assert tier == "raw"
+    assert len(points) == 4
+
+    # First minute bucket is flushed on the sample from the next minute
+    assert history._TM_MetricHistory__tiers[1].since(-1) == [(0, 1, 3, 6)]
+
+
+def test_query_falls_back_to_coarser_tier():
+    history = TM_MetricHistory()
+    for t in range(0, 7200 * 2, 5):
+        history.add(t, 1)
+
+    # Raw tier covers only 720 samples (1 hour), so 3 hours window must use minute rollups
+    tier, points = history.query(7200 * 2 - 3 * 3600)
+    assert tier == "1m"
+    assert all(p[2] == 1 for p in points)
+
+
+def test_sparkline():
+    points = [(t, t, t, t) for t in range(100)]
+    assert len(downsample(points, 10)) == 10
+    assert sparkline([0, 1, 2, 3], 0, 3) == "▁▃▆█"
+    assert sparkline([1, 1], 1, 1) == "▁▁"
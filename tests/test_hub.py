@@ -0,0 +1,89 @@
+"""
+Test hub receiving pushes from several agents on localhost
+"""
+import asyncio
+
+import pytest
+from aiohttp import ClientSession, UnixConnector
+
+from telemonitor import helpers as h
+from telemonitor.extensions.hub import TM_Agent, TM_Hub, decode_payload, encode_payload, split_address
+
+
+STATIC = {"system": "Linux 6.0", "user_host": "root@test"}
+
+
+@pytest.fixture(autouse=True)
+def hub_state(monkeypatch):
+    monkeypatch.setattr(TM_Hub, '_TM_Hub__hosts', {})
+    monkeypatch.setattr(h.TM_Config, 'model', classmethod(lambda cls: h.TM_ConfigSection(h.DEF_CFG)))
+
+
+def payload(host: str, *values: float) -> dict:
+    return {"host": host, "static": STATIC, "snapshots": [{"time": i, "uptime": 100.0, "mem": v} for i, v in enumerate(values)]}
+
+
+def test_address_parsing():
+    assert split_address("unix:/run/telemonitor.sock") == ("unix", "/run/telemonitor.sock")
+    assert split_address("http://10.0.0.1:8765/") == ("tcp", "10.0.0.1", 8765)
+    assert split_address("0.0.0.0:8765") == ("tcp", "0.0.0.0", 8765)
+
+
+def test_payload_validation():
+    import gzip
+
+    decoded = decode_payload(gzip.decompress(encode_payload(payload("web-1", 1.0))))
+    assert decoded["snapshots"] == [{"time": 0, "uptime": 100.0, "mem": 1.0}]
+
+    with pytest.raises(ValueError):
+        decode_payload(b'{"host": "", "static": {}, "snapshots": []}')
+    with pytest.raises(ValueError):
+        decode_payload(b'{"host": "web-1", "static": {"system": "Linux"}, "snapshots": []}')
+    # Non-numeric values can't be rendered and are dropped
+    raw = b'{"host": "web-1", "static": {"system": "Linux", "user_host": "a@b"}, "snapshots": [{"mem": "1", "cpu": true, "load1": 0.5}]}'
+    assert decode_payload(raw)["snapshots"] == [{"load1": 0.5}]
+
+
+def test_several_agents(tmp_path):
+    socket_path = str(tmp_path / 'hub.sock')
+
+    async def main():
+        bound = await TM_Hub.start_server("127.0.0.1:0", "secret")
+        tcp_url = f"http://{bound}"
+        await TM_Hub.stop_server()
+        await TM_Hub.start_server(f"unix:{socket_path}", "secret")
+        unix_session = ClientSession(connector=UnixConnector(socket_path))
+
+        results = await asyncio.gather(*(
+            TM_Agent.send(unix_session, f"unix:{socket_path}", payload(f"web-{i}", 10.0 * i, 10.0 * i + 1), "secret")
+            for i in range(1, 4)
+        ))
+        rejected = await TM_Agent.send(unix_session, f"unix:{socket_path}", payload("intruder", 1.0), "wrong")
+
+        # Batch of collected snapshots is kept until hub accepts it
+        TM_Agent.collect({"time": 1, "uptime": 5.0, "mem": 50.0})
+        async with ClientSession() as tcp_session:
+            failed = await TM_Agent.push(tcp_session, tcp_url, "local", "secret")
+        await TM_Agent.send(unix_session, f"unix:{socket_path}", payload("web-1", 99.0), "secret")
+        pushed = await TM_Agent.push(unix_session, f"unix:{socket_path}", "local", "secret")
+
+        await unix_session.close()
+        await TM_Hub.stop_server()
+        return results, rejected, failed, pushed
+
+    results, rejected, failed, pushed = asyncio.run(main())
+
+    assert results == [True, True, True]
+    assert rejected is False and failed is False and pushed is True
+    hosts = TM_Hub.hosts()
+    assert [s.name for s in hosts] == ["local", "web-1", "web-2", "web-3"]
+
+    web_1 = hosts[1]
+    assert web_1.pushes == 2 and web_1.samples == 3
+    assert web_1.snapshot["mem"] == 99.0
+    assert hosts[2].snapshot["mem"] == 21.0
+    assert hosts[0].snapshot["mem"] == 50.0
+
+    assert TM_Hub.host(web_1.id) is web_1
+    text = TM_Hub.render_host(web_1)
+    assert "web\\-1" in text and "online" in text and "root@test" in text
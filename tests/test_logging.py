@@ -0,0 +1,45 @@
+"""
+Test log file rotation and retention
+"""
+import os
+import gzip
+import logging
+
+from telemonitor.helpers import TM_LogFileHandler
+
+
+def make_record(message: str) -> logging.LogRecord:
+    return logging.LogRecord("test", logging.INFO, __file__, 1, message, None, None)
+
+
+def test_rotation_compresses_old_file(tmp_path):
+    handler = TM_LogFileHandler(str(tmp_path), max_bytes=200, max_total_bytes=1 << 20, max_age=3600)
+    for n in range(10):
+        handler.handle(make_record(f"message {n} " + "x" * 40))
+    handler.close()
+
+    names = sorted(os.listdir(tmp_path))
+    compressed = [n for n in names if n.endswith(".log.gz")]
+    assert compressed
+    assert len([n for n in names if n.endswith(".log")]) == 1
+
+    with gzip.open(tmp_path / compressed[0], 'rt') as f:
+        assert "message 0" in f.read()
+
+
+def test_retention_by_age_and_size(tmp_path):
+    for n in range(5):
+        path = tmp_path / f"TMLog_2020-01-0{n + 1}_00-00-00.log.gz"
+        path.write_bytes(b"x" * 1000)
+        os.utime(path, (1000 * n, 1000 * n))
+    (tmp_path / "TMLog_2020-01-09_00-00-00.log").write_bytes(b"old run")
+
+    handler = TM_LogFileHandler(str(tmp_path), max_bytes=1 << 20, max_total_bytes=2500, max_age=10 ** 10)
+    handler.apply_retention()
+    handler.close()
+
+    names = sorted(os.listdir(tmp_path))
+    # Two of the oldest files are removed to fit the total size, previous run log is compressed
+    assert "TMLog_2020-01-01_00-00-00.log.gz" not in names
+    assert "TMLog_2020-01-09_00-00-00.log.gz" in names
+    assert sum(os.path.getsize(tmp_path / n) for n in names) <= 2500
@@ -0,0 +1,99 @@
+"""
+Test mmap-backed tail and search of log files
+"""
+import os
+import gzip
+from time import time, strftime, localtime
+
+import pytest
+
+from telemonitor.extensions import logs
+from telemonitor.extensions.logs import TM_LogReader, list_log_files, parse_args, split_messages
+
+
+def record(t: float, text: str) -> str:
+    return f"[{strftime('%Y-%m-%d %H:%M:%S', localtime(t))},000][INFO][test->func]: {text}\n"
+
+
+@pytest.fixture
+def log_dir(tmp_path):
+    now = time()
+    header = "Telemonitor (test) : [ date ]\n\n"
+
+    # Compressed file of previous run, one hour old
+    with gzip.open(tmp_path / "TMLog_2020-01-01_00-00-00.log.gz", "wt") as f:
+        f.write(header + "".join(record(now - 3600 + i, f"old {i}") for i in range(5)))
+    os.utime(tmp_path / "TMLog_2020-01-01_00-00-00.log.gz", (now - 3600, now - 3600))
+
+    # Current file, one record per second for the last 1000 seconds, with multiline traceback in the middle
+    lines = [record(now - 1000 + i, f"new {i}") for i in range(1000)]
+    lines[500] += "Traceback (most recent call last):\n  ValueError: new 500 failed\n"
+    (tmp_path / "TMLog_2020-01-02_00-00-00.log").write_text(header + "".join(lines))
+    (tmp_path / "TMLog_2020-01-02_00-00-00_1.log").write_text("")
+    (tmp_path / "other.txt").write_text("ignored")
+    return str(tmp_path)
+
+
+def test_list_files(log_dir):
+    names = [os.path.basename(p) for p in list_log_files(log_dir)]
+    assert names == ["TMLog_2020-01-01_00-00-00.log.gz", "TMLog_2020-01-02_00-00-00.log", "TMLog_2020-01-02_00-00-00_1.log"]
+
+
+def test_tail(log_dir):
+    lines = TM_LogReader.tail(3, log_dir)
+    assert [line.rsplit(" ", 1)[1] for line in lines] == ["997", "998", "999"]
+
+    # Blank lines are skipped, missing lines are taken from older compressed file
+    lines = TM_LogReader.tail(1006, log_dir)
+    assert len(lines) == 1006
+    assert lines[0].endswith("old 2") and lines[3].startswith("Telemonitor") and lines[-1].endswith("new 999")
+
+
+def test_removed_files_are_skipped(log_dir, monkeypatch):
+    # Files are removed by retention after they were listed
+    listed = list_log_files(log_dir)
+    monkeypatch.setattr(logs, "list_log_files", lambda dir_path=None: listed)
+    os.remove(listed[1])
+    with open(listed[0], "r+b") as f:
+        f.truncate(20)
+
+    assert TM_LogReader.tail(3, log_dir) == []
+    assert TM_LogReader.grep(parse_args("grep new")[1], dir_path=log_dir) == []
+
+
+def test_grep(log_dir, monkeypatch):
+    monkeypatch.setattr(logs, "INDEX_STEP", 4096)
+
+    assert [line.rsplit(" ", 1)[1] for line in TM_LogReader.grep(parse_args("grep 'old [0-2]'")[1], dir_path=log_dir)] == ["0", "1", "2"]
+    assert TM_LogReader.grep(parse_args("grep failed$")[1], dir_path=log_dir) == ["  ValueError: new 500 failed"]
+
+    mode, pattern, since = parse_args("grep new --since 100s")
+    lines = TM_LogReader.grep(pattern, since, dir_path=log_dir)
+    assert 99 <= len(lines) <= 101 and lines[-1].endswith("new 999")
+    # Repeated query reuses offset index
+    assert TM_LogReader.grep(pattern, since, dir_path=log_dir) == lines
+
+    assert len(TM_LogReader.grep(pattern, limit=10, dir_path=log_dir)) == 10
+
+    # Offsets of files removed by retention are forgotten
+    index = TM_LogReader._TM_LogReader__index
+    current = os.path.join(log_dir, "TMLog_2020-01-02_00-00-00.log")
+    assert current in index
+    os.remove(current)
+    TM_LogReader.grep(pattern, since, dir_path=log_dir)
+    assert current not in index
+
+
+def test_args():
+    assert parse_args("tail")[:2] == ("tail", logs.TAIL_DEFAULT_LINES)
+    assert parse_args("tail 50")[:2] == ("tail", 50)
+    for args in ("", "head", "tail x", "tail 0", "grep", "grep [", "grep a --since"):
+        with pytest.raises(ValueError):
+            parse_args(args)
+
+
+def test_split_messages():
+    chunks = split_messages(["x" * 100] * 100, size=1000)
+    # 9 lines with newlines fit into each chunk
+    assert len(chunks) == 12
+    assert all(len(c) <= 1000 for c in chunks)
@@ -0,0 +1,123 @@
+"""
+Test /proc parsers of metrics sampler
+"""
+from telemonitor.extensions.metrics import parse_stat, parse_meminfo, parse_loadavg, parse_net_dev, parse_diskstats, format_bytes, format_uptime
+
+
+def test_parse_stat():
+    text = "cpu  100 10 50 800 40 0 0 0 0 0\ncpu0 100 10 50 800 40 0 0 0 0 0\n"
+    assert parse_stat(text) == (840, 1000)
+
+
+def test_parse_meminfo():
+    text = "MemTotal:        1000 kB\nMemAvailable:     250 kB\nHugePages_Total:       0\n"
+    values = parse_meminfo(text)
+    assert values["MemTotal"] == 1024000
+    assert values["MemAvailable"] == 256000
+
+
+def test_parse_loadavg():
+    assert parse_loadavg("0.06 0.08 0.02 2/72 3780\n") == (0.06, 0.08, 0.02)
+
+
+def test_parse_net_dev():
+    text = (
+        "Inter-|   Receive                                                |  Transmit\n"
+        " face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed\n"
+        "    lo: 4112793     666    0    0    0     0          0         0  4112793     666    0    0    0     0       0          0\n"
+        "  eth0:    1000      10    0    0    0     0          0         0      500       5    0    0    0     0       0          0\n"
+    )
+    assert parse_net_dev(text) == (1000, 500)
+
+
+def test_parse_diskstats():
+    text = (
+        "   7       0 loop0 1 0 100 0 0 0 100 0 0 0 0 0 0 0 0 0 0\n"
+        " 253       0 vda 10 0 20 0 5 0 40 0 0 0 0 0 0 0 0 0 0\n"
+        " 253       1 vda1 10 0 20 0 5 0 40 0 0 0 0 0 0 0 0 0 0\n"
+    )
+    assert parse_diskstats(text, frozenset(["vda"])) == (20 * 512, 40 * 512)
+
+
+def test_format():
+    assert format_bytes(512) == "512 B"
+    assert format_bytes(1536) == "1.5 KiB"
+    assert format_uptime(90061) == "01:01:01:01"
+
+
+def test_parse_pid_stat():
+    from telemonitor.extensions.metrics.processes import parse_pid_stat
+
+    text = b"42 (my (weird) proc) S 1 42 42 0 -1 4194560 100 0 0 0 150 50 0 0 20 0 1 0 9000 1000000 300 18446744073709551615\n"
+    assert parse_pid_stat(text) == ("my (weird) proc", 9000, 200, 300)
+
+
+def test_process_scanner(tmp_path, monkeypatch):
+    from telemonitor.extensions import metrics
+    from telemonitor.extensions.metrics import processes
+    from telemonitor.extensions.metrics.processes import TM_Processes
+
+    def write_stat(pid: int, name: str, started: int, jiffies: int, rss: int):
+        (tmp_path / str(pid)).mkdir(exist_ok=True)
+        fields = ["S"] + ["0"] * 10 + [str(jiffies), "0"] + ["0"] * 6 + [str(started), "0", str(rss)]
+        (tmp_path / str(pid) / 'stat').write_text(f"{pid} ({name}) {' '.join(fields)}\n")
+
+    monkeypatch.setattr(metrics, 'PATH_PROC', str(tmp_path))
+    monkeypatch.setattr(processes, 'SCAN_MIN_INTERVAL', 0)
+    monkeypatch.setattr(TM_Processes, '_TM_Processes__table', {})
+    monkeypatch.setattr(TM_Processes, '_TM_Processes__scanned', None)
+    monkeypatch.setattr(TM_Processes, '_TM_Processes__clock_ticks', 100)
+    (tmp_path / 'stat').write_text("cpu 0 0 0 0\n")
+
+    write_stat(1, "init", 10, 1000, 100)
+    write_stat(2, "busy", 20, 0, 5000)
+    write_stat(3, "dying", 30, 0, 10)
+    assert all(p[2] is None for p in TM_Processes.scan())
+
+    write_stat(2, "busy", 20, 50, 5000)
+    # PID 3 exited and was reused by new process, that has already used 5 jiffies
+    write_stat(3, "reused", 31, 5, 10)
+    monkeypatch.setattr(TM_Processes, '_TM_Processes__scanned', processes.monotonic() - 1)
+    by_cpu, by_rss, total = TM_Processes.top(2)
+
+    assert total == 3
+    assert [(p[1], round(p[2])) for p in by_cpu] == [("busy", 50), ("reused", 5)]
+    assert by_rss[0][1] == "busy"
+
+    (tmp_path / '2' / 'stat').unlink()
+    (tmp_path / '2').rmdir()
+    TM_Processes.scan()
+    assert 2 not in TM_Processes._TM_Processes__table
+
+
+def test_out_of_band_sample(tmp_path, monkeypatch):
+    from telemonitor.extensions import metrics
+    from telemonitor.extensions.metrics import TM_Metrics
+
+    def write_proc(busy: int, idle: int):
+        (tmp_path / 'stat').write_text(f"cpu {busy} 0 0 {idle}\n")
+        (tmp_path / 'net').mkdir(exist_ok=True)
+        (tmp_path / 'net' / 'dev').write_text("Inter-|\n face |\n")
+        (tmp_path / 'diskstats').write_text("")
+        (tmp_path / 'uptime').write_text("100.0 50.0\n")
+        (tmp_path / 'loadavg').write_text("0.1 0.2 0.3 1/100 42\n")
+        (tmp_path / 'meminfo').write_text("MemTotal: 100 kB\nMemAvailable: 50 kB\n")
+
+    monkeypatch.setattr(metrics, 'PATH_PROC', str(tmp_path))
+    monkeypatch.setattr(TM_Metrics, '_TM_Metrics__previous', None)
+    monkeypatch.setattr(TM_Metrics, '_TM_Metrics__snapshot', {})
+
+    write_proc(0, 0)
+    TM_Metrics.sample()
+    previous = TM_Metrics._TM_Metrics__previous
+
+    # Sysinfo request between sampler runs doesn't shorten the sampler's rate window
+    write_proc(10, 10)
+    baseline = {}
+    assert "cpu" not in TM_Metrics.sample(baseline=baseline)
+    assert TM_Metrics._TM_Metrics__previous is previous
+    assert baseline["cpu"] == (10, 20)
+
+    write_proc(20, 60)
+    assert TM_Metrics.sample()["cpu"] == 25.0
+    assert TM_Metrics.snapshot()["cpu"] == 25.0
@@ -0,0 +1,52 @@
+"""
+Test blocking calls offloading and event loop lag monitor
+"""
+import sys
+import json
+import time
+import asyncio
+import threading
+
+import pytest
+
+from telemonitor import helpers as h
+from telemonitor.helpers import TM_Offload, TM_LoopMonitor
+
+
+def test_run_in_thread_pool():
+    async def main():
+        return await TM_Offload.run(threading.get_ident)
+
+    assert asyncio.run(main()) != threading.get_ident()
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="requires posix shell commands")
+def test_run_command_timeout():
+    async def main():
+        code, stdout, _ = await TM_Offload.run_command('echo', 'hello')
+        assert code == 0 and stdout.strip() == b'hello'
+
+        with pytest.raises(asyncio.TimeoutError):
+            await TM_Offload.run_command('sleep', '5', timeout=0.1)
+
+    asyncio.run(main())
+
+
+def test_loop_monitor_detects_stall(tmp_path, monkeypatch):
+    monkeypatch.setattr(TM_LoopMonitor, 'stalls', 0)
+    monkeypatch.setattr(h, 'PATH_CFG', str(tmp_path / 'config.json'))
+    monkeypatch.setattr(h.TM_Config, '_TM_Config__last_mod_time', None)
+    cfg = json.loads(json.dumps(h.DEF_CFG))
+    cfg["event_loop"] = {"monitor_interval": 0.1, "lag_threshold_ms": 50}
+    h.TM_Config.write(cfg)
+
+    async def main():
+        TM_LoopMonitor.start()
+        await asyncio.sleep(0.15)
+        time.sleep(0.3)
+        await asyncio.sleep(0.3)
+        TM_LoopMonitor.stop()
+
+    asyncio.run(main())
+    assert TM_LoopMonitor.stalls >= 1
+    assert TM_LoopMonitor.max_lag >= 0.2
@@ -0,0 +1,142 @@
+"""
+Test single-flight response cache and per-user update queues
+"""
+import asyncio
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+
+from telemonitor import helpers as h
+from telemonitor.middlewares import TM_UserQueueMiddleware
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> types.Update:
+    return types.Update(**{
+        "update_id": update_id,
+        "callback_query": {"id": str(update_id), "chat_instance": "1", "data": data, "from": {"id": user_id, "is_bot": False, "first_name": "test"}}
+    })
+
+
+def test_response_cache_single_flight():
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def main():
+        h.TM_ResponseCache.clear()
+        results = await asyncio.gather(*(h.TM_ResponseCache.get("test", factory, ttl=60) for _ in range(10)))
+        cached = await h.TM_ResponseCache.get("test", factory, ttl=60)
+        fresh = await h.TM_ResponseCache.get("other", factory, ttl=0)
+        return results, cached, fresh
+
+    results, cached, fresh = asyncio.run(main())
+    assert results == [1] * 10 and cached == 1
+    assert fresh == 2 and len(calls) == 2
+
+
+def test_response_cache_error_shared():
+    async def factory():
+        await asyncio.sleep(0.01)
+        raise ValueError()
+
+    async def main():
+        h.TM_ResponseCache.clear()
+        return await asyncio.gather(*(h.TM_ResponseCache.get("error", factory) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(r, ValueError) for r in asyncio.run(main()))
+
+
+def test_response_cache_owner_cancelled():
+    async def factory():
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def main():
+        h.TM_ResponseCache.clear()
+        owner = asyncio.ensure_future(h.TM_ResponseCache.get("cancel", factory))
+        await asyncio.sleep(0)
+        waiters = [asyncio.ensure_future(h.TM_ResponseCache.get("cancel", factory)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        return owner, await asyncio.gather(*waiters)
+
+    owner, results = asyncio.run(main())
+    assert owner.cancelled()
+    assert results == ["value"] * 3
+
+
+def test_user_queue_order_and_drops(monkeypatch):
+    middleware = TM_UserQueueMiddleware(max_size=3)
+    answered = []
+
+    async def answer(self, callback_query):
+        answered.append(callback_query.id)
+
+    monkeypatch.setattr(TM_UserQueueMiddleware, '_TM_UserQueueMiddleware__answer', answer)
+    events = []
+
+    async def process(update: types.Update, delay: float):
+        data = {}
+        try:
+            await middleware.on_pre_process_update(update, data)
+        except CancelHandler:
+            events.append(("dropped", update.update_id))
+            return
+        events.append(("start", update.update_id))
+        await asyncio.sleep(delay)
+        events.append(("end", update.update_id))
+        await middleware.on_post_process_update(update, [], data)
+
+    async def main():
+        await asyncio.gather(
+            process(callback_update(1, 1, "a"), 0.05),
+            process(callback_update(2, 1, "b"), 0),
+            # Duplicate of waiting update
+            process(callback_update(3, 1, "b"), 0),
+            process(callback_update(4, 1, "c"), 0),
+            # Queue is full
+            process(callback_update(5, 1, "d"), 0),
+            # Other user isn't blocked
+            process(callback_update(6, 2, "a"), 0)
+        )
+
+    asyncio.run(main())
+
+    assert ("dropped", 3) in events and ("dropped", 5) in events
+    assert sorted(answered) == ["3", "5"]
+    assert events.index(("start", 6)) < events.index(("end", 1))
+    user_1 = [e for e in events if e[0] != "dropped" and e[1] in (1, 2, 4)]
+    assert user_1 == [("start", 1), ("end", 1), ("start", 2), ("end", 2), ("start", 4), ("end", 4)]
+    assert middleware.dropped == 2
+    assert not middleware._TM_UserQueueMiddleware__queues
+
+
+def test_user_queue_released_by_long_handler():
+    middleware = TM_UserQueueMiddleware(max_size=2)
+    events = []
+
+    async def process(update: types.Update, delay: float, release: bool = False):
+        data = {}
+        await middleware.on_pre_process_update(update, data)
+        events.append(("start", update.update_id))
+        if release:
+            TM_UserQueueMiddleware.release()
+        await asyncio.sleep(delay)
+        events.append(("end", update.update_id))
+        await middleware.on_post_process_update(update, [], data)
+
+    async def main():
+        await asyncio.gather(
+            # Upload-like handler leaves the queue right away
+            process(callback_update(1, 1, "upload"), 0.05, release=True),
+            process(callback_update(2, 1, "a"), 0),
+            process(callback_update(3, 1, "b"), 0)
+        )
+
+    asyncio.run(main())
+
+    assert events.index(("end", 3)) < events.index(("end", 1))
+    assert not middleware._TM_UserQueueMiddleware__queues
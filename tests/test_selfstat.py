@@ -0,0 +1,63 @@
+"""
+Test bot self-diagnostics, allocation growth report and RSS ceiling
+"""
+import asyncio
+
+import pytest
+
+from telemonitor import helpers as h
+from telemonitor.extensions import selfstat
+from telemonitor.extensions.selfstat import TM_SelfStat, get_rss
+
+
+@pytest.fixture
+def diagnostics(monkeypatch):
+    cfg = {"tracemalloc": True, "snapshot_interval": 3600, "top_allocations": 5, "rss_limit_mb": 0}
+    monkeypatch.setattr(h.TM_Config, 'model', classmethod(lambda cls: h.TM_ConfigSection(h.DEF_CFG, dict(h.DEF_CFG, diagnostics=cfg))))
+    monkeypatch.setattr(TM_SelfStat, '_TM_SelfStat__growth', [])
+    monkeypatch.setattr(TM_SelfStat, '_TM_SelfStat__restart_reason', None)
+    yield cfg
+    TM_SelfStat.stop()
+
+
+def test_usage_report(diagnostics):
+    diagnostics["tracemalloc"] = False
+
+    async def main():
+        assert not TM_SelfStat.start()
+        return await TM_SelfStat.collect(), await TM_SelfStat.render()
+
+    stat, text = asyncio.run(main())
+    assert stat["rss"] == pytest.approx(get_rss(), rel=0.5)
+    assert stat["tasks"] >= 1 and stat["python_threads"] >= 1 and len(stat["gc_stats"]) == 3
+    assert "*RSS*" in text and "Allocation tracing is disabled" in text
+
+
+def test_allocation_growth(diagnostics):
+    leak = []
+
+    async def main():
+        assert TM_SelfStat.start()
+        await TM_SelfStat.take_snapshot()
+        for _ in range(1000):
+            leak.append(bytearray(1000))
+        return await TM_SelfStat.render("snapshot")
+
+    text = asyncio.run(main())
+    assert "Top growing allocations" in text
+    # Pre-formatted block starts with the largest growth
+    assert "test\\_selfstat\\.py:" in text.split("```")[1].split("\n")[1]
+
+
+def test_rss_ceiling(diagnostics, monkeypatch):
+    diagnostics.update(tracemalloc=False, rss_limit_mb=1)
+    monkeypatch.setattr(selfstat, 'RSS_CHECK_INTERVAL', 0.01)
+    stopped = []
+
+    async def main():
+        TM_SelfStat.start(stop_loop=lambda: stopped.append(True))
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert stopped == [True]
+    assert TM_SelfStat.restart_reason().startswith("RSS ")
@@ -0,0 +1,33 @@
+"""
+Test lightweight startup path of CLI commands
+"""
+import sys
+import subprocess
+
+from telemonitor.helpers import TM_StartupProfiler, cli_arguments_parser
+
+
+def test_cli_imports_no_aiogram():
+    code = "import sys, telemonitor.main, telemonitor.extensions.systemd_service; print(any(m.startswith('aiogram') for m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False"
+
+
+def test_arguments_parsed_explicitly():
+    args = cli_arguments_parser(['--whitelist', '1', '2', '--profile-startup'])
+    assert args.whitelist_overwrite == [1, 2]
+    assert args.profile_startup
+
+
+def test_startup_profiler(tmp_path, monkeypatch):
+    (tmp_path / "tm_profiled_module.py").write_text("import json\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    TM_StartupProfiler.start()
+    import tm_profiled_module  # noqa: F401
+    TM_StartupProfiler.mark("test phase")
+    text = TM_StartupProfiler.report()
+
+    assert "test phase" in text
+    assert "tm_profiled_module" in text
+    assert TM_StartupProfiler.report() is None
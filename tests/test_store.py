@@ -0,0 +1,91 @@
+"""
+Test batched writes, lookups and retention of SQLite state store
+"""
+import sqlite3
+from time import time
+
+import pytest
+
+from telemonitor import helpers as h
+from telemonitor.extensions import store
+from telemonitor.extensions.store import TM_Store, metrics_table, parse_list_args
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(h.TM_Config, 'model', classmethod(lambda cls: h.TM_ConfigSection(h.DEF_CFG, h.DEF_CFG)))
+    monkeypatch.setattr(store, 'BATCH_DELAY', 0.05)
+    monkeypatch.setattr(TM_Store, '_TM_Store__written', 0)
+    monkeypatch.setattr(TM_Store, '_TM_Store__dropped', 0)
+    path = str(tmp_path / "state.db")
+    assert TM_Store.start(path)
+    yield path
+    TM_Store.stop()
+
+
+def test_audit_and_transfers(db):
+    TM_Store.audit(1, "reboot")
+    TM_Store.audit(2, "shutdown", "now")
+    for i in range(30):
+        TM_Store.transfer(1, "in", f"photos/{i}.jpg", 1000 + i)
+    TM_Store.transfer(2, "out", "notes.txt", None)
+    TM_Store.flush()
+
+    assert [r[1:] for r in TM_Store.recent_audit()] == [(2, "shutdown", "now"), (1, "reboot", None)]
+    assert [r[2] for r in TM_Store.recent_audit(user_id=1)] == ["reboot"]
+    assert len(TM_Store.recent_transfers()) == store.LIST_DEFAULT
+    assert [r[3] for r in TM_Store.recent_transfers(3, "photos/")] == ["photos/29.jpg", "photos/28.jpg", "photos/27.jpg"]
+    assert TM_Store.stats() == (33, 0)
+
+    assert "notes\\.txt" in TM_Store.render_transfers("5")
+    assert "reboot" in TM_Store.render_audit("10 1") and "shutdown" not in TM_Store.render_audit("10 1")
+    assert TM_Store.render_audit("x").startswith("*Usage*")
+
+
+def test_metrics_partitions_and_retention(db):
+    now = time()
+    old = now - 100 * 86400
+    TM_Store.record_metrics({"time": now - 1, "cpu": 20.0, "mem": 30.0, "disks": []})
+    TM_Store.record_metrics({"time": now, "cpu": 40.0})
+    TM_Store.audit(1, "old")
+    TM_Store.flush()
+
+    assert TM_Store.metric_history("cpu", now - 60) == [(now - 1, 20.0), (now, 40.0)]
+    assert TM_Store.metric_history("mem", now - 60) == [(now - 1, 30.0)]
+    assert TM_Store.metric_history("cpu", now - 60, now - 30) == []
+    TM_Store.stop()
+
+    # Outdated rows are deleted and old partition is dropped as a whole on the next start
+    with sqlite3.connect(db) as connection:
+        connection.execute("UPDATE audit SET time = ?", (old,))
+        connection.execute(f"CREATE TABLE {metrics_table(old)} (time REAL NOT NULL, name TEXT NOT NULL, value REAL)")
+    TM_Store.start(db)
+    TM_Store.audit(1, "new")
+    TM_Store.flush()
+
+    assert [r[2] for r in TM_Store.recent_audit()] == ["new"]
+    with sqlite3.connect(db) as connection:
+        tables = [r[0] for r in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    assert metrics_table(old) not in tables and metrics_table(now) in tables
+
+
+def test_rolled_back_partition_is_created_again(db):
+    now = time()
+    # Broken row fails the whole batch, including creation of the new partition
+    TM_Store.record_metrics({"time": now, "cpu": 10.0})
+    TM_Store._TM_Store__put(("INSERT INTO missing VALUES (?)", (1,)))
+    TM_Store.flush()
+    assert TM_Store.metric_history("cpu", now - 60) == []
+
+    TM_Store.record_metrics({"time": now, "cpu": 20.0})
+    TM_Store.flush()
+    assert TM_Store.metric_history("cpu", now - 60) == [(now, 20.0)]
+
+
+def test_list_args():
+    assert parse_list_args("") == (store.LIST_DEFAULT, None)
+    assert parse_list_args("5 photos/a b") == (5, "photos/a b")
+    assert parse_list_args("100000")[0] == store.LIST_MAX
+    for args in ("x", "0", "-1"):
+        with pytest.raises(ValueError):
+            parse_list_args(args)
@@ -0,0 +1,114 @@
+"""
+Test systemd readiness notifications and watchdog pings driven by bot progress
+"""
+import socket
+import asyncio
+
+import pytest
+
+from telemonitor.extensions.systemd_service import notify
+from telemonitor.extensions.systemd_service.notify import TM_SystemdNotify
+from telemonitor.extensions.telemetry import TM_Telemetry
+
+
+@pytest.fixture
+def systemd(tmp_path, monkeypatch):
+    path = str(tmp_path / "notify.sock")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    server.bind(path)
+    server.setblocking(False)
+    monkeypatch.setenv("NOTIFY_SOCKET", path)
+    monkeypatch.setenv("WATCHDOG_USEC", "300000")
+    monkeypatch.setenv("WATCHDOG_PID", "1")
+    yield server
+    TM_SystemdNotify.stopping()
+    server.close()
+    monkeypatch.setattr(TM_SystemdNotify, '_TM_SystemdNotify__socket', None)
+
+
+def received(server: socket.socket) -> list:
+    messages = []
+    while True:
+        try:
+            messages.append(server.recv(4096).decode())
+        except BlockingIOError:
+            return messages
+
+
+def test_not_under_systemd(monkeypatch):
+    monkeypatch.delenv("NOTIFY_SOCKET", raising=False)
+    assert not TM_SystemdNotify.setup()
+
+
+class FakeClock:
+    """ Clock of watchdog pings, advanced by test one ping at a time """
+    def __init__(self):
+        self.now = 1000.0
+        self.waiting = asyncio.Event()
+        self.tick = None
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float):
+        self.tick = asyncio.get_event_loop().create_future()
+        self.waiting.set()
+        await self.tick
+        self.now += delay
+
+    async def step(self):
+        """ Let pings loop run until its next sleep """
+        await self.waiting.wait()
+        self.waiting.clear()
+        self.tick.set_result(None)
+        await self.waiting.wait()
+
+
+def test_ready_and_watchdog(systemd, monkeypatch):
+    import os
+
+    assert TM_SystemdNotify.setup()
+    # Commands run by the bot don't inherit systemd variables
+    assert "NOTIFY_SOCKET" not in os.environ and "WATCHDOG_USEC" not in os.environ
+
+    polls = {"last": None}
+    monkeypatch.setattr(TM_Telemetry, 'last_api_call', classmethod(lambda cls, method: polls["last"]))
+    monkeypatch.setattr(notify, 'POLLING_STALL_TIMEOUT', 0.25)
+    monkeypatch.setattr(notify.TM_LoopMonitor, 'last_lag', 0)
+
+    async def main():
+        clock = FakeClock()
+        monkeypatch.setattr(notify, 'monotonic', clock.monotonic)
+        monkeypatch.setattr(notify.asyncio, 'sleep', clock.sleep)
+
+        TM_SystemdNotify.ready()
+        # Pings every 0.1 seconds, polling makes no progress for longer than stall timeout after the second one
+        for _ in range(2):
+            await clock.step()
+        healthy = received(systemd)
+        for _ in range(2):
+            await clock.step()
+        stalled = received(systemd)
+        polls["last"] = clock.now
+        await clock.step()
+        resumed = received(systemd)
+
+        TM_SystemdNotify.stopping()
+        return healthy, stalled, resumed, received(systemd)
+
+    healthy, stalled, resumed, stopped = asyncio.run(main())
+
+    assert healthy[0].startswith("READY=1\nSTATUS=Updates: ")
+    assert [m.split("\n")[0] for m in healthy[1:]] == ["WATCHDOG=1"] * 2
+    assert "updates/min" in healthy[-1] and "loop lag" in healthy[-1]
+    assert len(stalled) == 2 and all(m.startswith("STATUS=Stalled") for m in stalled)
+    assert len(resumed) == 1 and resumed[0].startswith("WATCHDOG=1")
+    assert stopped == ["STOPPING=1\nSTATUS=Shutting down"]
+
+
+def test_loop_lag_blocks_pings(monkeypatch):
+    monkeypatch.setattr(TM_SystemdNotify, '_TM_SystemdNotify__watchdog', 3)
+    monkeypatch.setattr(notify.TM_LoopMonitor, 'last_lag', 1.5)
+    assert not TM_SystemdNotify.is_healthy(False, notify.monotonic())
+    monkeypatch.setattr(notify.TM_LoopMonitor, 'last_lag', 0.1)
+    assert TM_SystemdNotify.is_healthy(False, notify.monotonic())
@@ -0,0 +1,87 @@
+"""
+Test handler latency histograms, Bot API call timing and Prometheus output
+"""
+import asyncio
+
+import pytest
+from aiogram import Bot, Dispatcher, types
+from aiogram.utils.exceptions import RetryAfter
+
+from telemonitor.extensions.telemetry import TM_Histogram, TM_Telemetry, TM_TelemetryMiddleware
+
+
+TOKEN = "123456:" + "a" * 35
+
+
+def message_update(text: str) -> types.Update:
+    return types.Update(**{
+        "update_id": 1,
+        "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "from": {"id": 1, "is_bot": False, "first_name": "test"}, "text": text}
+    })
+
+
+def test_histogram_buckets():
+    histogram = TM_Histogram(buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(1) == float('inf')
+
+
+def test_middleware_times_handlers():
+    async def main():
+        bot = Bot(TOKEN)
+        dp = Dispatcher(bot)
+        dp.middleware.setup(TM_TelemetryMiddleware())
+
+        @dp.message_handler(commands=['ok'])
+        async def __command_ok(message: types.Message):
+            pass
+
+        @dp.message_handler(commands=['fail'])
+        async def __command_fail(message: types.Message):
+            raise ValueError()
+
+        await dp.process_update(message_update("/ok"))
+        try:
+            raise KeyError()
+        except KeyError:
+            # Update handled while other exception is active isn't counted as failed
+            await dp.process_update(message_update("/ok"))
+        with pytest.raises(ValueError):
+            await dp.process_update(message_update("/fail"))
+        await (await bot.get_session()).close()
+
+    asyncio.run(main())
+    text = TM_Telemetry.prometheus()
+
+    assert 'telemonitor_handler_duration_seconds_count{handler="command_ok"} 2' in text
+    assert 'telemonitor_handler_errors_total{handler="command_ok"} 0' in text
+    assert 'telemonitor_handler_errors_total{handler="command_fail"} 1' in text
+    assert 'telemonitor_handler_duration_seconds_bucket{handler="command_ok",le="+Inf"} 2' in text
+
+
+def test_bot_api_calls_timed():
+    async def request(method, data=None, files=None, **kwargs):
+        if method == "sendMessage":
+            raise RetryAfter(1)
+        return True
+
+    async def main():
+        bot = Bot(TOKEN)
+        bot.request = request
+        TM_Telemetry.instrument_bot(bot)
+
+        await bot.request("deleteWebhook")
+        with pytest.raises(RetryAfter):
+            await bot.request("sendMessage", {"chat_id": 1, "text": "test"})
+        await (await bot.get_session()).close()
+
+    asyncio.run(main())
+    text = TM_Telemetry.prometheus()
+
+    assert 'telemonitor_api_request_duration_seconds_count{method="deleteWebhook"} 1' in text
+    assert 'telemonitor_api_throttled_total{method="sendMessage"} 1' in text
+    assert "sendMessage" in TM_Telemetry.render()
@@ -0,0 +1,90 @@
+"""
+Test webhook mode end-to-end with local server receiving POSTed updates
+"""
+import asyncio
+from types import SimpleNamespace
+
+from aiohttp.test_utils import TestServer, TestClient
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.webhook import get_new_configured_app
+
+from telemonitor import helpers as h
+from telemonitor.middlewares import TM_WhitelistMiddleware
+from telemonitor.extensions.webhook import skip_pending_updates
+
+
+def callback_update(user_id: int, data: str) -> dict:
+    return {
+        "update_id": 1,
+        "callback_query": {
+            "id": "42",
+            "chat_instance": "1",
+            "data": data,
+            "from": {"id": user_id, "is_bot": False, "first_name": "test"}
+        }
+    }
+
+
+def test_webhook_callback_answered_in_response(monkeypatch):
+    sent = []
+
+    async def send_message(chat_id, text, **kwargs):
+        sent.append((chat_id, text))
+
+    async def is_whitelisted_async(cls, user_id):
+        return user_id == 1
+
+    monkeypatch.setattr(h.TM_Whitelist, 'is_whitelisted', classmethod(lambda cls, user_id: user_id == 1))
+    monkeypatch.setattr(h.TM_Whitelist, 'is_whitelisted_async', classmethod(is_whitelisted_async))
+    monkeypatch.setattr(h, 'construct_sysinfo', lambda: "info")
+
+    async def post_updates():
+        bot = Bot(token="123456:test")
+        monkeypatch.setattr(bot, 'send_message', send_message)
+        dp = Dispatcher(bot)
+        dp.middleware.setup(TM_WhitelistMiddleware())
+        h.TM_ControlInlineKB(bot, dp, webhook=True)
+
+        async with TestClient(TestServer(get_new_configured_app(dp, '/telemonitor'))) as client:
+            whitelisted = await client.post('/telemonitor', json=callback_update(1, 'button-sysinfo-press'))
+            stranger = await client.post('/telemonitor', json=callback_update(2, 'button-sysinfo-press'))
+            # Sys info is sent after the response
+            for _ in range(100):
+                if sent:
+                    break
+                await asyncio.sleep(0.01)
+            result = (await whitelisted.json(), stranger.status, await stranger.text())
+
+        await (await bot.get_session()).close()
+        return result
+
+    whitelisted, stranger_status, stranger = asyncio.run(post_updates())
+
+    assert whitelisted == {"method": "answerCallbackQuery", "callback_query_id": "42"}
+    assert sent == [(1, "info")]
+    assert stranger_status == 200 and stranger == "ok"
+
+
+def test_pending_updates_skipped():
+    class FakeBot:
+        def __init__(self, pending: list):
+            self.pending = pending
+            self.calls = []
+
+        async def delete_webhook(self):
+            self.calls.append("delete_webhook")
+
+        async def get_updates(self, offset, timeout):
+            self.calls.append(offset)
+            if offset < 0:
+                return [SimpleNamespace(update_id=u) for u in self.pending[offset:]]
+            self.pending = [u for u in self.pending if u >= offset]
+            return []
+
+    bot = FakeBot([5, 6, 7])
+    assert asyncio.run(skip_pending_updates(bot))
+    assert bot.calls == ["delete_webhook", -1, 8] and bot.pending == []
+
+    bot = FakeBot([])
+    assert not asyncio.run(skip_pending_updates(bot))
+    assert bot.calls == ["delete_webhook", -1]
@@ -0,0 +1,100 @@
+"""
+Test whitelist index and early-reject middleware
+"""
+import json
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+
+from telemonitor import helpers as h
+from telemonitor.middlewares import TM_WhitelistMiddleware, get_update_user
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    monkeypatch.setattr(h.TM_Whitelist, '_TM_Whitelist__overwrite', None)
+    monkeypatch.setattr(h, 'PATH_CFG', str(tmp_path / 'config.json'))
+    monkeypatch.setattr(h.TM_Config, '_TM_Config__last_mod_time', None)
+    monkeypatch.setattr(h.TM_Whitelist, '_TM_Whitelist__index', frozenset())
+    monkeypatch.setattr(h.TM_Whitelist, '_TM_Whitelist__index_source', None)
+    monkeypatch.setattr(h.TM_Whitelist, '_TM_Whitelist__last_check_time', None)
+    monkeypatch.setattr(h.TM_Whitelist, '_TM_Whitelist__check_interval', h.WHITELIST_CHECK_INTERVAL)
+
+    def write(users: list, interval: float = 0):
+        cfg = json.loads(json.dumps(h.DEF_CFG))
+        cfg["bot"]["whitelisted_users"] = users
+        cfg["bot"]["whitelist_check_interval"] = interval
+        h.TM_Config.write(cfg)
+        # Force reload, mtime resolution of some filesystems is too coarse for this test
+        monkeypatch.setattr(h.TM_Config, '_TM_Config__last_mod_time', None)
+
+    return write
+
+
+def test_index_lookup(config):
+    config([1, 2])
+
+    assert h.TM_Whitelist.is_whitelisted(1)
+    assert not h.TM_Whitelist.is_whitelisted(3)
+
+
+def test_index_rebuilt_on_change(config):
+    config([1])
+    assert not h.TM_Whitelist.is_whitelisted(2)
+
+    config([2])
+    assert h.TM_Whitelist.is_whitelisted(2)
+    assert not h.TM_Whitelist.is_whitelisted(1)
+
+
+def test_index_refresh_throttled(config):
+    config([1], interval=3600)
+    assert h.TM_Whitelist.is_whitelisted(1)
+
+    config([2], interval=3600)
+    assert not h.TM_Whitelist.is_whitelisted(2)
+
+
+def test_middleware_rejects(config):
+    config([1])
+    middleware = TM_WhitelistMiddleware()
+
+    def update(user_id: int) -> types.Update:
+        return types.Update(**{
+            "update_id": 1,
+            "message": {"message_id": 1, "date": 0, "chat": {"id": user_id, "type": "private"}, "from": {"id": user_id, "is_bot": False, "first_name": "test"}, "text": "/start"}
+        })
+
+    asyncio.run(middleware.on_pre_process_update(update(1), {}))
+    for _ in range(2):
+        with pytest.raises(CancelHandler):
+            asyncio.run(middleware.on_pre_process_update(update(2), {}))
+
+    assert middleware.rejected[2] == 2
+    assert middleware.rejected_total == 2
+
+
+def test_concurrent_checks_wait_for_refresh(config):
+    config([1])
+
+    async def main():
+        # First checks arrive before the index was ever loaded
+        return await asyncio.gather(*(h.TM_Whitelist.is_whitelisted_async(1) for _ in range(10)))
+
+    assert asyncio.run(main()) == [True] * 10
+
+
+def test_update_user_on_old_aiogram():
+    # Updates of aiogram 2.9 don't have member and join request fields
+    user = SimpleNamespace(id=1)
+    fields = ("message", "edited_message", "callback_query", "inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query", "poll_answer")
+    update = SimpleNamespace(**dict.fromkeys(fields))
+    update.callback_query = SimpleNamespace(from_user=user)
+    assert get_update_user(update) is user
+
+    update.callback_query = None
+    update.poll_answer = SimpleNamespace(user=user)
+    assert get_update_user(update) is user